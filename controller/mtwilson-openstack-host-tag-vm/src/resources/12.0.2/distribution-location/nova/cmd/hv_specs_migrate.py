@@ -0,0 +1,151 @@
+"""
+  CLI interface for the online migrations of the CIT tables.
+
+  Runs the steps of nova.db.sqlalchemy.hv_specs_migration on the live
+  database. The expand and backfill phases are run when no phase is given,
+  contract only when asked for, once every nova service runs the new code.
+  --dry-run lists the pending steps with the number of rows they would
+  read or rewrite, without changing anything:
+
+    python -m nova.cmd.hv_specs_migrate --config-file /etc/nova/nova.conf \
+        [--phase expand|backfill|contract] [--dry-run] [--batch-size N] \
+        [--max-rows N] [--sleep SECONDS] [--allow-blocking-ddl]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from oslo_config import cfg
+
+from nova import config
+from nova.db.sqlalchemy import hv_specs_migration
+from nova.i18n import _
+
+
+cli_opts = [
+    cfg.StrOpt('phase',
+               choices=hv_specs_migration.PHASES,
+               help='Only run the steps of this phase, expand and backfill '
+                    'when not set'),
+    cfg.BoolOpt('dry-run',
+                default=False,
+                help='List the pending steps and the number of rows they '
+                     'would read or rewrite'),
+    cfg.IntOpt('batch-size',
+               default=1000,
+               help='Number of rows migrated per transaction'),
+    cfg.IntOpt('max-rows',
+               help='Maximum number of rows migrated per step, all of them '
+                    'when not set'),
+    cfg.FloatOpt('sleep',
+                 default=0,
+                 help='Seconds waited between two batches'),
+    cfg.BoolOpt('allow-blocking-ddl',
+                default=False,
+                help='Run the schema changes the database cannot run online '
+                     'instead of failing, in a maintenance window'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(cli_opts)
+
+# Seconds between two progress lines of a batched step
+PROGRESS_INTERVAL = 10
+
+
+class Progress(object):
+    """Prints the progress of the batched steps."""
+
+    def __init__(self):
+        self.step = None
+        self.started = None
+        self.printed = None
+
+    def __call__(self, step, rows_done, rows_total):
+        now = time.time()
+        if step is not self.step:
+            self.step = step
+            self.started = self.printed = now
+        elif (rows_done < rows_total and
+              now - self.printed < PROGRESS_INTERVAL):
+            return
+        self.printed = now
+
+        rate = rows_done / max(now - self.started, 0.001)
+        print(_("%(step)s: %(done)d of %(total)d rows (%(percent).1f%%), "
+                "%(rate).0f rows/s, %(left).0f s left") %
+              {'step': step.name,
+               'done': rows_done,
+               'total': rows_total,
+               'percent': 100.0 * rows_done / max(rows_total, 1),
+               'rate': rate,
+               'left': (rows_total - rows_done) / max(rate, 1)})
+        sys.stdout.flush()
+
+
+def main():
+    config.parse_args(sys.argv)
+
+    if CONF.batch_size < 1:
+        print(_("Must supply a positive value for batch_size"))
+        return 2
+    if CONF.max_rows is not None and CONF.max_rows < 1:
+        print(_("Must supply a positive value for max_rows"))
+        return 2
+    if CONF.sleep < 0:
+        print(_("Must supply a non-negative value for sleep"))
+        return 2
+
+    if CONF.phase:
+        phases = (CONF.phase,)
+    elif CONF.dry_run:
+        phases = hv_specs_migration.PHASES
+    else:
+        phases = (hv_specs_migration.EXPAND, hv_specs_migration.BACKFILL)
+
+    migration = hv_specs_migration.Migration(
+        batch_size=CONF.batch_size,
+        max_rows=CONF.max_rows,
+        sleep=CONF.sleep,
+        online=not CONF.allow_blocking_ddl,
+        progress=Progress())
+
+    for step in hv_specs_migration.get_steps(phases):
+        if not step.pending(migration):
+            print(_("%(phase)-8s %(step)s: done") %
+                  {'phase': step.phase, 'step': step.name})
+            continue
+
+        print(_("%(phase)-8s %(step)s: %(description)s, ~%(rows)d rows") %
+              {'phase': step.phase,
+               'step': step.name,
+               'description': step.describe(migration),
+               'rows': step.estimate(migration)})
+        if CONF.dry_run:
+            continue
+
+        started = time.time()
+        try:
+            rows = step.run(migration)
+        except Exception as exc:
+            print(_("%(step)s failed : %(error)s") %
+                  {'step': step.name, 'error': exc})
+            if step.phase == hv_specs_migration.EXPAND:
+                print(_("Rerun with --allow-blocking-ddl in a maintenance "
+                        "window if the database cannot run it online"))
+            return 1
+        seconds = time.time() - started
+        if rows is None:
+            print(_("%(step)s: done in %(seconds).1f s") %
+                  {'step': step.name, 'seconds': seconds})
+        else:
+            print(_("%(step)s: %(rows)d rows migrated in %(seconds).1f s") %
+                  {'step': step.name, 'rows': rows, 'seconds': seconds})
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,518 @@
+"""Online migrations of the CIT tables.
+
+change-script.py only creates the CIT tables. The later changes of the
+schema and of the rows of an existing hv_specs are the steps below, run
+on the live database by nova.cmd.hv_specs_migrate in three phases:
+
+  expand    additive DDL only, the tables, columns and indexes of the
+            models missing from the database. Run online, with
+            ALGORITHM=INPLACE, LOCK=NONE on MySQL and CONCURRENTLY on
+            PostgreSQL, so that reads and writes go on meanwhile.
+  backfill  data migrations of the existing rows, in bounded batches of
+            short transactions.
+  contract  removal of what the code before the expand relied on, once
+            every nova service runs the new code.
+
+Every step finds out by itself what is left to do, an interrupted run is
+resumed by running it again.
+"""
+
+import time
+import zlib
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import six
+from sqlalchemy import and_
+from sqlalchemy import or_
+from sqlalchemy import sql
+from sqlalchemy.engine import reflection
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.schema import CreateIndex
+
+from nova.db.sqlalchemy import api as db_api
+from nova.db.sqlalchemy import models
+from nova import exception
+from nova.i18n import _
+from nova.i18n import _LW
+from nova.openstack.common import host_trust_utils
+
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+EXPAND = 'expand'
+BACKFILL = 'backfill'
+CONTRACT = 'contract'
+PHASES = (EXPAND, BACKFILL, CONTRACT)
+
+
+def _estimate_table_rows(conn, table_name):
+    """Number of rows of a table, from the statistics when there are some.
+
+    A COUNT(*) would scan the whole table on MySQL and PostgreSQL.
+    """
+    if conn.dialect.name == 'mysql':
+        rows = conn.execute(sql.text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name"),
+            name=table_name).scalar()
+    elif conn.dialect.name == 'postgresql':
+        rows = conn.execute(sql.text(
+            "SELECT reltuples FROM pg_class WHERE relname = :name"),
+            name=table_name).scalar()
+    else:
+        quote = conn.dialect.identifier_preparer.quote
+        rows = conn.execute('SELECT COUNT(*) FROM %s'
+                            % quote(table_name)).scalar()
+    return int(rows or 0)
+
+
+class Migration(object):
+    """Database and options of a run of the migration steps.
+
+    :param batch_size: rows migrated per transaction by the batched steps
+    :param max_rows: maximum number of rows migrated per batched step, all
+                     of them when None
+    :param sleep: seconds waited between two batches, to let the replicas
+                  catch up
+    :param online: refuse the DDL the database cannot run without locking
+                   the table, instead of running it blocking
+    :param progress: called with (step, rows done, rows estimated) after
+                     every batch
+    """
+
+    def __init__(self, engine=None, batch_size=1000, max_rows=None, sleep=0,
+                 online=True, progress=None):
+        self.engine = engine or db_api.get_engine()
+        self.conn = self.engine.connect()
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.sleep = sleep
+        self.online = online
+        self.progress = progress
+
+    def inspector(self):
+        # Not cached, the steps change the schema it reflects
+        return reflection.Inspector.from_engine(self.engine)
+
+    def has_table(self, table_name):
+        return table_name in self.inspector().get_table_names()
+
+    def execute_ddl(self, statement):
+        LOG.info("Running %s" % statement)
+        if self.engine.dialect.name == 'postgresql':
+            # CREATE INDEX CONCURRENTLY cannot run in a transaction
+            conn = self.engine.connect().execution_options(
+                isolation_level='AUTOCOMMIT')
+            try:
+                conn.execute(statement)
+            finally:
+                conn.close()
+        else:
+            self.conn.execute(statement)
+
+
+class Step(object):
+    """A migration step of the CIT tables."""
+
+    phase = None
+    name = None
+
+    def describe(self, migration):
+        """What the step changes, for the dry run."""
+        raise NotImplementedError()
+
+    def pending(self, migration):
+        """Whether the step has anything left to do."""
+        raise NotImplementedError()
+
+    def estimate(self, migration):
+        """Number of rows the step reads or rewrites."""
+        raise NotImplementedError()
+
+    def run(self, migration):
+        """Runs the step.
+
+        :returns: number of rows migrated, None for the schema changes
+        """
+        raise NotImplementedError()
+
+
+class CreateTable(Step):
+    """Creates a table of the models that does not exist yet."""
+
+    phase = EXPAND
+
+    def __init__(self, table_name):
+        self.table = models.BASE.metadata.tables[table_name]
+        self.name = '%s_table' % table_name
+
+    def describe(self, migration):
+        return 'create table %s' % self.table.name
+
+    def pending(self, migration):
+        return not migration.has_table(self.table.name)
+
+    def estimate(self, migration):
+        return 0
+
+    def run(self, migration):
+        self.table.create(migration.engine, checkfirst=True)
+
+
+class AddColumns(Step):
+    """Adds the columns of a model missing from its table.
+
+    The columns are added in a single statement, which MySQL runs as one
+    in place rebuild of the table. Only nullable columns can be added
+    online, a NOT NULL column needs a change-script.py.
+    """
+
+    phase = EXPAND
+
+    def __init__(self, table_name, model_table_name=None):
+        self.table_name = table_name
+        # shadow_hv_specs has the columns of hv_specs
+        self.model_table = models.BASE.metadata.tables[
+            model_table_name or table_name]
+        self.name = '%s_columns' % table_name
+
+    def missing_columns(self, migration):
+        if not migration.has_table(self.table_name):
+            return []
+        existing = [column['name'] for column in
+                    migration.inspector().get_columns(self.table_name)]
+        return [column for column in self.model_table.columns
+                if column.name not in existing and column.nullable]
+
+    def describe(self, migration):
+        names = [column.name for column in self.missing_columns(migration)]
+        return 'add %s to %s' % (', '.join(names) or 'no column',
+                                 self.table_name)
+
+    def pending(self, migration):
+        return bool(self.missing_columns(migration))
+
+    def estimate(self, migration):
+        # Only MySQL rewrites the rows to add a nullable column
+        if migration.engine.dialect.name != 'mysql':
+            return 0
+        return _estimate_table_rows(migration.conn, self.table_name)
+
+    def run(self, migration):
+        dialect = migration.engine.dialect
+        table = dialect.identifier_preparer.quote(self.table_name)
+        clauses = ['ADD COLUMN %s' % CreateColumn(column).compile(
+                       dialect=dialect)
+                   for column in self.missing_columns(migration)]
+        if dialect.name == 'sqlite':
+            # One column per ALTER TABLE, without any table copy
+            for clause in clauses:
+                migration.execute_ddl('ALTER TABLE %s %s' % (table, clause))
+            return
+
+        if dialect.name == 'mysql' and migration.online:
+            clauses.extend(['ALGORITHM=INPLACE', 'LOCK=NONE'])
+        migration.execute_ddl('ALTER TABLE %s %s' % (table,
+                                                    ', '.join(clauses)))
+
+
+class CreateIndexes(Step):
+    """Creates the indexes of a model missing from its table."""
+
+    phase = EXPAND
+
+    def __init__(self, table_name):
+        self.table = models.BASE.metadata.tables[table_name]
+        self.name = '%s_indexes' % table_name
+
+    def missing_indexes(self, migration):
+        if not migration.has_table(self.table.name):
+            return []
+        existing = [index['name'] for index in
+                    migration.inspector().get_indexes(self.table.name)]
+        return sorted([index for index in self.table.indexes
+                       if index.name not in existing],
+                      key=lambda index: index.name)
+
+    def describe(self, migration):
+        names = [index.name for index in self.missing_indexes(migration)]
+        return 'create %s on %s' % (', '.join(names) or 'no index',
+                                    self.table.name)
+
+    def pending(self, migration):
+        return bool(self.missing_indexes(migration))
+
+    def estimate(self, migration):
+        # Every index build reads the whole table
+        return (len(self.missing_indexes(migration)) *
+                _estimate_table_rows(migration.conn, self.table.name))
+
+    def run(self, migration):
+        dialect = migration.engine.dialect
+        for index in self.missing_indexes(migration):
+            statement = '%s' % CreateIndex(index).compile(dialect=dialect)
+            if migration.online and dialect.name == 'mysql':
+                statement += ' ALGORITHM=INPLACE LOCK=NONE'
+            elif migration.online and dialect.name == 'postgresql':
+                statement = statement.replace('CREATE INDEX',
+                                              'CREATE INDEX CONCURRENTLY', 1)
+            migration.execute_ddl(statement)
+
+
+class BatchedStep(Step):
+    """Migrates the rows of hv_specs matching condition(), batch by batch.
+
+    The ids of a batch are read in order after the last id of the previous
+    batch, then migrate_batch() changes them in its own transaction. The
+    updates re-check the condition, a row changed in between by a trust
+    report push is left to the push.
+    """
+
+    table = models.BASE.metadata.tables['hv_specs']
+
+    def condition(self):
+        raise NotImplementedError()
+
+    def unexpanded_condition(self):
+        """The rows to migrate while hv_specs misses columns of the model.
+
+        None when there are none, the dry run estimates the rows of the
+        backfill before the expand phase added the columns.
+        """
+        return None
+
+    def expanded(self, migration):
+        existing = [column['name'] for column in
+                    migration.inspector().get_columns(self.table.name)]
+        return all(column.name in existing for column in self.table.columns)
+
+    def columns(self):
+        return [self.table.c.id]
+
+    def migrate_batch(self, migration, rows):
+        raise NotImplementedError()
+
+    def pending(self, migration):
+        if not self.expanded(migration):
+            return self.unexpanded_condition() is not None
+        query = sql.select([self.table.c.id], self.condition()).limit(1)
+        return migration.conn.execute(query).first() is not None
+
+    def estimate(self, migration):
+        if self.expanded(migration):
+            condition = self.condition()
+        else:
+            condition = self.unexpanded_condition()
+            if condition is None:
+                return 0
+        query = sql.select([sql.func.count()]).select_from(self.table).\
+                    where(condition)
+        return migration.conn.execute(query).scalar()
+
+    def run(self, migration):
+        if not self.expanded(migration):
+            raise exception.NovaException(
+                _("%s needs the columns added by the expand phase")
+                % self.name)
+
+        conn = migration.conn
+        total = self.estimate(migration)
+        if migration.max_rows is not None:
+            total = min(total, migration.max_rows)
+
+        rows_done = 0
+        last_id = 0
+        while migration.max_rows is None or rows_done < migration.max_rows:
+            if migration.max_rows is None:
+                limit = migration.batch_size
+            else:
+                limit = min(migration.batch_size,
+                            migration.max_rows - rows_done)
+
+            query = sql.select(self.columns(),
+                               and_(self.table.c.id > last_id,
+                                    self.condition())).\
+                        order_by(self.table.c.id).limit(limit)
+            rows = conn.execute(query).fetchall()
+            if not rows:
+                break
+
+            with conn.begin():
+                self.migrate_batch(migration, rows)
+            last_id = rows[-1].id
+            rows_done += len(rows)
+            if migration.progress is not None:
+                migration.progress(self, rows_done, max(total, rows_done))
+
+            if len(rows) < limit:
+                break
+            if migration.sleep:
+                time.sleep(migration.sleep)
+
+        return rows_done
+
+
+class TrustReportSummary(BatchedStep):
+    """Fills trusted, valid_to and the asset tags of the trust reports.
+
+    The reports stored before these columns existed only get them on their
+    next push, until then the trusted hosts queries do not see them.
+    """
+
+    phase = BACKFILL
+    name = 'trust_report_summary'
+    tags_table = models.BASE.metadata.tables['hv_spec_tags']
+
+    def __init__(self):
+        self.trust_utils = host_trust_utils.HostTrustUtils()
+        self.key = self.trust_utils.getTrustReportKey()
+
+    def describe(self, migration):
+        return ('set trusted, valid_to, tags_hash and hv_spec_tags of the '
+                '%s rows' % self.key)
+
+    def condition(self):
+        table = self.table
+        return and_(table.c.key == self.key,
+                    table.c.deleted == 0,
+                    or_(table.c.trusted == sql.null(),
+                        table.c.tags_hash == sql.null()))
+
+    def unexpanded_condition(self):
+        return and_(self.table.c.key == self.key, self.table.c.deleted == 0)
+
+    def columns(self):
+        return [self.table.c.id, self.table.c.compute_node_id,
+                self.table.c.value, self.table.c.value_blob]
+
+    def run(self, migration):
+        if self.trust_utils.verification == 'on':
+            # Read through rootwrap once for the whole run, verifySignature
+            # then reuses it. A key that cannot be read stops the step here
+            # rather than marking every report untrusted
+            self.trust_utils.getPublicKey()
+        return super(TrustReportSummary, self).run(migration)
+
+    def migrate_batch(self, migration, rows):
+        table = self.table
+        tags_table = self.tags_table
+        for row in rows:
+            value = row.value
+            if value is None and row.value_blob is not None:
+                value = zlib.decompress(row.value_blob).decode('utf-8')
+            try:
+                summary = self.trust_utils.getTrustSummary(value)
+            except Exception:
+                LOG.warning(_LW("Invalid trust report for compute node : "
+                                "%s"), row.compute_node_id)
+                summary = None
+            columns = self.trust_utils.getSummaryColumns(summary)
+
+            result = migration.conn.execute(
+                table.update().
+                where(and_(table.c.id == row.id, self.condition())).
+                values(trusted=columns['trusted'],
+                       valid_to=columns['valid_to'],
+                       tags_hash=db_api._hvspec_tags_hash(
+                           columns['asset_tags'])))
+            if not result.rowcount:
+                continue
+
+            migration.conn.execute(tags_table.delete().
+                                   where(tags_table.c.hv_spec_id == row.id))
+            tags = [{'hv_spec_id': row.id, 'name': name, 'value': tag_value}
+                    for name, tag_values in columns['asset_tags'].items()
+                    for tag_value in set(tag_values)]
+            if tags:
+                migration.conn.execute(tags_table.insert(), tags)
+
+
+class TrustReportCompression(BatchedStep):
+    """Copies the text trust reports to value_blob, compressed.
+
+    Only with trust_report_storage = compressed. value is kept until the
+    contract phase, so that the services not restarted yet still read it.
+    """
+
+    phase = BACKFILL
+    name = 'trust_report_compression'
+
+    def describe(self, migration):
+        return 'compress the text %s values into value_blob' % ', '.join(
+            db_api.HVSPEC_COMPRESSED_KEYS)
+
+    def condition(self):
+        table = self.table
+        return and_(table.c.key.in_(db_api.HVSPEC_COMPRESSED_KEYS),
+                    table.c.deleted == 0,
+                    table.c.value != sql.null(),
+                    table.c.value_blob == sql.null())
+
+    def unexpanded_condition(self):
+        table = self.table
+        return and_(table.c.key.in_(db_api.HVSPEC_COMPRESSED_KEYS),
+                    table.c.deleted == 0,
+                    table.c.value != sql.null())
+
+    def columns(self):
+        return [self.table.c.id, self.table.c.value]
+
+    def pending(self, migration):
+        if CONF.trusted_computing.trust_report_storage != 'compressed':
+            return False
+        return super(TrustReportCompression, self).pending(migration)
+
+    def migrate_batch(self, migration, rows):
+        table = self.table
+        for row in rows:
+            value = row.value
+            if isinstance(value, six.text_type):
+                value = value.encode('utf-8')
+            migration.conn.execute(
+                table.update().
+                where(and_(table.c.id == row.id, self.condition())).
+                values(value_blob=zlib.compress(value)))
+
+
+class TrustReportTextValues(BatchedStep):
+    """Clears the text copy of the trust reports compressed by the backfill.
+
+    HVMetadata.get_value() then inflates value_blob.
+    """
+
+    phase = CONTRACT
+    name = 'trust_report_text_values'
+
+    def describe(self, migration):
+        return 'clear the value of the %s rows compressed into value_blob' % (
+            ', '.join(db_api.HVSPEC_COMPRESSED_KEYS))
+
+    def condition(self):
+        table = self.table
+        return and_(table.c.key.in_(db_api.HVSPEC_COMPRESSED_KEYS),
+                    table.c.value != sql.null(),
+                    table.c.value_blob != sql.null())
+
+    def migrate_batch(self, migration, rows):
+        table = self.table
+        migration.conn.execute(
+            table.update().
+            where(and_(table.c.id.in_([row.id for row in rows]),
+                       self.condition())).
+            values(value=None))
+
+
+def get_steps(phases=PHASES):
+    """The migration steps of the phases, in the order they are run."""
+    steps = [
+        CreateTable('hv_spec_tags'),
+        AddColumns('hv_specs'),
+        AddColumns(db_api._SHADOW_TABLE_PREFIX + 'hv_specs', 'hv_specs'),
+        CreateIndexes('hv_specs'),
+        TrustReportSummary(),
+        TrustReportCompression(),
+        TrustReportTextValues(),
+    ]
+    return [step for step in steps if step.phase in phases]
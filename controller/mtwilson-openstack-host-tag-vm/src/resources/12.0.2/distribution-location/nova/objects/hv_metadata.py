@@ -8,30 +8,60 @@ from nova import exception
 from nova import objects
 from nova.objects import base
 from nova.objects import fields
+from nova.openstack.common import host_trust_utils
+from nova import utils
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
+# Fields set on the HVMetadata returned by
+# HVMetadataList.get_keys_by_compute_node_ids, the others are loaded on
+# first access
+HVMETADATA_KEY_FIELDS = ('id', 'compute_node_id', 'key', 'updated_at')
+
 
 @base.NovaObjectRegistry.register
 class HVMetadata(base.NovaPersistentObject, base.NovaObject,
                  base.NovaObjectDictCompat):
     # Version 1.0: Initial version
-    VERSION = '1.0'
+    # Version 1.1: Added trusted and valid_to
+    # Version 1.2: Added asset_tags
+    VERSION = '1.2'
 
     fields = {
         'id': fields.IntegerField(read_only=True),
         'compute_node_id': fields.IntegerField(),
         'key': fields.StringField(nullable=False),
-        'value': fields.StringField(nullable=True)
+        'value': fields.StringField(nullable=True),
+        'trusted': fields.BooleanField(nullable=True),
+        'valid_to': fields.DateTimeField(nullable=True),
+        # Written to hv_spec_tags on create and save, not read back
+        'asset_tags': fields.DictOfListOfStringsField(nullable=True),
         }
 
+    def obj_make_compatible(self, primitive, target_version):
+        super(HVMetadata, self).obj_make_compatible(primitive, target_version)
+        target_version = utils.convert_version_to_tuple(target_version)
+        if target_version < (1, 1):
+            primitive.pop('trusted', None)
+            primitive.pop('valid_to', None)
+        if target_version < (1, 2):
+            primitive.pop('asset_tags', None)
+
     @staticmethod
     #Converts the db object into HVMetadata object
-    def _from_db_object(context, hvspec, db_hvspec):
+    def _from_db_object(context, hvspec, db_hvspec, only_fields=None):
         for key in hvspec.fields:
+            if key == 'asset_tags':
+                continue
+            if only_fields is not None and key not in only_fields:
+                continue
             #retrieve the value from db object
-            value = db_hvspec[key]
+            if key == 'value':
+                #inflated when stored in the compressed format
+                value = db_hvspec.get_value()
+            else:
+                value = getattr(db_hvspec, key)
             #store the same value in HVMetadata object
             hvspec[key] = value
 
@@ -40,8 +70,29 @@ class HVMetadata(base.NovaPersistentObject, base.NovaObject,
         return hvspec
 
     def obj_load_attr(self, attrname):
-        self.id = self.get_by_id(self.id)
-        self.obj_reset_changes(['id'])
+        if attrname == 'asset_tags':
+            # Not read back from hv_spec_tags
+            self.asset_tags = None
+            self.obj_reset_changes(['asset_tags'])
+            return
+
+        if not self._context:
+            raise exception.OrphanedObjectError(method='obj_load_attr',
+                                                objtype=self.obj_name())
+        if not self.obj_attr_is_set('id'):
+            raise exception.ObjectActionError(
+                action='obj_load_attr', reason='attribute id not set')
+
+        LOG.debug("Lazy-loading '%s' on HVMetadata %s" % (attrname, self.id))
+
+        # All the unset fields are loaded at once, a caller reading value
+        # usually reads the rest of the row as well
+        loaded = HVMetadata.get_by_id(self._context, self.id)
+        unset = [field for field in self.fields
+                 if field != 'asset_tags' and not self.obj_attr_is_set(field)]
+        for field in unset:
+            self[field] = loaded[field]
+        self.obj_reset_changes(unset)
 
     @base.remotable
     def create(self):
@@ -76,11 +127,81 @@ class HVMetadata(base.NovaPersistentObject, base.NovaObject,
         db_hvspec = db.hvspec_get_by_compute_node_id_and_key(context, compute_node_id, key)
         return cls._from_db_object(context, cls(), db_hvspec)
 
+    @staticmethod
+    def _get_summary(trust_utils, hvspec):
+        # trusted, valid_to and asset_tags stored along with the value,
+        # parsed from the trust report as the os-hypervisors API does when
+        # the object does not carry them. hvspec_set clears the columns of
+        # a row written without a summary
+        summary_fields = [field for field in ('trusted', 'valid_to',
+                                              'asset_tags')
+                          if hvspec.obj_attr_is_set(field)]
+        if summary_fields:
+            return dict((field, hvspec[field]) for field in summary_fields)
+        if hvspec.key != trust_utils.getTrustReportKey():
+            return None
+
+        try:
+            summary = trust_utils.getTrustSummary(hvspec.value)
+        except Exception:
+            LOG.exception("Invalid trust report for compute node : %s"
+                          % hvspec.compute_node_id)
+            summary = None
+        return trust_utils.getSummaryColumns(summary)
+
+    @classmethod
+    def save_all(cls, context, hvspecs):
+        """Creates or updates many HVMetadata with one database call.
+
+        Through the conductor only the ids of the rows are sent back and
+        set on the objects, the other fields keep their local values.
+        """
+        triples = [(hvspec.compute_node_id, hvspec.key, hvspec.value)
+                   for hvspec in hvspecs]
+
+        trust_utils = host_trust_utils.HostTrustUtils()
+        summaries = {}
+        for hvspec in hvspecs:
+            summary = cls._get_summary(trust_utils, hvspec)
+            if summary is not None:
+                summaries.setdefault(hvspec.compute_node_id,
+                                     {})[hvspec.key] = summary
+
+        if not cls.indirection_api:
+            values = {}
+            for compute_node_id, key, value in triples:
+                values.setdefault(compute_node_id, {})[key] = value
+            stored = dict(((db_hvspec.compute_node_id, db_hvspec.key),
+                           db_hvspec)
+                          for db_hvspec in db.hvspec_set(
+                              context, values, summaries=summaries))
+            for hvspec in hvspecs:
+                cls._from_db_object(
+                    context, hvspec,
+                    stored[(hvspec.compute_node_id, hvspec.key)])
+            return hvspecs
+
+        ids = HVMetadataList.set_values(context, triples,
+                                        summaries=summaries)
+        for hvspec, hvspec_id in zip(hvspecs, ids):
+            if not hvspec.obj_attr_is_set('id'):
+                hvspec.id = hvspec_id
+            hvspec._context = context
+            hvspec.obj_reset_changes()
+        return hvspecs
+
 
 @base.NovaObjectRegistry.register
 class HVMetadataList(base.ObjectListBase, base.NovaObject):
     # Version 1.0: Initial version
-    VERSION = '1.0'
+    # Version 1.1: HVMetadata version 1.1
+    # Version 1.2: HVMetadata version 1.2, added
+    #              get_trusted_compute_node_ids and get_asset_tags
+    # Version 1.3: Added get_by_compute_node_ids and get_by_keys
+    # Version 1.4: Added get_keys_by_compute_node_ids
+    # Version 1.5: Added set
+    # Version 1.6: Added set_values
+    VERSION = '1.6'
     fields = {
         'objects': fields.ListOfObjectsField('HVMetadata'),
         }
@@ -93,22 +214,90 @@ class HVMetadataList(base.ObjectListBase, base.NovaObject):
 
     @base.remotable_classmethod
     def get_by_compute_node_id(cls, context, compute_node_id):
-        try:
-            db_hvspecs = db.hvspec_get_by_compute_node_id(context,
-                                                           compute_node_id)
-
-        except exception.ComputeHostNotFound(host=compute_node_id):
-            db_hvspecs = []
+        # Empty when the compute node has no metadata, nothing is raised
+        db_hvspecs = db.hvspec_get_by_compute_node_id(context,
+                                                       compute_node_id)
         return base.obj_make_list(context, cls(context), objects.HVMetadata,
                                   db_hvspecs)
 
     @base.remotable_classmethod
     def get_by_key(cls, context, key):
-        try:
-            db_hvspecs = db.hvspec_get_by_key(context,
-                                               key)
+        # Empty when no compute node has the key, nothing is raised
+        db_hvspecs = db.hvspec_get_by_key(context, key)
+        return base.obj_make_list(context, cls(context), objects.HVMetadata,
+                                  db_hvspecs)
 
-        except exception.HVMetadataNotFound(host=key):
-            db_hvspecs = []
+    @base.remotable_classmethod
+    def get_by_compute_node_ids(cls, context, compute_node_ids, keys=None):
+        db_hvspecs = db.hvspec_get_by_compute_node_ids_and_keys(
+            context, compute_node_ids=compute_node_ids, keys=keys)
         return base.obj_make_list(context, cls(context), objects.HVMetadata,
                                   db_hvspecs)
+
+    @base.remotable_classmethod
+    def get_by_keys(cls, context, keys, compute_node_ids=None):
+        db_hvspecs = db.hvspec_get_by_compute_node_ids_and_keys(
+            context, compute_node_ids=compute_node_ids, keys=keys)
+        return base.obj_make_list(context, cls(context), objects.HVMetadata,
+                                  db_hvspecs)
+
+    @base.remotable_classmethod
+    def set(cls, context, hvspecs, summaries=None):
+        """Creates or updates the metadata of one or many compute nodes.
+
+        :param hvspecs: dict of compute node id to dict of key to value
+        :param summaries: dict of compute node id to dict of key to the
+                          trusted, valid_to and asset_tags of the value
+        """
+        db_hvspecs = db.hvspec_set(context, hvspecs, summaries=summaries)
+        return base.obj_make_list(context, cls(context), objects.HVMetadata,
+                                  db_hvspecs)
+
+    @base.remotable_classmethod
+    def set_values(cls, context, triples, summaries=None):
+        """Creates or updates (compute node id, key, value) triples.
+
+        :returns: the ids of the stored rows, in the order of the triples
+        """
+        return db.hvspec_set_values(context, triples, summaries=summaries)
+
+    @base.remotable_classmethod
+    def get_keys_by_compute_node_ids(cls, context, compute_node_ids):
+        """Returns the metadata of the compute nodes without their values.
+
+        Only the HVMETADATA_KEY_FIELDS are read from the database, the
+        value and the other fields are loaded when first accessed.
+        """
+        db_hvspecs = db.hvspec_get_keys_by_compute_node_ids(context,
+                                                             compute_node_ids)
+        hvspec_list = cls(context)
+        hvspec_list.objects = [
+            objects.HVMetadata._from_db_object(
+                context, objects.HVMetadata(context), db_hvspec,
+                only_fields=HVMETADATA_KEY_FIELDS)
+            for db_hvspec in db_hvspecs]
+        hvspec_list._context = context
+        hvspec_list.obj_reset_changes()
+        return hvspec_list
+
+    def group_by_compute_node_id(self, compute_node_ids=()):
+        """Returns a dict of compute node id to list of HVMetadata.
+
+        Every id of compute_node_ids is present, with an empty list for
+        the compute nodes without metadata.
+        """
+        grouped = dict((compute_node_id, []) for compute_node_id in
+                       compute_node_ids)
+        for hvspec in self.objects:
+            grouped.setdefault(hvspec.compute_node_id, []).append(hvspec)
+        return grouped
+
+    @base.remotable_classmethod
+    def get_trusted_compute_node_ids(cls, context, key, tags=None,
+                                     valid_until=None):
+        return db.hvspec_get_trusted_compute_node_ids(context, key, tags=tags,
+                                                      valid_until=valid_until)
+
+    @base.remotable_classmethod
+    def get_asset_tags(cls, context, key):
+        return db.hvspec_tag_get_all(context, key)
@@ -1,12 +1,16 @@
 from nova import exception
 from nova import context
 from nova import utils
-from nova import db
+from nova.openstack.common import asset_tag_utils
+from nova.openstack.common import trust_filter_metrics
+from nova.openstack.common import trust_report_backend
 
 from oslo_config import cfg
 from oslo_log import log as logging
 
+import json
 import jwt
+import time
 from cryptography.x509 import load_pem_x509_certificate
 from cryptography.hazmat.backends import default_backend
 
@@ -30,6 +34,10 @@ trust_group = cfg.OptGroup(name='trusted_computing', title='Trust parameters')
 CONF.register_group(trust_group)
 CONF.register_opts(trusted_opts, group=trust_group)
 
+# Seconds during which a signature that does not verify is not a reason to
+# read the hub public key again
+PUBLIC_KEY_RELOAD_INTERVAL = 60
+
 
 class HostTrustUtils():
 
@@ -38,14 +46,38 @@ class HostTrustUtils():
         self.algorithm = CONF.trusted_computing.signature_algorithm
         self.key = CONF.trusted_computing.attestation_hub_public_key
         self.admin = context.get_admin_context()
+        self.backend = trust_report_backend.get_backend()
+        self.public_key = None
+        self.public_key_read_at = None
+
 
+    def getPublicKey(self, metrics=trust_filter_metrics.NULL_METRICS,
+                     reload=False):
+        # The key is only readable by root, it is read once through rootwrap
+        # rather than for every trust report verified
+        if self.public_key is None or reload:
+            with metrics.phase('public_key_read'):
+                self.public_key = utils.execute('cat', self.key, run_as_root=True, check_exit_code=[0])[0]
+            self.public_key_read_at = time.time()
+        return self.public_key
 
-    def verifySignature(self, signed_trust_report):
+
+    def verifySignature(self, signed_trust_report,
+                        metrics=trust_filter_metrics.NULL_METRICS):
         try:
             LOG.info("key : %s" % self.key)
             LOG.info("algorithm : %s" % self.algorithm)
-            public_key = utils.execute('cat', self.key, run_as_root=True, check_exit_code=[0])[0]
-            trust_report = jwt.decode(signed_trust_report, public_key, self.algorithm)
+            public_key = self.getPublicKey(metrics)
+            try:
+                with metrics.phase('jwt_decode'):
+                    trust_report = jwt.decode(signed_trust_report, public_key, self.algorithm)
+            except jwt.DecodeError:
+                # The hub key may have been replaced since it was read
+                if time.time() - self.public_key_read_at < PUBLIC_KEY_RELOAD_INTERVAL:
+                    raise
+                public_key = self.getPublicKey(metrics, reload=True)
+                with metrics.phase('jwt_decode'):
+                    trust_report = jwt.decode(signed_trust_report, public_key, self.algorithm)
             return trust_report
 
         except IOError as exc:
@@ -56,21 +88,69 @@ class HostTrustUtils():
             raise exc
 
 
-    def getTrustReport(self, compute_node_id):
-        trust_report = {}
+    def getTrustReportKey(self):
+        # hv_specs key holding the trust report this deployment relies on
+        if self.verification == 'on':
+            return "signed_trust_report"
+        return "trust_report"
+
+
+    def getTrustSummary(self, value):
+        # Parses the value stored under getTrustReportKey() into the summary
+        # kept in memory by the schedulers
+        if self.verification == 'on':
+            trust_report = self.verifySignature(value)
+        elif asset_tag_utils.is_json(value):
+            trust_report = json.loads(value)
+        else:
+            trust_report = value
+
+        return {'trusted': trust_report.get('trusted', False),
+                'valid_to': trust_report.get('valid_to'),
+                'asset_tags': trust_report.get('asset_tags', {})}
+
+
+    def getSummaryColumns(self, summary):
+        # trusted, valid_to and asset tags stored along with the trust
+        # report, summary is None when the report is invalid
+        if summary is None:
+            return {'trusted': False, 'valid_to': None, 'asset_tags': {}}
+
+        try:
+            valid_to = asset_tag_utils.parseValidTo(summary['valid_to'])
+        except (TypeError, ValueError):
+            valid_to = None
+
+        asset_tags = {}
+        for name, values in summary['asset_tags'].iteritems():
+            if not isinstance(values, list):
+                values = [values]
+            asset_tags[name] = ["%s" % value for value in values]
+
+        return {'trusted': summary['trusted'] == True,
+                'valid_to': valid_to,
+                'asset_tags': asset_tags}
+
+
+    def getTrustReport(self, compute_node_id,
+                       metrics=trust_filter_metrics.NULL_METRICS):
+        # None when the compute node has no trust report or when its
+        # signature does not verify
         try:
             if self.verification == 'on':
-                hvspec = db.hvspec_get_by_compute_node_id_and_key(self.admin, compute_node_id, "signed_trust_report")
-                signed_trust_report = hvspec['value']
+                with metrics.phase('hv_specs_read'):
+                    signed_trust_report = self.backend.get(self.admin, compute_node_id, "signed_trust_report")
 
-                trust_report = self.verifySignature(signed_trust_report)
+                metrics.increment('signature_verifications')
+                return self.verifySignature(signed_trust_report, metrics)
 
-            else:
-                hvspec = db.hvspec_get_by_compute_node_id_and_key(self.admin, compute_node_id, "trust_report")
-                trust_report = hvspec['value']
+            with metrics.phase('hv_specs_read'):
+                return self.backend.get(self.admin, compute_node_id, "trust_report")
 
         except exception.HVMetadataNotFound:
-                LOG.exception("Trust Report not found for compute node : %s" % compute_node_id)
-        except:
+                metrics.increment('trust_reports_missing')
+                LOG.debug("Trust Report not found for compute node : %s" % compute_node_id)
+        except Exception:
+                metrics.increment('signature_failures')
                 LOG.exception("Signature Verification failed for compute node : %s" % compute_node_id)
-        return trust_report
+        return None
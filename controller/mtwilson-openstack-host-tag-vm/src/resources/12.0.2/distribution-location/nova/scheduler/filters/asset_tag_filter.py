@@ -44,14 +44,21 @@ the Open Attestation project at:
     https://github.com/OpenAttestation/OpenAttestation
 """
 
+import threading
+
 from nova import db
 from nova import context
 from oslo_log import log as logging
 from nova.scheduler import filters
 from nova.openstack.common import asset_tag_utils
 from nova.openstack.common import host_trust_utils
+from nova.openstack.common import trust_filter_metrics
+from nova.openstack.common import trust_report_rpc
+
+from oslo_config import cfg
 
 
+CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
 
@@ -67,10 +74,41 @@ class TrustAssertionFilter(filters.BaseHostFilter):
         # host in the first round that scheduler invokes us.
         self.compute_nodes = db.compute_node_get_all(self.admin)
 
+        # Trust reports kept current by the os-hypervisors API fan-out
+        self.trust_map = None
+        if CONF.trusted_computing.trust_report_fanout:
+            self.trust_map = trust_report_rpc.get_trust_map()
+
+        # Metrics of the request being filtered by the current thread
+        self.metrics_enabled = CONF.trusted_computing.trust_filter_metrics
+        self._request = threading.local()
+
+    def filter_all(self, filter_obj_list, filter_properties):
+        if not self.metrics_enabled:
+            return super(TrustAssertionFilter, self).filter_all(
+                filter_obj_list, filter_properties)
+        return self._filter_all_measured(filter_obj_list, filter_properties)
+
+    def _filter_all_measured(self, filter_obj_list, filter_properties):
+        metrics = trust_filter_metrics.RequestMetrics()
+        self._request.metrics = metrics
+        try:
+            for obj in super(TrustAssertionFilter, self).filter_all(
+                    filter_obj_list, filter_properties):
+                metrics.increment('hosts_passed')
+                yield obj
+        finally:
+            self._request.metrics = None
+            metrics.emit()
+
 
     def host_passes(self, host_state, filter_properties):
         """Only return hosts with required Trust level."""
 
+        metrics = (getattr(self._request, 'metrics', None) or
+                   trust_filter_metrics.NULL_METRICS)
+        metrics.increment('hosts')
+
         verify_asset_tag = False
         verify_trust_status = False
 
@@ -82,7 +120,7 @@ class TrustAssertionFilter(filters.BaseHostFilter):
             LOG.info(image_props.get('mtwilson_trustpolicy_location'))
             trust_verify = 'true'
 
-		LOG.debug("trust_verify : %s" % trust_verify)
+        LOG.debug("trust_verify : %s" % trust_verify)
 
         if trust_verify == 'true':
             verify_trust_status = True
@@ -99,19 +137,28 @@ class TrustAssertionFilter(filters.BaseHostFilter):
             # Filter returns success/true if neither trust or tag has to be verified.
             return True
 
-        #Fetch compute node record for this hypervisor
-        compute_node = db.compute_node_search_by_hypervisor(self.admin, host_state.hypervisor_hostname)
-        compute_node_id = compute_node[0]['id']
-        LOG.debug("compute_node_is : %s" % compute_node_id)
-
-        trust_report = self.utils.getTrustReport(compute_node_id)
+        if self.trust_map is not None:
+            with metrics.phase('trust_map_get'):
+                trust_report = self.trust_map.get(host_state.hypervisor_hostname)
+        else:
+            #Fetch compute node record for this hypervisor
+            with metrics.phase('compute_node_search'):
+                compute_node = db.compute_node_search_by_hypervisor(self.admin, host_state.hypervisor_hostname)
+            compute_node_id = compute_node[0]['id']
+            LOG.debug("compute_node_is : %s" % compute_node_id)
+
+            with metrics.phase('trust_report'):
+                trust_report = self.utils.getTrustReport(compute_node_id,
+                                                         metrics)
         LOG.debug("trust_report : %s" % trust_report)
 
         if trust_report is None:
             #No attestation found for this host
+            metrics.increment('hosts_without_trust_report')
             return False
 
-        trust, asset_tag = asset_tag_utils.isHostTrusted(trust_report)
+        with metrics.phase('trust_check'):
+            trust, asset_tag = asset_tag_utils.isHostTrusted(trust_report)
         LOG.debug("trust : %s" % trust)
         LOG.debug("asset_tag : %s" % asset_tag)
         if not trust:
@@ -119,7 +166,8 @@ class TrustAssertionFilter(filters.BaseHostFilter):
 
         if verify_asset_tag:
             # Verify the asset tag restriction
-            return asset_tag_utils.isAssetTagsPresent(asset_tag, tag_selections)
+            with metrics.phase('asset_tag_match'):
+                return asset_tag_utils.isAssetTagsPresent(asset_tag, tag_selections)
 
 
         return True
@@ -0,0 +1,69 @@
+"""
+  CLI interface for archiving the soft-deleted hypervisor metadata.
+
+  Moves the soft-deleted hv_specs rows to shadow_hv_specs in bounded
+  batches, as nova-manage db archive_deleted_rows does for the nova tables:
+
+    python -m nova.cmd.hv_specs_manage --config-file /etc/nova/nova.conf \
+        [--max-rows N] [--until 2016-06-01T00:00:00] [--batch-size N]
+"""
+
+from __future__ import print_function
+
+import sys
+
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from nova import config
+from nova import context
+from nova import db
+from nova.i18n import _
+
+
+cli_opts = [
+    cfg.IntOpt('max-rows',
+               help='Maximum number of deleted rows to archive, all of '
+                    'them when not set'),
+    cfg.StrOpt('until',
+               help='Only archive the rows deleted before this ISO 8601 '
+                    'date and time (UTC)'),
+    cfg.IntOpt('batch-size',
+               default=1000,
+               help='Number of rows moved per transaction'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(cli_opts)
+
+
+def main():
+    config.parse_args(sys.argv)
+
+    if CONF.max_rows is not None and CONF.max_rows < 1:
+        print(_("Must supply a positive value for max_rows"))
+        return 2
+    if CONF.batch_size < 1:
+        print(_("Must supply a positive value for batch_size"))
+        return 2
+
+    until = None
+    if CONF.until:
+        try:
+            until = timeutils.normalize_time(
+                timeutils.parse_isotime(CONF.until))
+        except ValueError:
+            print(_("Invalid date and time for until : %s") % CONF.until)
+            return 2
+
+    admin = context.get_admin_context()
+    rows_archived = db.hvspec_archive_deleted_rows(admin,
+                                                   max_rows=CONF.max_rows,
+                                                   until=until,
+                                                   batch_size=CONF.batch_size)
+    print(_("%d hv_specs rows archived") % rows_archived)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,14 +15,8 @@ def isHostTrusted(trust_report):
 
     if 'trusted' in jsonObj:
         if jsonObj['trusted'] == True:
-            validTo = jsonObj['valid_to']
             currentUtcTime = datetime.datetime.utcnow()
-
-            #formatting the validTo time to match currentUtcTime format
-            vDate = validTo[0:10]
-            vTime = validTo[11:19]
-            validToFormatted = vDate + " " + vTime
-            validTime = datetime.datetime.strptime(validToFormatted, "%Y-%m-%d %H:%M:%S")
+            validTime = parseValidTo(jsonObj['valid_to'])
 
             maxTime = max(currentUtcTime, validTime)
             if maxTime == validTime:
@@ -34,6 +28,15 @@ def isHostTrusted(trust_report):
     return trust, assetTags
 
 
+# Converts the valid_to of a trust report to a naive UTC datetime
+def parseValidTo(validTo):
+    #formatting the validTo time to match utcnow() format
+    vDate = validTo[0:10]
+    vTime = validTo[11:19]
+    validToFormatted = vDate + " " + vTime
+    return datetime.datetime.strptime(validToFormatted, "%Y-%m-%d %H:%M:%S")
+
+
 # Verifies the asset tag match with the tag selections provided by the user.
 def isAssetTagsPresent(host_tags, tag_selections):
     # host_tags is the list of tags set on the host
@@ -0,0 +1,159 @@
+"""Compute node lookups of the os-hypervisors API, cached per API worker.
+
+The trust reports are pushed with the hostname or the IP address of the
+compute nodes, which used to cost two LIKE searches of compute_nodes per
+host and per push. The hostname and host_ip of all the compute nodes are
+instead loaded with a single query, again once compute_node_cache_ttl
+expired, and names that are not an exact hostname or host_ip fall back to
+the LIKE searches.
+
+Deleting a compute node or its service invalidates the caches of the
+process doing it. The other API workers check that the compute nodes they
+are about to write trust reports for still exist, see check().
+"""
+import threading
+import time
+import weakref
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+cache_opts = [
+    cfg.IntOpt('compute_node_cache_ttl',
+               default=600,
+               help='Seconds the os-hypervisors API caches the hostname and '
+                    'host_ip of the compute nodes, 0 disables the cache'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(cache_opts, group='trusted_computing')
+
+# Caches of the process, for invalidate_all
+_CACHES = weakref.WeakSet()
+
+
+def _compute_node_dict(compute_node):
+    # Attributes, the projection rows are named tuples
+    return {'id': compute_node.id,
+            'hypervisor_hostname': compute_node.hypervisor_hostname,
+            'host_ip': compute_node.host_ip}
+
+
+class ComputeNodeCache(object):
+    """Maps the hostname and host_ip of the compute nodes to their record.
+
+    The records are dicts of id, hypervisor_hostname and host_ip.
+    """
+
+    def __init__(self, host_api, ttl=None):
+        self.host_api = host_api
+        if ttl is None:
+            ttl = CONF.trusted_computing.compute_node_cache_ttl
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.compute_nodes = {}
+        self.expires = 0
+        _CACHES.add(self)
+
+    def prime(self, context):
+        """Loads the hostname and host_ip of all the compute nodes."""
+        compute_nodes = {}
+        for compute_node in self.host_api.compute_node_get_all_hostnames(
+                context):
+            compute_node = _compute_node_dict(compute_node)
+            compute_nodes[compute_node['hypervisor_hostname']] = compute_node
+            if compute_node['host_ip']:
+                compute_nodes[str(compute_node['host_ip'])] = compute_node
+
+        with self.lock:
+            self.compute_nodes = compute_nodes
+            self.expires = time.time() + self.ttl
+        LOG.debug("Compute node cache primed with %d names"
+                  % len(compute_nodes))
+
+    def _search(self, context, name):
+        compute_node = self.host_api.compute_node_search_by_hypervisor(
+            context, name)
+        LOG.debug("compute_node search by hypervisor : %s" % compute_node)
+
+        if not compute_node:
+            compute_node = self.host_api.compute_node_search_by_hostip(
+                context, name)
+            LOG.debug("compute_node search by hostip : %s" % compute_node)
+
+        if not compute_node:
+            return None
+        return _compute_node_dict(compute_node[0])
+
+    def get(self, context, name):
+        """Returns the compute node of a hostname or host_ip, None if none."""
+        if self.ttl <= 0:
+            return self._search(context, name)
+
+        if time.time() >= self.expires:
+            self.prime(context)
+
+        with self.lock:
+            compute_node = self.compute_nodes.get(name)
+        if compute_node is not None:
+            return compute_node
+
+        # Unknown hosts are not cached, they may register at any time
+        compute_node = self._search(context, name)
+        if compute_node is not None:
+            with self.lock:
+                self.compute_nodes[name] = compute_node
+        return compute_node
+
+    def check(self, context, compute_nodes):
+        """Looks up again the compute nodes deleted since they were cached.
+
+        compute_nodes maps names to the records get() returned for them. A
+        compute node created again under the same name has a new id, names
+        that no longer have a compute node are left out of the result.
+        """
+        if self.ttl <= 0 or not compute_nodes:
+            return compute_nodes
+
+        compute_node_ids = set(compute_node['id']
+                               for compute_node in compute_nodes.values())
+        existing = set(compute_node.id for compute_node in
+                       self.host_api.compute_node_get_all_hostnames(
+                           context, compute_node_ids=compute_node_ids))
+
+        checked = {}
+        for name, compute_node in compute_nodes.items():
+            if compute_node['id'] not in existing:
+                LOG.info("Compute node %s of %s was deleted"
+                         % (compute_node['id'], name))
+                self.invalidate(compute_node['id'])
+                compute_node = self._search(context, name)
+                if compute_node is None:
+                    continue
+                with self.lock:
+                    self.compute_nodes[name] = compute_node
+            checked[name] = compute_node
+        return checked
+
+    def invalidate(self, compute_node_id=None):
+        """Forgets a deleted compute node, or all of them when None."""
+        with self.lock:
+            if compute_node_id is None:
+                self.compute_nodes = {}
+                self.expires = 0
+                return
+            self.compute_nodes = dict(
+                (name, compute_node)
+                for name, compute_node in self.compute_nodes.items()
+                if compute_node['id'] != compute_node_id)
+
+
+def invalidate_all(compute_node_id=None):
+    """Forgets a deleted compute node, or all of them when None, in all the
+    caches of the process.
+    """
+    for cache in list(_CACHES):
+        cache.invalidate(compute_node_id)
@@ -0,0 +1,148 @@
+"""Timings and counters of the trust filter, aggregated per request.
+
+TrustAssertionFilter measures the phases of host_passes and of
+HostTrustUtils.getTrustReport for every host of a scheduling request and,
+once the request went through all the hosts, logs their totals as the
+trust_filter_metrics structured field and optionally sends them to a
+statsd server. When trusted_computing/trust_filter_metrics is off the
+phases are measured by NULL_METRICS, which does nothing.
+"""
+import socket
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+metrics_opts = [
+    cfg.BoolOpt('trust_filter_metrics',
+                default=False,
+                help='Measure the phases of the trust filter and log their '
+                     'totals for every scheduling request'),
+    cfg.StrOpt('trust_filter_statsd_host',
+               help='statsd server the trust filter metrics are also sent '
+                    'to, not sent when unset'),
+    cfg.IntOpt('trust_filter_statsd_port',
+               default=8125,
+               help='UDP port of the statsd server'),
+    cfg.StrOpt('trust_filter_statsd_prefix',
+               default='nova.scheduler.trust_filter',
+               help='Prefix of the statsd metric names'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(metrics_opts, group='trusted_computing')
+
+
+class _Phase(object):
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.add_time(self.name, time.time() - self.start)
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class NullMetrics(object):
+    """Metrics of a request that is not measured."""
+
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def add_time(self, name, seconds):
+        pass
+
+    def increment(self, name, count=1):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class RequestMetrics(object):
+    """Timings and counters of the trust filter for one request."""
+
+    enabled = True
+
+    def __init__(self):
+        self.start = time.time()
+        # phase -> [calls, seconds]
+        self.timings = {}
+        self.counters = {}
+
+    def phase(self, name):
+        """Context manager adding its duration to the phase."""
+        return _Phase(self, name)
+
+    def add_time(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+
+    def increment(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def fields(self):
+        """Returns the totals of the request, durations in milliseconds."""
+        fields = {'total_ms': round((time.time() - self.start) * 1000, 3)}
+        for name, (calls, seconds) in self.timings.items():
+            fields['%s_ms' % name] = round(seconds * 1000, 3)
+            fields['%s_calls' % name] = calls
+        fields.update(self.counters)
+        return fields
+
+    def emit(self):
+        """Logs the totals of the request and sends them to statsd."""
+        fields = self.fields()
+        LOG.info("Trust filter request metrics : %s"
+                 % ', '.join('%s=%s' % item for item in sorted(fields.items())),
+                 extra={'trust_filter_metrics': fields})
+
+        if CONF.trusted_computing.trust_filter_statsd_host:
+            try:
+                self._send_statsd(fields)
+            except Exception:
+                LOG.exception("Unable to send the trust filter metrics")
+
+    def _send_statsd(self, fields):
+        prefix = CONF.trusted_computing.trust_filter_statsd_prefix
+        lines = []
+        for name, value in sorted(fields.items()):
+            if name.endswith('_ms'):
+                lines.append('%s.%s:%s|ms' % (prefix, name[:-3], value))
+            else:
+                lines.append('%s.%s:%s|c' % (prefix, name, value))
+
+        # One datagram for the whole request
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.sendto('\n'.join(lines).encode('utf-8'),
+                        (CONF.trusted_computing.trust_filter_statsd_host,
+                         CONF.trusted_computing.trust_filter_statsd_port))
+        finally:
+            sock.close()
@@ -0,0 +1,194 @@
+"""Fan-out of the trust report changes to the schedulers.
+
+The os-hypervisors API casts every trust report it stores to all the
+schedulers listening on the trust_report_topic fanout exchange. Each
+scheduler verifies the report as the trust filter would, then keeps its
+summary in a TrustMap keyed by hypervisor hostname, so the trust filter
+never reads the database while scheduling. Nothing received on the message
+bus is trusted without that check. A periodic full reload of the trust
+reports backs up lost casts.
+"""
+import threading
+
+from nova import context
+from nova import db
+from nova import rpc
+from nova.openstack.common import host_trust_utils
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import oslo_messaging as messaging
+from oslo_service import loopingcall
+
+
+LOG = logging.getLogger(__name__)
+
+rpc_opts = [
+    cfg.BoolOpt('trust_report_fanout',
+                default=True,
+                help='Fan out trust report changes to the schedulers, which '
+                     'then keep the trust reports in memory'),
+    cfg.StrOpt('trust_report_topic',
+               default='trust_reports',
+               help='Topic the trust report changes are fanned out on'),
+    cfg.IntOpt('trust_report_reconcile_interval',
+               default=300,
+               help='Seconds between two full reloads of the trust reports '
+                    'kept in memory by the schedulers'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(rpc_opts, group='trusted_computing')
+CONF.import_opt('host', 'nova.netconf')
+
+
+class TrustReportAPI(object):
+    """Client side of the trust report fan-out.
+
+    API version history:
+
+        * 1.0 - Initial version.
+    """
+
+    def __init__(self):
+        target = messaging.Target(
+            topic=CONF.trusted_computing.trust_report_topic, version='1.0')
+        self.client = rpc.get_client(target)
+
+    def trust_report_updated(self, ctxt, hypervisor_hostname, trust_report):
+        cctxt = self.client.prepare(fanout=True)
+        cctxt.cast(ctxt, 'trust_report_updated',
+                   hypervisor_hostname=hypervisor_hostname,
+                   trust_report=trust_report)
+
+    def trust_report_deleted(self, ctxt, hypervisor_hostname):
+        cctxt = self.client.prepare(fanout=True)
+        cctxt.cast(ctxt, 'trust_report_deleted',
+                   hypervisor_hostname=hypervisor_hostname)
+
+
+class TrustReportEndpoint(object):
+    """Server side of the trust report fan-out, feeds a TrustMap."""
+
+    target = messaging.Target(version='1.0')
+
+    def __init__(self, trust_map):
+        self.trust_map = trust_map
+
+    def trust_report_updated(self, context, hypervisor_hostname, trust_report):
+        self.trust_map.update(hypervisor_hostname,
+                              self.trust_map.get_summary(hypervisor_hostname,
+                                                         trust_report))
+
+    def trust_report_deleted(self, context, hypervisor_hostname):
+        self.trust_map.update(hypervisor_hostname, None)
+
+
+class TrustMap(object):
+    """Trust report summaries of all the hypervisors, kept in memory."""
+
+    def __init__(self):
+        self.utils = host_trust_utils.HostTrustUtils()
+        self.summaries = {}
+        self.lock = threading.Lock()
+        self.started = False
+        # Changes received while a reconcile reads the database, replayed
+        # on top of its result so that they are not lost
+        self._pending = None
+        self._server = None
+        self._reconciler = None
+
+    def get(self, hypervisor_hostname):
+        return self.summaries.get(hypervisor_hostname)
+
+    def update(self, hypervisor_hostname, summary):
+        LOG.debug("Trust report of %s updated : %s"
+                  % (hypervisor_hostname, summary))
+        with self.lock:
+            if summary is None:
+                self.summaries.pop(hypervisor_hostname, None)
+            else:
+                self.summaries[hypervisor_hostname] = summary
+            if self._pending is not None:
+                self._pending.append((hypervisor_hostname, summary))
+
+    def get_summary(self, hypervisor_hostname, trust_report):
+        """Summary of a trust report, None if its signature does not verify."""
+        try:
+            return self.utils.getTrustSummary(trust_report)
+        except Exception:
+            LOG.exception("Invalid trust report for hypervisor : %s"
+                          % hypervisor_hostname)
+            return None
+
+    def _load_summaries(self):
+        admin = context.get_admin_context()
+
+        hostnames = dict((compute_node['id'],
+                          compute_node['hypervisor_hostname'])
+                         for compute_node in db.compute_node_get_all(admin))
+
+        summaries = {}
+        for hvspec in db.hvspec_get_by_key(admin,
+                                           self.utils.getTrustReportKey()):
+            hostname = hostnames.get(hvspec['compute_node_id'])
+            if hostname is None:
+                continue
+            summary = self.get_summary(hostname, hvspec.get_value())
+            if summary is not None:
+                summaries[hostname] = summary
+        return summaries
+
+    def reconcile(self):
+        """Reloads all the trust reports from the database."""
+        with self.lock:
+            self._pending = []
+        try:
+            summaries = self._load_summaries()
+        except Exception:
+            LOG.exception("Unable to reload the trust reports")
+            with self.lock:
+                self._pending = None
+            return
+
+        with self.lock:
+            for hypervisor_hostname, summary in self._pending:
+                if summary is None:
+                    summaries.pop(hypervisor_hostname, None)
+                else:
+                    summaries[hypervisor_hostname] = summary
+            self._pending = None
+            self.summaries = summaries
+        LOG.info("Trust reports of %d hypervisors reloaded" % len(summaries))
+
+    def start(self):
+        """Loads the trust reports and starts listening for changes."""
+        if self.started:
+            return
+        self.started = True
+
+        self.reconcile()
+
+        target = messaging.Target(
+            topic=CONF.trusted_computing.trust_report_topic,
+            server=CONF.host)
+        self._server = rpc.get_server(target, [TrustReportEndpoint(self)])
+        self._server.start()
+
+        interval = CONF.trusted_computing.trust_report_reconcile_interval
+        if interval > 0:
+            self._reconciler = loopingcall.FixedIntervalLoopingCall(
+                self.reconcile)
+            self._reconciler.start(interval=interval, initial_delay=interval)
+
+
+_TRUST_MAP = None
+
+
+def get_trust_map():
+    """Returns the started TrustMap of the process."""
+    global _TRUST_MAP
+    if _TRUST_MAP is None:
+        _TRUST_MAP = TrustMap()
+        _TRUST_MAP.start()
+    return _TRUST_MAP
@@ -71,6 +71,7 @@ from nova.objects import fields as fields_obj
 from nova.objects import keypair as keypair_obj
 from nova.objects import quotas as quotas_obj
 from nova.objects import security_group as security_group_obj
+from nova.openstack.common import compute_node_cache
 from nova.pci import request as pci_request
 import nova.policy
 from nova import rpc
@@ -3696,6 +3697,8 @@ class HostAPI(base.Base):
     def _service_delete(self, context, service_id):
         """Performs the actual Service deletion operation."""
         objects.Service.get_by_id(context, service_id).destroy()
+        # The compute nodes of the service are deleted along with it
+        compute_node_cache.invalidate_all()
 
     def service_delete(self, context, service_id):
         """Deletes the specified service."""
@@ -3731,6 +3734,10 @@ class HostAPI(base.Base):
         return objects.ComputeNodeList.get_by_hostip(context,
                                                          host_ip)
 
+    def compute_node_get_all_hostnames(self, context, compute_node_ids=None):
+        return self.db.compute_node_get_all_hostnames(
+            context, compute_node_ids=compute_node_ids)
+
     def compute_node_statistics(self, context):
         return self.db.compute_node_statistics(context)
 
@@ -4411,31 +4418,58 @@ class HVMetadataAPI(base.Base):
 
     @wrap_exception()
     def create_hv_spec(self, context, compute_node_id,
-                        key, value):
-        """Create a new hypervisor metadata."""
+                        key, value, summary=None):
+        """Create a new hypervisor metadata.
+
+        :param summary: dict of trusted, valid_to and asset_tags, for trust
+                        reports
+        """
 
         hvspec = objects.HVMetadata(context)
         hvspec.compute_node_id = compute_node_id
         hvspec.key = key
         hvspec.value = value
+        if summary is not None:
+            hvspec.trusted = summary['trusted']
+            hvspec.valid_to = summary['valid_to']
+            hvspec.asset_tags = summary['asset_tags']
         hvspec.create()
 
         return hvspec
 
     @wrap_exception()
     def update_hv_spec(self, context, id, compute_node_id,
-                        key, value):
-        """Update an existing hypervisor metadata."""
+                        key, value, summary=None):
+        """Update an existing hypervisor metadata.
+
+        :param summary: dict of trusted, valid_to and asset_tags, for trust
+                        reports
+        """
 
         hvspec = objects.HVMetadata(context)
         hvspec.id = id
         hvspec.compute_node_id = compute_node_id
         hvspec.key = key
         hvspec.value = value
+        if summary is not None:
+            hvspec.trusted = summary['trusted']
+            hvspec.valid_to = summary['valid_to']
+            hvspec.asset_tags = summary['asset_tags']
         hvspec.save()
 
         return hvspec
 
+    @wrap_exception()
+    def set_hv_specs(self, context, hvspecs, summaries=None):
+        """Create or update the metadata of one or many hypervisors at once.
+
+        :param hvspecs: dict of compute node id to dict of key to value
+        :param summaries: dict of compute node id to dict of key to the
+                          trusted, valid_to and asset_tags of the value
+        """
+        return objects.HVMetadataList.set(context, hvspecs,
+                                          summaries=summaries)
+
     @wrap_exception()
     def delete_hv_spec(self, context, hvspec_id):
         """Delete a hypervisor metadata by id."""
@@ -4463,3 +4497,41 @@ class HVMetadataAPI(base.Base):
         """Get a specific metadata for given compute_node."""
         return objects.HVMetadata.get_by_compute_node_id_and_key(context,
                                                          compute_node_id, key)
+
+    def get_hv_specs_by_compute_node_ids(self, context, compute_node_ids,
+                                         keys=None):
+        """Get the metadata of several compute nodes in one query.
+
+        :returns: dict of compute node id to list of metadata
+        """
+        hv_specs = objects.HVMetadataList.get_by_compute_node_ids(
+            context, compute_node_ids, keys=keys)
+        return hv_specs.group_by_compute_node_id(compute_node_ids)
+
+    def get_hv_spec_keys_by_compute_node_ids(self, context, compute_node_ids):
+        """Get the metadata of several compute nodes without their values.
+
+        The values are loaded when first accessed.
+
+        :returns: dict of compute node id to list of metadata
+        """
+        hv_specs = objects.HVMetadataList.get_keys_by_compute_node_ids(
+            context, compute_node_ids)
+        return hv_specs.group_by_compute_node_id(compute_node_ids)
+
+    def get_hv_specs_by_keys(self, context, keys, compute_node_ids=None):
+        """Get specific metadata of all, or the given, hypervisors."""
+        return objects.HVMetadataList.get_by_keys(
+            context, keys, compute_node_ids=compute_node_ids)
+
+    def get_trusted_compute_node_ids(self, context, key, tags=None,
+                                     valid_until=None):
+        """Get the compute nodes trusted until valid_until with all the
+        given asset tags, from the summary of their trust report.
+        """
+        return objects.HVMetadataList.get_trusted_compute_node_ids(
+            context, key, tags=tags, valid_until=valid_until)
+
+    def get_asset_tags(self, context, key):
+        """Get the distinct asset tags of the hypervisors."""
+        return objects.HVMetadataList.get_asset_tags(context, key)
@@ -21,9 +21,12 @@ import collections
 import copy
 import datetime
 import functools
+import hashlib
 import inspect
+import sqlite3
 import sys
 import uuid
+import zlib
 
 from oslo_config import cfg
 from oslo_db import api as oslo_db_api
@@ -33,6 +36,7 @@ from oslo_db.sqlalchemy import enginefacade
 from oslo_db.sqlalchemy import update_match
 from oslo_db.sqlalchemy import utils as sqlalchemyutils
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import excutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
@@ -125,10 +129,20 @@ api_db_opts = [
                     'SQLAlchemy.'),
 ]
 
+hvspec_opts = [
+    cfg.StrOpt('trust_report_storage',
+               default='text',
+               choices=('text', 'compressed'),
+               help='Storage format of the trust reports in hv_specs. text '
+                    'keeps them in the value column, compressed stores them '
+                    'zlib compressed in value_blob'),
+]
+
 CONF = cfg.CONF
 CONF.register_opts(db_opts)
 CONF.register_opts(oslo_db_options.database_opts, 'database')
 CONF.register_opts(api_db_opts, group='api_database')
+CONF.register_opts(hvspec_opts, group='trusted_computing')
 CONF.import_opt('until_refresh', 'nova.quota')
 
 LOG = logging.getLogger(__name__)
@@ -859,6 +873,21 @@ def compute_node_search_by_hostip(context, host_ip):
             all()
 
 
+@pick_context_manager_reader
+def compute_node_get_all_hostnames(context, compute_node_ids=None):
+    query = model_query(context, models.ComputeNode,
+                        args=(models.ComputeNode.id,
+                              models.ComputeNode.hypervisor_hostname,
+                              models.ComputeNode.host_ip),
+                        read_deleted='no')
+    if compute_node_ids is not None:
+        if not compute_node_ids:
+            return []
+        query = query.filter(
+            models.ComputeNode.id.in_(list(compute_node_ids)))
+    return query.all()
+
+
 @pick_context_manager_writer
 def compute_node_create(context, values):
     """Creates a new ComputeNode and populates the capacity fields
@@ -6872,9 +6901,70 @@ def instance_tag_exists(context, instance_uuid, tag):
 #####################
 
 
+# hv_specs keys stored compressed with trust_report_storage = compressed
+HVSPEC_COMPRESSED_KEYS = ('trust_report', 'signed_trust_report')
+
+
+def _hvspec_pack_values(values, key=None):
+    """Moves a trust report to value_blob in the compressed storage format.
+
+    HVMetadata.get_value() inflates it back on read.
+
+    :param key: key of the row, values['key'] when None. An update usually
+                only carries the changed fields
+    """
+    if 'value' not in values:
+        return
+
+    if key is None:
+        key = values.get('key')
+    value = values['value']
+    if (CONF.trusted_computing.trust_report_storage == 'compressed' and
+            key in HVSPEC_COMPRESSED_KEYS and
+            value is not None):
+        if isinstance(value, six.text_type):
+            value = value.encode('utf-8')
+        values['value_blob'] = zlib.compress(value)
+        values['value'] = None
+    else:
+        values['value_blob'] = None
+
+
+def _hvspec_tags_hash(asset_tags):
+    """Returns the tags_hash of the asset tags of a trust report."""
+    return hashlib.sha256(
+        jsonutils.dumps(asset_tags, sort_keys=True)).hexdigest()
+
+
+def _hvspec_set_tags(context, hvspec_ref, asset_tags):
+    """Replaces the hv_spec_tags rows of a trust report.
+
+    The rows are left untouched when the tags hash to the tags_hash of the
+    hv_specs row, the tags of a host rarely change between two reports.
+
+    :param asset_tags: dict of tag name to list of values
+    """
+    tags_hash = _hvspec_tags_hash(asset_tags)
+    if tags_hash == hvspec_ref.tags_hash:
+        return
+
+    context.session.query(models.HVMetadataTag).\
+            filter_by(hv_spec_id=hvspec_ref.id).\
+            delete(synchronize_session=False)
+    for name, tag_values in asset_tags.items():
+        for value in set(tag_values):
+            tag_ref = models.HVMetadataTag()
+            tag_ref.update({'hv_spec_id': hvspec_ref.id,
+                            'name': name,
+                            'value': value})
+            context.session.add(tag_ref)
+    hvspec_ref.tags_hash = tags_hash
+
+
 @pick_context_manager_reader
 def _hvspec_get(context, hvspec_id):
     result = model_query(context, models.HVMetadata).\
+            options(undefer('value_blob')).\
             filter_by(id=hvspec_id).\
             first()
 
@@ -6889,12 +6979,17 @@ def hvspec_create(context, values):
     """Creates a new HVMetadata and populates the metadata field
     with the most recent data.
     """
-    convert_objects_related_datetimes(values)
+    convert_objects_related_datetimes(values, 'created_at', 'deleted_at',
+                                      'updated_at', 'valid_to')
+    _hvspec_pack_values(values)
+    asset_tags = values.pop('asset_tags', None)
 
     try:
         hvspec_ref = models.HVMetadata()
         hvspec_ref.update(values)
         hvspec_ref.save(context.session)
+        if asset_tags is not None:
+            _hvspec_set_tags(context, hvspec_ref, asset_tags)
         return hvspec_ref
 
     except db_exc.DBDuplicateEntry:
@@ -6911,12 +7006,150 @@ def hvspec_update(context, hvspec_id, values):
     # changes in data.  This ensures that we invalidate the
     # scheduler cache of host attestation data in case of races.
     values['updated_at'] = timeutils.utcnow()
-    convert_objects_related_datetimes(values)
+    convert_objects_related_datetimes(values, 'created_at', 'deleted_at',
+                                      'updated_at', 'valid_to')
+    _hvspec_pack_values(values, values.get('key', hvspec_ref.key))
+    asset_tags = values.pop('asset_tags', None)
     hvspec_ref.update(values)
+    if asset_tags is not None:
+        _hvspec_set_tags(context, hvspec_ref, asset_tags)
 
     return hvspec_ref
 
 
+# Columns written by hvspec_set, only the HVSPEC_SET_UPDATE_COLUMNS of an
+# existing row are changed
+HVSPEC_SET_COLUMNS = ('created_at', 'updated_at', 'deleted', 'compute_node_id',
+                      'key', 'value', 'value_blob', 'trusted', 'valid_to')
+HVSPEC_SET_UPDATE_COLUMNS = ('updated_at', 'value', 'value_blob', 'trusted',
+                             'valid_to')
+
+
+def _hvspec_upsert_statement(dialect):
+    """Returns the upsert statement of hv_specs for the dialect.
+
+    None when the dialect has no upsert hvspec_set can rely on. SQLite
+    INSERT OR REPLACE is not used, it gives the row a new id and so
+    orphans its hv_spec_tags rows.
+    """
+    quote = dialect.identifier_preparer.quote
+    insert = 'INSERT INTO hv_specs (%s) VALUES (%s)' % (
+        ', '.join(quote(column) for column in HVSPEC_SET_COLUMNS),
+        ', '.join(':%s' % column for column in HVSPEC_SET_COLUMNS))
+
+    if dialect.name == 'mysql':
+        updates = ', '.join('%s = VALUES(%s)' % (quote(column), quote(column))
+                            for column in HVSPEC_SET_UPDATE_COLUMNS)
+        return sql.text('%s ON DUPLICATE KEY UPDATE %s' % (insert, updates))
+
+    if (dialect.name == 'postgresql' or
+            (dialect.name == 'sqlite' and
+             sqlite3.sqlite_version_info >= (3, 24, 0))):
+        updates = ', '.join('%s = excluded.%s' % (quote(column), quote(column))
+                            for column in HVSPEC_SET_UPDATE_COLUMNS)
+        return sql.text('%s ON CONFLICT (compute_node_id, %s, deleted) '
+                        'DO UPDATE SET %s' % (insert, quote('key'), updates))
+
+    return None
+
+
+@oslo_db_api.wrap_db_retry(max_retries=5, retry_on_deadlock=True)
+@pick_context_manager_writer
+def hvspec_set(context, hvspecs, summaries=None):
+    """Creates or updates the metadata of one or many compute nodes.
+
+    The rows are upserted with a single executemany, no row is read first
+    and concurrent pushes for the same compute node cannot fail with
+    HVMetadataExists.
+
+    :param hvspecs: dict of compute node id to dict of key to value
+    :param summaries: dict of compute node id to dict of key to the
+                      trusted, valid_to and asset_tags of the value
+    :returns: the stored HVMetadata rows
+    """
+    summaries = summaries or {}
+    now = timeutils.utcnow()
+
+    rows = []
+    tags = {}
+    for compute_node_id, values in hvspecs.items():
+        # Keys are strings once the dicts went through the conductor
+        compute_node_id = int(compute_node_id)
+        node_summaries = (summaries.get(compute_node_id) or
+                          summaries.get(str(compute_node_id)) or {})
+        for key, value in values.items():
+            summary = node_summaries.get(key) or {}
+            row = {'created_at': now,
+                   'updated_at': now,
+                   'deleted': 0,
+                   'compute_node_id': compute_node_id,
+                   'key': key,
+                   'value': value,
+                   'trusted': summary.get('trusted'),
+                   'valid_to': summary.get('valid_to')}
+            convert_objects_related_datetimes(row, 'valid_to')
+            _hvspec_pack_values(row)
+            rows.append(row)
+            if summary.get('asset_tags') is not None:
+                tags[(compute_node_id, key)] = summary['asset_tags']
+
+    if not rows:
+        return []
+
+    statement = _hvspec_upsert_statement(context.session.bind.dialect)
+    if statement is not None:
+        context.session.execute(statement, rows)
+    else:
+        for row in rows:
+            hvspec_ref = model_query(context, models.HVMetadata,
+                                     read_deleted='no').\
+                    filter_by(compute_node_id=row['compute_node_id'],
+                              key=row['key']).\
+                    first()
+            if hvspec_ref is None:
+                hvspec_ref = models.HVMetadata()
+            else:
+                del row['created_at']
+            hvspec_ref.update(row)
+            context.session.add(hvspec_ref)
+        context.session.flush()
+
+    compute_node_ids = set(row['compute_node_id'] for row in rows)
+    keys = set(row['key'] for row in rows)
+    written = set((row['compute_node_id'], row['key']) for row in rows)
+    hvspec_refs = [hvspec_ref for hvspec_ref in
+                   model_query(context, models.HVMetadata, read_deleted='no').
+                   options(undefer('value_blob')).
+                   filter(models.HVMetadata.compute_node_id.in_(
+                       compute_node_ids)).
+                   filter(models.HVMetadata.key.in_(keys)).
+                   all()
+                   if (hvspec_ref.compute_node_id, hvspec_ref.key) in written]
+
+    for hvspec_ref in hvspec_refs:
+        asset_tags = tags.get((hvspec_ref.compute_node_id, hvspec_ref.key))
+        if asset_tags is not None:
+            _hvspec_set_tags(context, hvspec_ref, asset_tags)
+
+    return hvspec_refs
+
+
+def hvspec_set_values(context, triples, summaries=None):
+    """Creates or updates (compute node id, key, value) triples.
+
+    :returns: the ids of the stored rows, in the order of the triples
+    """
+    hvspecs = {}
+    for compute_node_id, key, value in triples:
+        hvspecs.setdefault(int(compute_node_id), {})[key] = value
+
+    ids = dict(((hvspec_ref.compute_node_id, hvspec_ref.key), hvspec_ref.id)
+               for hvspec_ref in hvspec_set(context, hvspecs,
+                                            summaries=summaries))
+    return [ids[(int(compute_node_id), key)]
+            for compute_node_id, key, value in triples]
+
+
 @pick_context_manager_writer
 def hvspec_delete(context, hvspec_id):
     """Delete a HVMetadata record."""
@@ -6927,10 +7160,15 @@ def hvspec_delete(context, hvspec_id):
     if not result:
         raise exception.HVMetadataNotFound(host=hvspec_id)
 
+    context.session.query(models.HVMetadataTag).\
+            filter_by(hv_spec_id=hvspec_id).\
+            delete(synchronize_session=False)
+
 
 @pick_context_manager_reader
 def hvspec_get(context, hvspec_id):
     result = model_query(context, models.HVMetadata, read_deleted='no').\
+            options(undefer('value_blob')).\
             filter_by(id=hvspec_id).\
             first()
 
@@ -6942,12 +7180,14 @@ def hvspec_get(context, hvspec_id):
 
 @pick_context_manager_reader
 def hvspec_get_all(context):
-    return model_query(context, models.HVMetadata, read_deleted='no').all()
+    return model_query(context, models.HVMetadata, read_deleted='no').\
+            options(undefer('value_blob')).all()
 
 
 @pick_context_manager_reader
 def hvspec_get_by_compute_node_id(context, compute_node_id):
     result = model_query(context, models.HVMetadata, read_deleted='no').\
+            options(undefer('value_blob')).\
             filter_by(compute_node_id=compute_node_id).\
             all()
 
@@ -6957,15 +7197,18 @@ def hvspec_get_by_compute_node_id(context, compute_node_id):
 @pick_context_manager_reader
 def hvspec_get_by_key(context, key):
     result = model_query(context, models.HVMetadata, read_deleted='no').\
+            options(undefer('value_blob')).\
             filter_by(key=key).\
             all()
 
     return result
 
 
-@pick_context_manager_reader
-def hvspec_get_by_compute_node_id_and_key(context, compute_node_id, key):
+@select_db_reader_mode
+def hvspec_get_by_compute_node_id_and_key(context, compute_node_id, key,
+                                          use_slave=False):
     result = model_query(context, models.HVMetadata, read_deleted='no').\
+            options(undefer('value_blob')).\
             filter_by(compute_node_id=compute_node_id, key=key).\
             first()
 
@@ -6973,3 +7216,169 @@ def hvspec_get_by_compute_node_id_and_key(context, compute_node_id, key):
         raise exception.HVMetadataNotFound(host=key)
 
     return result
+
+
+@pick_context_manager_reader
+def hvspec_get_by_compute_node_ids_and_keys(context, compute_node_ids=None,
+                                            keys=None):
+    """Returns the metadata of several compute nodes in a single query.
+
+    :param compute_node_ids: list of compute node ids, all nodes when None
+    :param keys: list of keys, all keys when None
+    """
+    if compute_node_ids is not None and not compute_node_ids:
+        return []
+    if keys is not None and not keys:
+        return []
+
+    query = model_query(context, models.HVMetadata, read_deleted='no').\
+            options(undefer('value_blob'))
+    if compute_node_ids is not None:
+        query = query.filter(
+            models.HVMetadata.compute_node_id.in_(compute_node_ids))
+    if keys is not None:
+        query = query.filter(models.HVMetadata.key.in_(keys))
+
+    return query.all()
+
+
+@pick_context_manager_reader
+def hvspec_get_keys_by_compute_node_ids(context, compute_node_ids):
+    """Returns the metadata of the compute nodes without their values.
+
+    :returns: list of (id, compute_node_id, key, updated_at) rows
+    """
+    if not compute_node_ids:
+        return []
+
+    return model_query(context, models.HVMetadata,
+                       args=(models.HVMetadata.id,
+                             models.HVMetadata.compute_node_id,
+                             models.HVMetadata.key,
+                             models.HVMetadata.updated_at),
+                       read_deleted='no').\
+            filter(models.HVMetadata.compute_node_id.in_(compute_node_ids)).\
+            all()
+
+
+@pick_context_manager_reader
+def hvspec_get_trusted_compute_node_ids(context, key, tags=None,
+                                        valid_until=None):
+    """Returns the ids of the compute nodes with a trusted trust report.
+
+    Answered from the trusted, valid_to and hv_spec_tags summary of the
+    trust reports stored under key, the reports themselves are not read.
+
+    :param tags: dict of tag name to list of values the hosts must all have
+    :param valid_until: datetime until which the trust must stay valid,
+                        now when None
+    """
+    if valid_until is None:
+        valid_until = timeutils.utcnow()
+
+    query = model_query(context, models.HVMetadata,
+                        args=(models.HVMetadata.compute_node_id,),
+                        read_deleted='no').\
+            filter_by(key=key).\
+            filter(models.HVMetadata.trusted == true()).\
+            filter(models.HVMetadata.valid_to > valid_until)
+
+    # One join per required tag, each served by the name/value index
+    for name, tag_values in (tags or {}).items():
+        for value in set(tag_values):
+            tag = aliased(models.HVMetadataTag)
+            query = query.join(tag, and_(
+                tag.hv_spec_id == models.HVMetadata.id,
+                tag.name == name,
+                tag.value == value))
+
+    return [row[0] for row in query.all()]
+
+
+@pick_context_manager_reader
+def hvspec_tag_get_all(context, key):
+    """Returns the distinct asset tags of the trust reports stored under key.
+
+    :returns: list of (name, value) tuples
+    """
+    query = context.session.query(models.HVMetadataTag.name,
+                                  models.HVMetadataTag.value).\
+            join(models.HVMetadata,
+                 models.HVMetadata.id == models.HVMetadataTag.hv_spec_id).\
+            filter(models.HVMetadata.key == key).\
+            filter(models.HVMetadata.deleted == 0).\
+            distinct()
+
+    return [(row[0], row[1]) for row in query.all()]
+
+
+def _hvspec_archive_deleted_batch(conn, table, shadow_table, tags_table,
+                                  batch_size, until):
+    """Move one batch of soft-deleted hv_specs rows to shadow_hv_specs.
+
+    :returns: number of rows archived
+    """
+    deleted_column = table.c.deleted
+    where = deleted_column != deleted_column.default.arg
+    if until is not None:
+        where = and_(where, table.c.deleted_at < until)
+
+    # The ids are read first so that the insert and the delete of the batch
+    # only lock the rows they move
+    query_ids = sql.select([table.c.id], where).\
+                    order_by(table.c.id).limit(batch_size)
+    ids = [row[0] for row in conn.execute(query_ids)]
+    if not ids:
+        return 0
+
+    columns = [c.name for c in table.c]
+    insert = shadow_table.insert(inline=True).\
+        from_select(columns,
+                    sql.select([table], table.c.id.in_(ids)))
+    delete_statement = table.delete().where(table.c.id.in_(ids))
+
+    # Group the insert and delete in a transaction.
+    with conn.begin():
+        conn.execute(tags_table.delete().
+                     where(tags_table.c.hv_spec_id.in_(ids)))
+        conn.execute(insert)
+        result_delete = conn.execute(delete_statement)
+
+    return result_delete.rowcount
+
+
+def hvspec_archive_deleted_rows(context, max_rows=None, until=None,
+                                batch_size=1000):
+    """Move soft-deleted hv_specs rows to shadow_hv_specs.
+
+    Rows are moved in transactions of at most batch_size rows, so that the
+    archive never holds long locks on hv_specs.
+
+    :param max_rows: maximum number of rows to archive, all if None
+    :param until: only archive the rows deleted before this datetime
+    :returns: number of rows archived
+    """
+    engine = get_engine()
+    conn = engine.connect()
+    metadata = MetaData()
+    metadata.bind = engine
+    # Default value of deleted is known only by the model
+    table = models.BASE.metadata.tables['hv_specs']
+    tags_table = models.BASE.metadata.tables['hv_spec_tags']
+    shadow_table = Table(_SHADOW_TABLE_PREFIX + 'hv_specs', metadata,
+                         autoload=True)
+
+    rows_archived = 0
+    while max_rows is None or rows_archived < max_rows:
+        if max_rows is None:
+            limit = batch_size
+        else:
+            limit = min(batch_size, max_rows - rows_archived)
+
+        archived = _hvspec_archive_deleted_batch(conn, table, shadow_table,
+                                                 tags_table, limit, until)
+        rows_archived += archived
+        if archived < limit:
+            break
+
+    return rows_archived
@@ -19,6 +19,8 @@
 SQLAlchemy models for nova data.
 """
 
+import zlib
+
 from oslo_config import cfg
 from oslo_db.sqlalchemy import models
 from oslo_utils import timeutils
@@ -28,6 +30,7 @@ from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import orm
 from sqlalchemy import ForeignKey, DateTime, Boolean, Text, Float
+from sqlalchemy import LargeBinary
 
 from nova.db.sqlalchemy import types
 
@@ -1535,9 +1538,43 @@ class HVMetadata(BASE, NovaBase, models.SoftDeleteMixin):
          schema.UniqueConstraint(
             'compute_node_id', 'key', 'deleted',
             name="uniq_hv_specs0compute_node_id0key0deleted"),
+         Index('hv_specs_key_deleted_compute_node_id_idx',
+               'key', 'deleted', 'compute_node_id'),
+         Index('hv_specs_key_deleted_trusted_valid_to_idx',
+               'key', 'deleted', 'trusted', 'valid_to'),
     )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     compute_node_id = Column(Integer, ForeignKey('compute_nodes.id'), nullable=False)
     key = Column(String(255), nullable=False)
     value = Column(Text)
+    # Trust reports in the compressed trust_report_storage format, only
+    # loaded by the queries that need the value
+    value_blob = orm.deferred(Column(LargeBinary))
+    # Summary of the trust report, see HVMetadataAPI
+    trusted = Column(Boolean)
+    valid_to = Column(DateTime)
+    # Hash of the asset tags stored in hv_spec_tags
+    tags_hash = Column(String(64))
+
+    def get_value(self):
+        """Returns value, inflated from value_blob when compressed."""
+        if self.value is None and self.value_blob is not None:
+            return zlib.decompress(self.value_blob).decode('utf-8')
+        return self.value
+
+
+class HVMetadataTag(BASE, NovaBase):
+    """Represents an asset tag of the trust report of a hypervisor."""
+
+    __tablename__ = 'hv_spec_tags'
+    __table_args__ = (
+        Index('hv_spec_tags_hv_spec_id_idx', 'hv_spec_id'),
+        Index('hv_spec_tags_name_value_hv_spec_id_idx',
+              'name', 'value', 'hv_spec_id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    hv_spec_id = Column(Integer, ForeignKey('hv_specs.id'), nullable=False)
+    name = Column(String(255), nullable=False)
+    value = Column(String(255), nullable=False)
@@ -21,15 +21,24 @@ from nova.api.openstack import common
 from nova.api.openstack import extensions
 from nova.api.openstack import wsgi
 from nova import compute
+from nova import context as nova_context
 from nova import exception
 from nova.i18n import _
 from nova import servicegroup
 
+from oslo_config import cfg
+
 import json
 from collections import defaultdict
+from nova.openstack.common import compute_node_cache
 from nova.openstack.common import host_trust_utils
+from nova.openstack.common import trust_report_backend
+from nova.openstack.common import trust_report_rpc
 
 
+CONF = cfg.CONF
+CONF.import_opt('trust_report_storage', 'nova.db.sqlalchemy.api',
+                group='trusted_computing')
 LOG = logging.getLogger(__name__)
 ALIAS = "os-hypervisors"
 authorize = extensions.os_compute_authorizer(ALIAS)
@@ -42,6 +51,16 @@ class HypervisorsController(wsgi.Controller):
         self.api = compute.HVMetadataAPI()
         self.host_api = compute.HostAPI()
         self.servicegroup_api = servicegroup.API()
+        self.trust_backend = trust_report_backend.get_backend()
+        self.trust_utils = host_trust_utils.HostTrustUtils()
+        self.trust_report_api = trust_report_rpc.TrustReportAPI()
+        self.compute_node_cache = compute_node_cache.ComputeNodeCache(
+            self.host_api)
+        try:
+            self.compute_node_cache.prime(nova_context.get_admin_context())
+        except Exception:
+            # Primed again by the first lookup
+            LOG.exception("Unable to prime the compute node cache")
         super(HypervisorsController, self).__init__()
 
     #clean the hv_metadata object for showing to user
@@ -56,15 +75,41 @@ class HypervisorsController(wsgi.Controller):
             clean[attr] = hvspec[attr]
         return clean
 
+    #parse the summary of a pushed trust report, None if it is invalid
+    def _get_trust_summary(self, compute_node_id, value):
+        try:
+            return self.trust_utils.getTrustSummary(value)
+        except Exception:
+            LOG.exception("Invalid trust report for compute node : %s"
+                          % compute_node_id)
+            return None
+
+    #only the report relied upon is kept in the compressed storage format
+    def _is_redundant_report(self, key, param):
+        trust_key = self.trust_utils.getTrustReportKey()
+        return (CONF.trusted_computing.trust_report_storage == 'compressed' and
+                key in ('trust_report', 'signed_trust_report') and
+                key != trust_key and trust_key in param)
+
+    #fan out a newly pushed trust report to the schedulers, which verify it
+    def _notify_trust_report(self, context, compute_node, summary,
+                             trust_report):
+        if not CONF.trusted_computing.trust_report_fanout:
+            return
+
+        hypervisor_hostname = compute_node['hypervisor_hostname']
+        if summary is None:
+            self.trust_report_api.trust_report_deleted(context,
+                                                       hypervisor_hostname)
+        else:
+            self.trust_report_api.trust_report_updated(context,
+                                                       hypervisor_hostname,
+                                                       trust_report)
+
     #search compute node corresponding to given hostname or hostip
     def _search_compute_node(self, context, hostname):
-        compute_node = self.host_api.compute_node_search_by_hypervisor(context, hostname)
-        LOG.debug("compute_node search by hypervisor : %s" % compute_node)
-
-        if not compute_node:
-            compute_node = self.host_api.compute_node_search_by_hostip(context, hostname)
-            LOG.debug("compute_node search by hostip : %s" % compute_node)
-
+        compute_node = self.compute_node_cache.get(context, hostname)
+        LOG.debug("compute_node search : %s" % compute_node)
         return compute_node
 
     def _view_hypervisor(self, hypervisor, service, detail, servers=None,
@@ -111,7 +156,7 @@ class HypervisorsController(wsgi.Controller):
         authorize(context)
         params = body['hostDetailsList']
 
-        hvspecs = []
+        compute_nodes = {}
         for param in params:
             hostname = param['hostname']
 
@@ -119,35 +164,71 @@ class HypervisorsController(wsgi.Controller):
             if not compute_node:
                 LOG.info("No Compute Record found for host : %s" % hostname)
                 continue
+            compute_nodes[hostname] = compute_node
 
-            compute_node_id = compute_node[0]['id']
-            LOG.info("compute_node_id : %s" % compute_node_id)
+        #cached compute nodes may have been deleted by another process,
+        #reports must not be written to their ids
+        compute_nodes = self.compute_node_cache.check(context, compute_nodes)
 
-            existing_hvspecs = self.api.get_hv_specs_by_compute_node_id(context, compute_node_id)
-            LOG.info("existing_hvspecs : %s" % existing_hvspecs)
+        trust_key = self.trust_utils.getTrustReportKey()
 
-            existing_keys = [x['key'] for x in existing_hvspecs]
-            existing_ids = [x['id'] for x in existing_hvspecs]
+        import cgi
+        values = {}
+        summaries = {}
+        notifications = {}
+        redundant = {}
+        for param in params:
+            compute_node = compute_nodes.get(param['hostname'])
+            if compute_node is None:
+                continue
 
-            import cgi
+            compute_node_id = compute_node['id']
+            LOG.info("compute_node_id : %s" % compute_node_id)
+
+            if trust_key in param:
+                summary = self._get_trust_summary(compute_node_id,
+                                                  param[trust_key])
+                # The summary columns are only set on the trust report row
+                summaries[compute_node_id] = {
+                    trust_key: self.trust_utils.getSummaryColumns(summary)}
+                notifications[compute_node_id] = (compute_node, summary,
+                                                  param[trust_key])
+
+            #a later entry for the same host wins
+            node_values = values.setdefault(compute_node_id, {})
             for k,v in param.iteritems():
+                if self._is_redundant_report(k, param):
+                    redundant.setdefault(compute_node_id, set()).add(k)
+                    node_values.pop(k, None)
+                    continue
+                node_values[k] = cgi.escape(v)
+
+        #all the pushed hosts are created or updated in one transaction
+        stored = self.api.set_hv_specs(context, values, summaries=summaries)
+
+        if redundant:
+            existing_by_node = self.api.get_hv_spec_keys_by_compute_node_ids(
+                context, redundant.keys())
+            for compute_node_id, keys in redundant.iteritems():
+                for hvspec in existing_by_node[compute_node_id]:
+                    if hvspec['key'] in keys:
+                        self.api.delete_hv_spec(context, hvspec['id'])
+                        self.trust_backend.delete(compute_node_id,
+                                                  hvspec['key'])
 
-                try:
-                    if not k in existing_keys:
-                        hvspec = self.api.create_hv_spec(
-                            context, compute_node_id, k, cgi.escape(v))
-                    else:
-                        idx = existing_keys.index(k)
-                        hvspec = self.api.update_hv_spec(
-                            context, existing_ids[idx], compute_node_id, k, cgi.escape(v))
+        hvspecs = []
+        for hvspec in stored:
+            self.trust_backend.set(hvspec.compute_node_id, hvspec.key,
+                                   hvspec.value)
 
-                except exception.HVMetadataExists as exc:
-                    raise webob.exc.HTTPConflict(explanation=exc.format_message())
+            hvspec = self._filter_hvspec(hvspec,
+                                         **hvspec_filters)
+            LOG.info("hvspec : %s" % hvspec)
+            hvspecs.append(hvspec)
 
-                hvspec = self._filter_hvspec(hvspec,
-                                             **hvspec_filters)
-                LOG.info("hvspec : %s" % hvspec)
-                hvspecs.append(hvspec)
+        for compute_node, summary, trust_report in notifications.itervalues():
+            self._notify_trust_report(context, compute_node, summary,
+                                      trust_report)
 
         LOG.info("hvspecs : %s" % hvspecs)
         return {'hvMetadataList': hvspecs}
@@ -174,20 +255,27 @@ class HypervisorsController(wsgi.Controller):
         authorize(context)
 
         hv_specs = self.api.get_hv_specs_by_compute_node_id(context, id)
+        if not hv_specs:
+            msg = _("Metadata for compute node with ID '%s' could not be found.") % id
+            raise webob.exc.HTTPNotFound(explanation=msg)
+
         result = defaultdict(list)
         result['id'] = id
 
         for hvspec in hv_specs:
             key = hvspec['key']
             if key == "trust_report":
-                utils = host_trust_utils.HostTrustUtils()
-                value = utils.getTrustReport(id)
+                value = self.trust_utils.getTrustReport(id)
             elif key == "signed_trust_report":
                 value = ""
             else:
                 value = hvspec['value']
             result[key] = value
 
+        #only the signed report is stored in the compressed storage format
+        if "signed_trust_report" in result and "trust_report" not in result:
+            result["trust_report"] = self.trust_utils.getTrustReport(id)
+
         return {'hv_metadata': result}
 
     @extensions.expected_errors(404)
@@ -196,22 +284,14 @@ class HypervisorsController(wsgi.Controller):
         context = req.environ['nova.context']
         authorize(context)
 
-        hv_specs = self.api.get_hv_specs_by_key(context, "trust_report")
         result = defaultdict(list)
 
-        asset_tags = []
-        for hvspec in hv_specs:
-            jsonObj = json.loads(hvspec['value'])
-            LOG.info("jsonObj : %s" % jsonObj)
-            tags = jsonObj['asset_tags']
-            LOG.info("tags : %s" % tags)
-            for k,v in tags.iteritems():
-                for value in v:
-                    LOG.info("name : %s, value : %s" % (k, value))
-                    asset_tags.append({"name" : k, "value" : value})
-
-        #pushing only the unique asset tag entries
-        unique_tags = list(map(dict, frozenset(frozenset(i.items()) for i in asset_tags)))
+        #distinct tags read from the trust report summary, the reports
+        #themselves are not parsed
+        tags = self.api.get_asset_tags(context,
+                                       self.trust_utils.getTrustReportKey())
+        unique_tags = [{"name" : name, "value" : value}
+                       for name, value in tags]
         result['kv_attributes'] = unique_tags
 
         return {'asset_tags': result}
@@ -222,14 +302,20 @@ class HypervisorsController(wsgi.Controller):
         context = req.environ['nova.context']
         authorize(context)
 
-        try:
-            utils = host_trust_utils.HostTrustUtils()
-            trust_report = utils.getTrustReport(id)
-        except (Exception, exception.ComputeHostNotFound):
-            msg = _("Trust Report for compute node with ID '%s' could not be found.") % id
+        msg = _("Trust Report for compute node with ID '%s' could not be found.") % id
+        trust_report = self.trust_utils.getTrustReport(id)
+        if trust_report is None:
             raise webob.exc.HTTPNotFound(explanation=msg)
-        
-        return {'trust_report': json.loads(trust_report)}
+
+        #signed trust reports are already decoded
+        if isinstance(trust_report, basestring):
+            try:
+                trust_report = json.loads(trust_report)
+            except ValueError:
+                LOG.error("Invalid trust report for compute node : %s" % id)
+                raise webob.exc.HTTPNotFound(explanation=msg)
+
+        return {'trust_report': trust_report}
 
     @extensions.expected_errors(404)
     def delete(self, req, id):
@@ -238,10 +324,24 @@ class HypervisorsController(wsgi.Controller):
         authorize(context)
 
         try:
+            hvspec = self.api.get_hv_spec(context, id)
             self.api.delete_hv_spec(context, id)
         except exception.HVMetadataNotFound as exc:
             raise webob.exc.HTTPNotFound(explanation=exc.format_message())
 
+        self.trust_backend.delete(hvspec.compute_node_id, hvspec.key)
+
+        if (CONF.trusted_computing.trust_report_fanout and
+                hvspec.key == self.trust_utils.getTrustReportKey()):
+            try:
+                compute_node = self.host_api.compute_node_get(
+                    context, hvspec.compute_node_id)
+            except exception.ComputeHostNotFound:
+                self.compute_node_cache.invalidate(hvspec.compute_node_id)
+                return
+            self.trust_report_api.trust_report_deleted(
+                context, compute_node.hypervisor_hostname)
+
     @extensions.expected_errors(())
     def index(self, req):
         context = req.environ['nova.context']
@@ -275,7 +375,11 @@ class HypervisorsController(wsgi.Controller):
         try:
             hyp = self.host_api.compute_node_get(context, id)
             req.cache_db_compute_node(hyp)
-        except (ValueError, exception.ComputeHostNotFound):
+        except ValueError:
+            msg = _("Hypervisor with ID '%s' could not be found.") % id
+            raise webob.exc.HTTPNotFound(explanation=msg)
+        except exception.ComputeHostNotFound:
+            self.compute_node_cache.invalidate(int(id))
             msg = _("Hypervisor with ID '%s' could not be found.") % id
             raise webob.exc.HTTPNotFound(explanation=msg)
         service = self.host_api.service_get_by_compute_host(
@@ -289,7 +393,11 @@ class HypervisorsController(wsgi.Controller):
         try:
             hyp = self.host_api.compute_node_get(context, id)
             req.cache_db_compute_node(hyp)
-        except (ValueError, exception.ComputeHostNotFound):
+        except ValueError:
+            msg = _("Hypervisor with ID '%s' could not be found.") % id
+            raise webob.exc.HTTPNotFound(explanation=msg)
+        except exception.ComputeHostNotFound:
+            self.compute_node_cache.invalidate(int(id))
             msg = _("Hypervisor with ID '%s' could not be found.") % id
             raise webob.exc.HTTPNotFound(explanation=msg)
 
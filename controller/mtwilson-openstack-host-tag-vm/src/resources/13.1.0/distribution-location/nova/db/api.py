@@ -259,6 +259,18 @@ def compute_node_get_all_by_host(context, host):
     return IMPL.compute_node_get_all_by_host(context, host)
 
 
+def compute_node_get_all_hostnames(context, compute_node_ids=None):
+    """Get the id, hypervisor hostname and host ip of all compute nodes.
+
+    :param context: The security context
+    :param compute_node_ids: Only these compute nodes when not None
+
+    :returns: List of (id, hypervisor_hostname, host_ip) rows
+    """
+    return IMPL.compute_node_get_all_hostnames(
+        context, compute_node_ids=compute_node_ids)
+
+
 def compute_node_search_by_hypervisor(context, hypervisor_match):
     """Get compute nodes by hypervisor hostname.
 
@@ -2041,6 +2053,17 @@ def hvspec_update(context, hvspec_id, values):
     """Set the given properties on a compute node and update it."""
     return IMPL.hvspec_update(context, hvspec_id, values)
 
+def hvspec_set(context, hvspecs, summaries=None):
+    """Create or update the metadata of one or many compute nodes."""
+    return IMPL.hvspec_set(context, hvspecs, summaries=summaries)
+
+def hvspec_set_values(context, triples, summaries=None):
+    """Create or update (compute node id, key, value) triples.
+
+    :returns: the ids of the stored rows, in the order of the triples
+    """
+    return IMPL.hvspec_set_values(context, triples, summaries=summaries)
+
 def hvspec_delete(context, hvspec_id):
     """Delete a compute node from the database."""
     return IMPL.hvspec_delete(context, hvspec_id)
@@ -2061,6 +2084,34 @@ def hvspec_get_by_key(context, key):
     """Get a specific metadata for all hosts."""
     return IMPL.hvspec_get_by_key(context, key)
 
-def hvspec_get_by_compute_node_id_and_key(context, compute_node_id, key):
+def hvspec_get_by_compute_node_id_and_key(context, compute_node_id, key,
+                                          use_slave=False):
     """Get a hypervisor metadata by compute_node_id and key."""
-    return IMPL.hvspec_get_by_compute_node_id_and_key(context, compute_node_id, key)
+    return IMPL.hvspec_get_by_compute_node_id_and_key(context, compute_node_id,
+                                                      key, use_slave=use_slave)
+
+def hvspec_get_by_compute_node_ids_and_keys(context, compute_node_ids=None,
+                                            keys=None):
+    """Get the metadata of several compute nodes and/or keys."""
+    return IMPL.hvspec_get_by_compute_node_ids_and_keys(
+        context, compute_node_ids=compute_node_ids, keys=keys)
+
+def hvspec_get_keys_by_compute_node_ids(context, compute_node_ids):
+    """Get the id, key and updated_at of the metadata of compute nodes."""
+    return IMPL.hvspec_get_keys_by_compute_node_ids(context, compute_node_ids)
+
+def hvspec_get_trusted_compute_node_ids(context, key, tags=None,
+                                        valid_until=None):
+    """Get the ids of the compute nodes with a trusted trust report."""
+    return IMPL.hvspec_get_trusted_compute_node_ids(context, key, tags=tags,
+                                                    valid_until=valid_until)
+
+def hvspec_tag_get_all(context, key):
+    """Get the distinct asset tags of the trust reports."""
+    return IMPL.hvspec_tag_get_all(context, key)
+
+def hvspec_archive_deleted_rows(context, max_rows=None, until=None,
+                                batch_size=1000):
+    """Move soft-deleted hypervisor metadata to shadow_hv_specs."""
+    return IMPL.hvspec_archive_deleted_rows(context, max_rows=max_rows,
+                                            until=until, batch_size=batch_size)
@@ -24,6 +24,7 @@ from nova import objects
 from nova.objects import base
 from nova.objects import fields
 from nova.objects import pci_device_pool
+from nova.openstack.common import compute_node_cache
 
 CONF = cfg.CONF
 CONF.import_opt('cpu_allocation_ratio', 'nova.compute.resource_tracker')
@@ -341,6 +342,7 @@ class ComputeNode(base.NovaPersistentObject, base.NovaObject,
     @base.remotable
     def destroy(self):
         db.compute_node_delete(self._context, self.id)
+        compute_node_cache.invalidate_all(self.id)
 
     def update_from_virt_driver(self, resources):
         # NOTE(pmurray): the virt driver provides a dict of values that
@@ -0,0 +1,221 @@
+"""Stores from which the host trust reports are read.
+
+HostTrustUtils reads the trust reports through the backend selected with
+the trusted_computing/trust_report_backend option:
+
+    sql    : the hv_specs table, optionally through the oslo.db slave
+             connection (trust_report_use_slave)
+    memory : a process local copy fed by the os-hypervisors push path,
+             falling back to the sql backend for hosts it has not seen yet.
+             Nothing feeds the copy of the other processes, the schedulers
+             included, so a value is only kept trust_report_memory_ttl
+             seconds and never past the valid_to of the report
+    file   : a JSON document {compute_node_id: {key: value}}, for tests and
+             deployments without database access
+"""
+import abc
+import base64
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+
+from nova import db
+from nova import exception
+from nova.openstack.common import asset_tag_utils
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import six
+
+
+LOG = logging.getLogger(__name__)
+
+backend_opts = [
+    cfg.StrOpt('trust_report_backend',
+               default='sql',
+               choices=('sql', 'memory', 'file'),
+               help='Store the host trust reports are read from'),
+    cfg.BoolOpt('trust_report_use_slave',
+                default=False,
+                help='Read the trust reports through the slave database '
+                     'connection when one is configured'),
+    cfg.StrOpt('trust_report_file',
+               default='/var/lib/nova/trust_reports.json',
+               help='JSON document used by the file trust report backend'),
+    cfg.IntOpt('trust_report_memory_ttl',
+               default=60,
+               help='Seconds the memory trust report backend serves a value '
+                    'before reading it again from the database'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(backend_opts, group='trusted_computing')
+
+
+def _get_valid_to(value):
+    # valid_to of a trust report, None if it has none. Only used to stop
+    # serving an expired copy, signed reports are not verified here
+    try:
+        if not asset_tag_utils.is_json(value):
+            payload = str(value).split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            value = base64.urlsafe_b64decode(payload)
+        return asset_tag_utils.parseValidTo(json.loads(value)['valid_to'])
+    except Exception:
+        return None
+
+
+@six.add_metaclass(abc.ABCMeta)
+class TrustReportBackend(object):
+    """Base class of the trust report stores."""
+
+    @abc.abstractmethod
+    def get(self, context, compute_node_id, key):
+        """Returns the value stored for the compute node.
+
+        :raises: HVMetadataNotFound if there is no such value
+        """
+
+    def set(self, compute_node_id, key, value):
+        """Records a value pushed through the os-hypervisors API."""
+        pass
+
+    def delete(self, compute_node_id, key):
+        """Forgets a value deleted through the os-hypervisors API."""
+        pass
+
+
+class SQLTrustReportBackend(TrustReportBackend):
+    """Reads the hv_specs table, the API already wrote the pushed values."""
+
+    def __init__(self):
+        self.use_slave = CONF.trusted_computing.trust_report_use_slave
+
+    def get(self, context, compute_node_id, key):
+        hvspec = db.hvspec_get_by_compute_node_id_and_key(
+            context, compute_node_id, key, use_slave=self.use_slave)
+        return hvspec.get_value()
+
+
+class MemoryTrustReportBackend(TrustReportBackend):
+    """Keeps the pushed values in memory, in front of the sql backend."""
+
+    def __init__(self):
+        self.ttl = CONF.trusted_computing.trust_report_memory_ttl
+        # (compute_node_id, key) -> (value, expires_at, valid_to)
+        self.reports = {}
+        self.fallback = SQLTrustReportBackend()
+
+    def _store(self, cache_key, value):
+        self.reports[cache_key] = (value, time.time() + self.ttl,
+                                   _get_valid_to(value))
+
+    def _is_current(self, entry):
+        value, expires_at, valid_to = entry
+        if time.time() >= expires_at:
+            return False
+        return valid_to is None or datetime.datetime.utcnow() < valid_to
+
+    def get(self, context, compute_node_id, key):
+        cache_key = (str(compute_node_id), key)
+        entry = self.reports.get(cache_key)
+        if entry is not None and self._is_current(entry):
+            return entry[0]
+
+        try:
+            value = self.fallback.get(context, compute_node_id, key)
+        except exception.HVMetadataNotFound:
+            self.reports.pop(cache_key, None)
+            raise
+        self._store(cache_key, value)
+        return value
+
+    def set(self, compute_node_id, key, value):
+        self._store((str(compute_node_id), key), value)
+
+    def delete(self, compute_node_id, key):
+        self.reports.pop((str(compute_node_id), key), None)
+
+
+class FileTrustReportBackend(TrustReportBackend):
+    """Reads and writes the values in a JSON document."""
+
+    def __init__(self, path=None):
+        self.path = path or CONF.trusted_computing.trust_report_file
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.reports = {}
+
+    def _load(self):
+        # Reloaded only when the document changed since the last read
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self.mtime = None
+            self.reports = {}
+            return self.reports
+
+        if mtime != self.mtime:
+            with open(self.path) as report_file:
+                self.reports = json.load(report_file)
+            self.mtime = mtime
+        return self.reports
+
+    def _dump(self, reports):
+        # Written to a temporary file first so readers never see a
+        # partially written document
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as report_file:
+            json.dump(reports, report_file)
+        os.rename(tmp_path, self.path)
+        self.mtime = os.path.getmtime(self.path)
+
+    def get(self, context, compute_node_id, key):
+        with self.lock:
+            reports = self._load()
+        try:
+            return reports[str(compute_node_id)][key]
+        except KeyError:
+            raise exception.HVMetadataNotFound(host=key)
+
+    def set(self, compute_node_id, key, value):
+        with self.lock:
+            reports = dict(self._load())
+            node_reports = dict(reports.get(str(compute_node_id), {}))
+            node_reports[key] = value
+            reports[str(compute_node_id)] = node_reports
+            self._dump(reports)
+            self.reports = reports
+
+    def delete(self, compute_node_id, key):
+        with self.lock:
+            reports = dict(self._load())
+            node_reports = dict(reports.get(str(compute_node_id), {}))
+            if node_reports.pop(key, None) is None:
+                return
+            reports[str(compute_node_id)] = node_reports
+            self._dump(reports)
+            self.reports = reports
+
+
+BACKENDS = {
+    'sql': SQLTrustReportBackend,
+    'memory': MemoryTrustReportBackend,
+    'file': FileTrustReportBackend,
+}
+
+_BACKEND = None
+
+
+def get_backend():
+    """Returns the configured backend, shared by the whole process."""
+    global _BACKEND
+    if _BACKEND is None:
+        name = CONF.trusted_computing.trust_report_backend
+        LOG.info("Using the %s trust report backend" % name)
+        _BACKEND = BACKENDS[name]()
+    return _BACKEND
@@ -14,16 +14,21 @@ import socket
 import ssl
 import base64
 from base64 import b64encode
+import datetime
 import random
+import urllib
 import logging
 import json
-from lxml import etree
+import saml_utils
 
 logging.basicConfig()
 LOG = logging.getLogger(__name__)
 
 ASSET_TAG_SERVICE = getattr(settings, 'ASSET_TAG_SERVICE', {})
 
+# Trust status of the hypervisors whose attestation could not be fetched
+UNKNOWN_TRUST_STATUS = json.dumps({"trust": "unknown", "tags": {}})
+
 class SelectionUtils:
 
     def get_selections(self):
@@ -87,86 +92,98 @@ class SelectionUtils:
         trust_status = self.verify_and_parse_saml(host_data)
         return trust_status
 
+    def get_hypervisors_trust_status(self, hosts):
+        """Trust status of many hypervisors with bulk Mt. Wilson queries.
+
+        :param hosts: hypervisors as listed by nova
+        :returns: dictionary of hypervisor hostname to trust status
+        """
+        untrusted = self.verify_and_parse_saml(None)
+        trust_status = dict((host.hypervisor_hostname, untrusted)
+                            for host in hosts)
+        try:
+            host_uuids = self.get_hypervisor_uuids()
+        except Exception:
+            LOG.exception("Unable to list the hosts registered in Mt. Wilson")
+            return dict((hostname, UNKNOWN_TRUST_STATUS)
+                        for hostname in trust_status)
+
+        node_uuids = {}
+        for host in hosts:
+            # Hosts are registered either with the hostname or the host IP
+            host_uuid = (host_uuids.get(host.hypervisor_hostname) or
+                         host_uuids.get(host.host_ip))
+            if host_uuid:
+                node_uuids[host.hypervisor_hostname] = host_uuid
+
+        # Hosts of a failed request are shown as unknown rather than
+        # failing the whole page
+        attestservice = AttestationService()
+        host_uuids = list(set(node_uuids.values()))
+        assertions = {}
+        failed = set()
+        for start in range(0, len(host_uuids), attestservice.batch_size):
+            batch = host_uuids[start:start + attestservice.batch_size]
+            try:
+                assertions.update(attestservice.do_attestation_batch(batch))
+            except Exception:
+                LOG.exception("Unable to attest %d hosts" % len(batch))
+                failed.update(batch)
+
+        for hostname, host_uuid in node_uuids.items():
+            if host_uuid in failed:
+                trust_status[hostname] = UNKNOWN_TRUST_STATUS
+            elif host_uuid in assertions:
+                try:
+                    trust_status[hostname] = self.verify_and_parse_saml(
+                        assertions[host_uuid])
+                except Exception:
+                    LOG.exception("Invalid attestation of %s" % hostname)
+                    trust_status[hostname] = UNKNOWN_TRUST_STATUS
+        return trust_status
+
+    def _get_hosts(self, host_url):
+        host = ASSET_TAG_SERVICE['IP']
+        port = ASSET_TAG_SERVICE['port']
+        auth_blob = ASSET_TAG_SERVICE['auth_blob']
+        server_ca_file = ASSET_TAG_SERVICE['attestation_server_ca_file']
+        # Setup the SSL context for certificate verification
+
+        if  hasattr(ssl,'SSLContext') and server_ca_file:
+            LOG.info("Using SSL context HTTPS client connection to attestation server with SSL certificate verification")
+            as_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+            as_context.verify_mode = ssl.CERT_REQUIRED
+            as_context.check_hostname = True
+            as_context.load_verify_locations(server_ca_file)
+            c = httplib.HTTPSConnection(host, port=port, context=as_context)
+        else:
+            LOG.info("Using socket HTTPS client connection to attestation server with SSL certificate verification")
+            c = HTTPSClientAuthConnection(host, port, key_file=None, cert_file=None, ca_file=server_ca_file)
+
+        userAndPass = b64encode(auth_blob).decode("ascii")
+        headers = { 'Authorization' : 'Basic %s' %  userAndPass , 'Accept': 'application/json'}
+        c.request('GET', host_url, headers=headers)
+        res = c.getresponse()
+        res_data = res.read()
+        return json.loads(res_data)['hosts']
+
+    def get_hypervisor_uuids(self):
+        hosts = self._get_hosts(ASSET_TAG_SERVICE['host_url'])
+        return dict((host['name'], host['id']) for host in hosts)
+
     def get_hypervisor_uuid(self, hostname):
         try:
-            host = ASSET_TAG_SERVICE['IP']
-            port = ASSET_TAG_SERVICE['port']
             host_url = ASSET_TAG_SERVICE['host_url'] + "?nameEqualTo=" + hostname
-            auth_blob = ASSET_TAG_SERVICE['auth_blob']
-            server_ca_file = ASSET_TAG_SERVICE['attestation_server_ca_file']
-            # Setup the SSL context for certificate verification
-
-            if  hasattr(ssl,'SSLContext') and server_ca_file:
-                LOG.info("Using SSL context HTTPS client connection to attestation server with SSL certificate verification")
-                as_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-                as_context.verify_mode = ssl.CERT_REQUIRED
-                as_context.check_hostname = True
-                as_context.load_verify_locations(server_ca_file)
-                c = httplib.HTTPSConnection(host, port=port, context=as_context)
-            else:
-                LOG.info("Using socket HTTPS client connection to attestation server with SSL certificate verification")
-                c = HTTPSClientAuthConnection(host, port, key_file=None, cert_file=None, ca_file=server_ca_file)
-			
-            userAndPass = b64encode(auth_blob).decode("ascii")
-            headers = { 'Authorization' : 'Basic %s' %  userAndPass , 'Accept': 'application/json'}
-            c.request('GET', host_url, headers=headers)
-            res = c.getresponse()
-            res_data = res.read()
-            return json.loads(res_data)['hosts'][0]['id']
+            return self._get_hosts(host_url)[0]['id']
         except Exception:
             LOG.error("Exception")
             return ""
 
-
     def verify_and_parse_saml(self, saml_data):
-        trust = False
-        asset_tag = {}
+        assertion = saml_utils.parse_host_assertion(saml_data)
         asset_tag_str = {}
-
-        # Intel(R) Cloud Integrity Technology service responds with a JSON in case the given host name is not found
-        # Need to update this after the mt. wilson service is updated to return consistent message formats
-        try:
-            if json.loads(saml_data):
-                return "{'trust': 'false'}"
-        except:
-            LOG.debug("System does not exist in the Mt. Wilson portal")
-
-        ns = {'saml2p': '{urn:oasis:names:tc:SAML:2.0:protocol}',
-              'saml2': '{urn:oasis:names:tc:SAML:2.0:assertion}'}
-
-        try:
-            # xpath strings
-            xp_attributestatement = '{saml2}AttributeStatement/{saml2}Attribute'.format(**ns)
-            xp_attributevalue = '{saml2}AttributeValue'.format(**ns)
-
-            doc = etree.XML(saml_data)
-            elements = doc.findall(xp_attributestatement)
-            trust_flag = ""
-            asset_flag = ""
-            asset_tooltip= ""
-    
-            for el in elements:
-                if el.attrib['Name'].lower() == 'trusted':
-                    if el.find(xp_attributevalue).text == 'true':
-                        trust_flag = "Trust = true"
-                        asset_tag_str["trust"] =  "true"
-                        asset_tag_str["tags"] =  {}
-                    else:
-                        trust_flag = "Trust = Untrusted"
-                        asset_tag_str["trust"] =  "false"
-                        asset_tag_str["tags"] =  {}
-                elif el.attrib['Name'].lower().startswith("tag["):
-                    asset_flag = ", Location = true"
-                    if(asset_tooltip == ""):
-                        asset_tooltip = ", tooltip = "
-                    asset_tooltip +=  el.attrib['Name'].lower().split('[')[1].split(']')[0] + ': ' +  el.find(xp_attributevalue).text + ' & '
-                    asset_tag_str["tags"][el.attrib['Name'].lower().split('[')[1].split(']')[0]] =   el.find(xp_attributevalue).text
-
-            #return trust_flag + asset_flag + asset_tooltip[:-2]
-        except:
-            LOG.error("Exception")
-            asset_tag_str["trust"] =  "false"
-            asset_tag_str["tags"] =  {}
+        asset_tag_str["trust"] = "true" if assertion.trusted else "false"
+        asset_tag_str["tags"] = assertion.asset_tags
         return json.dumps(asset_tag_str)
 
 
@@ -215,20 +232,24 @@ class AttestationService(object):
         self.cert_file = None
         self.ca_file = ASSET_TAG_SERVICE['attestation_server_ca_file']
         self.request_count = 100
+        self.batch_size = ASSET_TAG_SERVICE.get('attestation_batch_size', 50)
+        # Older SAML assertions have expired
+        self.batch_max_age = ASSET_TAG_SERVICE.get('attestation_batch_max_age',
+                                                   3600)
 
     def _do_request(self, method, action_url, params, headers):
         # Connects to the server and issues a request.
+        # :param params: query string of the host-attestations search
         # :returns: result data
         # :raises: IOError if the request fails
 
-        #action_url = "%s" % (self.api_url)
-        action_url = "%s?host_id=%s&limit=1" % (self.api_url, params) #"%s" % (self.api_url)
+        action_url = "%s?%s" % (self.api_url, params)
         try:
             c = HTTPSClientAuthConnection(self.host, self.port,
                                           key_file=self.key_file,
                                           cert_file=self.cert_file,
                                           ca_file=self.ca_file)
-            c.request(method, action_url, json.dumps(params), headers)
+            c.request(method, action_url, headers=headers)
             res = c.getresponse()
             status_code = res.status
             if status_code in (httplib.OK,
@@ -241,18 +262,17 @@ class AttestationService(object):
         except (socket.error, IOError):
             return IOError, None
 
-    def _request(self, cmd, subcmd, host_uuid):
+    def _request(self, cmd, subcmd, query,
+                 accept='application/samlassertion+xml'):
         # Setup the header & body for the request
-        params = {"host_uuid": host_uuid}
-
         headers = {}
         auth = base64.encodestring(self.auth_blob).replace('\n', '')
         if self.auth_blob:
             headers['x-auth-blob'] = self.auth_blob
             headers['Authorization'] = "Basic " + auth
-            headers['Accept'] = 'application/samlassertion+xml'
+            headers['Accept'] = accept
             #headers['Content-Type'] = 'application/json'
-        status, res = self._do_request(cmd, subcmd, host_uuid, headers)
+        status, res = self._do_request(cmd, subcmd, query, headers)
         if status == httplib.OK:
             data = res.read()
             return status, data
@@ -269,8 +289,50 @@ class AttestationService(object):
 
         #status, data = self._request("POST", "PollHosts", hosts)
         #status, data = self._request("POST", "", host_uuid)
-        status, data = self._request("GET", "", host_uuid)
+        status, data = self._request("GET", "", "host_id=%s&limit=1" % host_uuid)
 
         return data 
 
+    def do_attestation_batch(self, host_uuids):
+        """Fetches the latest attestation of many hosts at once.
+
+        Only the attestations of the last attestation_batch_max_age seconds
+        are requested rather than the whole history of the hosts.
+
+        :param host_uuids: Mt. Wilson host UUIDs
+        :returns: dictionary of host UUID to SAML assertion, hosts without
+                  any attestation are left out
+        :raises: IOError if a request fails
+        """
+        assertions = {}
+        created = {}
+        host_uuids = list(host_uuids)
+        from_date = (datetime.datetime.utcnow() -
+                     datetime.timedelta(seconds=self.batch_max_age))
+        from_date = from_date.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        for start in range(0, len(host_uuids), self.batch_size):
+            batch = host_uuids[start:start + self.batch_size]
+            query = urllib.urlencode([('host_id', host_uuid)
+                                      for host_uuid in batch] +
+                                     [('fromDate', from_date)])
+            status, data = self._request("GET", "", query,
+                                         accept='application/json')
+            if data is None:
+                raise IOError("Bulk attestation request failed with status "
+                              "%s" % status)
+
+            for attestation in json.loads(data).get('host_attestations', []):
+                host_uuid = attestation.get('host_uuid')
+                saml = attestation.get('saml')
+                if not host_uuid or not saml:
+                    continue
+                # ISO 8601 timestamps of the same format sort as strings
+                timestamp = attestation.get('created', '')
+                if host_uuid not in created or timestamp > created[host_uuid]:
+                    created[host_uuid] = timestamp
+                    assertions[host_uuid] = saml
+
+        return assertions
+
 
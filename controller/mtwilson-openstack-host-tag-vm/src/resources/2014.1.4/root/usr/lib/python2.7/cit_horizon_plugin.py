@@ -93,6 +93,9 @@ def generate_attestation_status_str(policy, policy_status, asset_tag):
             if (tags != None and tags != {}):
                 tag_image_tooltip = 'Trust: Yes; Asset tags: ' + json.dumps(tags)
                 trust_type = 'trust_and_geo'
+        elif(tag_dictionary.get('trust') == 'unknown'):
+            # The attestation server could not be reached
+            tag_image_tooltip = 'Trust: Unknown; Asset Tags: Unknown'
         
     return return_string.format(trust_type, tag_image_tooltip +  '; ' + launch_image_tooltip, launch_image_name, tag_image_tooltip + '; ' + launch_image_tooltip)
     #return return_string.format(trust_type, tag_image_tooltip, launch_image_name, launch_image_tooltip)
@@ -157,8 +160,12 @@ project_instances_view.IndexView.table_class = GeoTagInstancesTable
 # BEGIN: Changes to add the Geo Tag column in the hypervisors table view
 
 def get_host_trust_status(hypervisor):
-    utils = horizon_utils.SelectionUtils()
-    return generate_attestation_status_str('none', 'na', utils.get_hypervisr_trust_status(hypervisor))
+    # Filled in for the whole page by GeoTagHypervisorsTable.get_rows
+    trust_status = getattr(hypervisor, 'trust_status', None)
+    if trust_status is None:
+        utils = horizon_utils.SelectionUtils()
+        trust_status = utils.get_hypervisr_trust_status(hypervisor)
+    return generate_attestation_status_str('none', 'na', trust_status)
 
 class GeoTagHypervisorsTable(hypervisors_tables.AdminHypervisorsTable):
 
@@ -170,6 +177,15 @@ class GeoTagHypervisorsTable(hypervisors_tables.AdminHypervisorsTable):
         name = "hypervisors"
         columns = ('hostname', 'geo_tag', 'vcpus', 'vcpus_used', 'memory', 'memory_used', 'local', 'local_used', 'running_vms')
 
+    def get_rows(self):
+        # Attest all listed hypervisors with bulk queries instead of two
+        # Mt. Wilson round trips per row
+        utils = horizon_utils.SelectionUtils()
+        trust_status = utils.get_hypervisors_trust_status(self.data)
+        for hypervisor in self.data:
+            hypervisor.trust_status = trust_status.get(hypervisor.hypervisor_hostname)
+        return super(GeoTagHypervisorsTable, self).get_rows()
+
 hypervisors_view.AdminIndexView.table_class = GeoTagHypervisorsTable
 # END: Changes to add the Geo Tag column in the hypervisors table view
 
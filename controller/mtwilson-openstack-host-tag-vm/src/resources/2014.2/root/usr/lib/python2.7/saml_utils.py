@@ -0,0 +1,93 @@
+import collections
+import datetime
+import logging
+
+from lxml import etree
+
+
+LOG = logging.getLogger(__name__)
+
+SAML2_NS = 'urn:oasis:names:tc:SAML:2.0:assertion'
+
+# Qualified names are built once, the parse only compares them against
+# elem.tag and never evaluates a path expression per attribute
+_ATTRIBUTE_STATEMENT = etree.QName(SAML2_NS, 'AttributeStatement').text
+_CONDITIONS = etree.QName(SAML2_NS, 'Conditions').text
+_SUBJECT_CONFIRMATION_DATA = etree.QName(SAML2_NS, 'SubjectConfirmationData').text
+_VALIDITY_TAGS = (_CONDITIONS, _SUBJECT_CONFIRMATION_DATA)
+
+
+# trusted    : True only if the assertion carries Trusted=true
+# asset_tags : dict of lower cased tag name -> tag value, as sent by Mt. Wilson
+# valid_from : naive UTC datetime (NotBefore) or None
+# valid_to   : naive UTC datetime (NotOnOrAfter) or None
+HostAssertion = collections.namedtuple('HostAssertion',
+                                       ['trusted', 'asset_tags',
+                                        'valid_from', 'valid_to'])
+
+
+def untrusted_assertion():
+    return HostAssertion(False, {}, None, None)
+
+
+def _parse_time(value):
+    # Timestamps are xs:dateTime in UTC (2016-06-01T10:00:00.000Z), sliced
+    # by hand because time.strptime dominates the cost of a small assertion
+    if not value:
+        return None
+    try:
+        return datetime.datetime(int(value[0:4]), int(value[5:7]),
+                                 int(value[8:10]), int(value[11:13]),
+                                 int(value[14:16]), int(value[17:19]))
+    except ValueError:
+        LOG.debug("Unable to parse SAML timestamp : %s" % value)
+        return None
+
+
+def parse_host_assertion(saml_data):
+    """Parses a Mt. Wilson host attestation SAML assertion.
+
+    Mt. Wilson answers with a JSON document instead of an assertion when the
+    host is not registered, so any payload that does not start like an XML
+    document is reported as untrusted without invoking the XML parser.
+
+    :param saml_data: the assertion as returned by /host-attestations
+    :returns: HostAssertion
+    """
+    if not saml_data:
+        return untrusted_assertion()
+
+    if isinstance(saml_data, type(u'')):
+        saml_data = saml_data.encode('utf-8')
+
+    if not saml_data.lstrip()[0:1] == b'<':
+        LOG.debug("System does not exist in the Mt. Wilson portal")
+        return untrusted_assertion()
+
+    trusted = False
+    asset_tags = {}
+    valid_from = None
+    valid_to = None
+
+    try:
+        root = etree.fromstring(saml_data)
+
+        for elem in root.iter(_VALIDITY_TAGS):
+            valid_from = _parse_time(elem.get('NotBefore')) or valid_from
+            valid_to = _parse_time(elem.get('NotOnOrAfter')) or valid_to
+
+        statement = root.find(_ATTRIBUTE_STATEMENT)
+        for attribute in (statement if statement is not None else ()):
+            name = attribute.get('Name', '').lower()
+            # The first (and only) child is the saml2:AttributeValue
+            value = (attribute[0].text if len(attribute) else None) or ''
+            if name == 'trusted':
+                trusted = value == 'true'
+            elif name.startswith('tag['):
+                asset_tags[name[4:].partition(']')[0]] = value
+
+    except etree.XMLSyntaxError:
+        LOG.exception("Unable to parse the SAML assertion")
+        return untrusted_assertion()
+
+    return HostAssertion(trusted, asset_tags, valid_from, valid_to)
@@ -44,6 +44,7 @@ the Open Attestation project at:
     https://github.com/OpenAttestation/OpenAttestation
 """
 
+import datetime
 import httplib
 import socket
 import ssl
@@ -62,11 +63,16 @@ from oslo_log import log as logging
 #from nova.openstack.common import timeutils
 from oslo_utils import timeutils
 from nova.scheduler import filters
+from nova.openstack.common import saml_utils
 
-from lxml import etree
 import base64
 from base64 import b64encode
 import random
+import urllib
+
+import eventlet
+from eventlet import greenpool
+import threading
 
 LOG = logging.getLogger(__name__)
 
@@ -89,6 +95,22 @@ trusted_opts = [
     cfg.IntOpt('attestation_auth_timeout',
                default=60,
                help='Attestation status cache valid period length'),
+    cfg.IntOpt('attestation_pool_size',
+               default=20,
+               help='Maximum number of hosts attested concurrently'),
+    cfg.IntOpt('attestation_deadline',
+               default=10,
+               help='Seconds to wait for the attestation of all candidate '
+                    'hosts; hosts not attested in time are filtered out'),
+    cfg.IntOpt('attestation_batch_size',
+               default=50,
+               help='Number of hosts queried per bulk host-attestations '
+                    'request'),
+    cfg.IntOpt('attestation_batch_max_age',
+               default=3600,
+               help='Seconds back the bulk host-attestations requests '
+                    'search, the SAML assertions of older attestations '
+                    'have expired'),
 ]
 
 CONF = cfg.CONF
@@ -96,6 +118,14 @@ trust_group = cfg.OptGroup(name='trusted_computing', title='Trust parameters')
 CONF.register_group(trust_group)
 CONF.register_opts(trusted_opts, group=trust_group)
 
+# Attestation results of the scheduler process keyed by hypervisor hostname,
+# each entry is (attested_at, trust, asset_tag). Icehouse and Juno create the
+# filter again for every scheduling request, so the cache and its warm-up
+# belong to the process rather than to the filter.
+_ATTESTATION_CACHE = {}
+_ATTESTATION_CACHE_LOCK = threading.Lock()
+_WARM_UP_STARTED = False
+
 class HTTPSClientAuthConnection(httplib.HTTPSConnection):
     """
     Class to make a HTTPS connection, with support for full client-based
@@ -141,21 +171,25 @@ class AttestationService(object):
         self.cert_file = None
         self.ca_file = CONF.trusted_computing.attestation_server_ca_file
         self.request_count = 100
+        self.timeout = CONF.trusted_computing.attestation_deadline
+        self.batch_size = CONF.trusted_computing.attestation_batch_size
+        self.batch_max_age = CONF.trusted_computing.attestation_batch_max_age
 
     def _do_request(self, method, action_url, params, headers):
         # Connects to the server and issues a request.
+        # :param params: query string of the host-attestations search
         # :returns: result data
         # :raises: IOError if the request fails
 
-        #action_url = "%s" % (self.api_url)
-        action_url = "%s?host_id=%s&limit=1" % (self.api_url, params)
+        action_url = "%s?%s" % (self.api_url, params)
         try:
             c = HTTPSClientAuthConnection(self.host, self.port,
                                           key_file=self.key_file,
                                           cert_file=self.cert_file,
-                                          ca_file=self.ca_file)
+                                          ca_file=self.ca_file,
+                                          timeout=self.timeout)
 
-            c.request(method, action_url, json.dumps(params), headers)
+            c.request(method, action_url, headers=headers)
             res = c.getresponse()
             status_code = res.status
             if status_code in (httplib.OK,
@@ -168,19 +202,17 @@ class AttestationService(object):
         except (socket.error, IOError):
             return IOError, None
 
-    def _request(self, cmd, subcmd, host_uuid):
+    def _request(self, cmd, subcmd, query,
+                 accept='application/samlassertion+xml'):
         # Setup the header & body for the request
-        params = {"host_uuid": host_uuid}
-
         headers = {}
         auth = base64.encodestring(self.auth_blob).replace('\n', '')
         if self.auth_blob:
             headers['x-auth-blob'] = self.auth_blob
             headers['Authorization'] = "Basic " + auth
-            headers['Accept'] = 'application/samlassertion+xml'
+            headers['Accept'] = accept
             #headers['Content-Type'] = 'application/json'
-        #status, res = self._do_request(cmd, subcmd, params, headers)
-        status, res = self._do_request(cmd, subcmd, host_uuid, headers)
+        status, res = self._do_request(cmd, subcmd, query, headers)
         if status == httplib.OK:
             data = res.read()
             return status, data
@@ -197,25 +229,104 @@ class AttestationService(object):
 
         #status, data = self._request("POST", "PollHosts", hosts)
         #status, data = self._request("POST", "", host_uuid)
-        status, data = self._request("GET", "", host_uuid)
+        status, data = self._request("GET", "", "host_id=%s&limit=1" % host_uuid)
 
         return data 
 
+    def do_attestation_batch(self, host_uuids):
+        """Fetches the latest attestation of many hosts at once.
+
+        Hosts are searched `attestation_batch_size` at a time, with one
+        host_id parameter per host. Only the attestations of the last
+        `attestation_batch_max_age` seconds are requested rather than the
+        whole history of the hosts, and the combined JSON response is split
+        per host keeping only the most recent attestation of each.
+
+        :param host_uuids: Mt. Wilson host UUIDs
+        :returns: dictionary of host UUID to SAML assertion, hosts without
+                  any attestation are left out
+        """
+        assertions = {}
+        created = {}
+        host_uuids = list(host_uuids)
+        from_date = (timeutils.utcnow() -
+                     datetime.timedelta(seconds=self.batch_max_age))
+        from_date = from_date.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        for start in range(0, len(host_uuids), self.batch_size):
+            batch = host_uuids[start:start + self.batch_size]
+            query = urllib.urlencode([('host_id', host_uuid)
+                                      for host_uuid in batch] +
+                                     [('fromDate', from_date)])
+            status, data = self._request("GET", "", query,
+                                         accept='application/json')
+            if data is None:
+                LOG.warn("Bulk attestation request failed with status %s"
+                         % status)
+                continue
+
+            for attestation in json.loads(data).get('host_attestations', []):
+                host_uuid = attestation.get('host_uuid')
+                saml = attestation.get('saml')
+                if not host_uuid or not saml:
+                    continue
+                # ISO 8601 timestamps of the same format sort as strings
+                timestamp = attestation.get('created', '')
+                if host_uuid not in created or timestamp > created[host_uuid]:
+                    created[host_uuid] = timestamp
+                    assertions[host_uuid] = saml
+
+        return assertions
+
 class TrustAssertionFilter(filters.BaseHostFilter):
 
     def __init__(self):
+        global _WARM_UP_STARTED
         self.attestservice = AttestationService()
-        self.compute_nodes = {}
-        admin = context.get_admin_context()
 
-        # Fetch compute node list to initialize the compute_nodes,
+        # The first filter of the process attests all the compute nodes,
         # so that we don't need poll OAT service one by one for each
         # host in the first round that scheduler invokes us.
-        self.compute_nodes = db.compute_node_get_all(admin)
-
-
-    def host_passes(self, host_state, filter_properties):
-        """Only return hosts with required Trust level."""
+        with _ATTESTATION_CACHE_LOCK:
+            warm_up = not _WARM_UP_STARTED
+            _WARM_UP_STARTED = True
+        if warm_up:
+            eventlet.spawn_n(self._warm_up_attestation_cache)
+
+    def _warm_up_attestation_cache(self):
+        """Attests all known compute nodes with bulk Mt. Wilson queries."""
+        try:
+            admin = context.get_admin_context()
+            compute_nodes = db.compute_node_get_all(admin)
+            host_uuids = self.get_hypervisor_uuids()
+
+            node_uuids = {}
+            for compute_node in compute_nodes:
+                hostname = compute_node['hypervisor_hostname']
+                host_uuid = (host_uuids.get(hostname) or
+                             host_uuids.get(str(compute_node['host_ip'])))
+                if host_uuid:
+                    node_uuids[hostname] = host_uuid
+
+            assertions = self.attestservice.do_attestation_batch(
+                set(node_uuids.values()))
+
+            attested_at = timeutils.utcnow()
+            warmed_up = 0
+            for hostname, host_uuid in node_uuids.items():
+                if host_uuid in assertions:
+                    trust, asset_tag = self.verify_and_parse_saml(
+                        assertions[host_uuid])
+                    self._cache_attestation(hostname, trust, asset_tag,
+                                            attested_at)
+                    warmed_up += 1
+            LOG.info("Attestation cache warmed up with %d of %d compute nodes"
+                     % (warmed_up, len(compute_nodes)))
+        except Exception:
+            LOG.exception("Unable to warm up the attestation cache")
+
+    def _get_trust_policy(self, filter_properties):
+        """Returns (verify_trust_status, verify_asset_tag, tag_selections)."""
         verify_asset_tag = False
         verify_trust_status = False
 
@@ -235,11 +346,30 @@ class TrustAssertionFilter(filters.BaseHostFilter):
             if tag_selections != None and tag_selections != {} and  tag_selections != 'None':
                 verify_asset_tag = True
 
-        
-        if not verify_trust_status:
-            # Filter returns success/true if neither trust or tag has to be verified.
-            return True
+        return verify_trust_status, verify_asset_tag, tag_selections
+
+    def _get_cached_attestation(self, hostname):
+        with _ATTESTATION_CACHE_LOCK:
+            entry = _ATTESTATION_CACHE.get(hostname)
+            if entry is None:
+                return None
+
+            attested_at, trust, asset_tag = entry
+            if timeutils.is_older_than(attested_at,
+                                       CONF.trusted_computing.attestation_auth_timeout):
+                del _ATTESTATION_CACHE[hostname]
+                return None
+            return trust, asset_tag
 
+    def _cache_attestation(self, hostname, trust, asset_tag,
+                           attested_at=None):
+        if attested_at is None:
+            attested_at = timeutils.utcnow()
+        with _ATTESTATION_CACHE_LOCK:
+            _ATTESTATION_CACHE[hostname] = (attested_at, trust, asset_tag)
+
+    def _attest_host(self, host_state):
+        """Attests a single host and caches the (trust, asset_tag) result."""
         # Get the host UUID based on the hostname
         host_uuid = self.get_hypervisor_uuid(host_state.hypervisor_hostname)
         if (host_uuid == ''):
@@ -247,10 +377,63 @@ class TrustAssertionFilter(filters.BaseHostFilter):
             host_uuid = self.get_hypervisor_uuid(host_state.host_ip)
 
         if (host_uuid == ''):
-            return False
+            return False, {}
 
         host_data = self.attestservice.do_attestation(host_uuid)
         trust, asset_tag = self.verify_and_parse_saml(host_data)
+        self._cache_attestation(host_state.hypervisor_hostname, trust,
+                                asset_tag)
+        return trust, asset_tag
+
+    def _attest_hosts(self, host_states):
+        """Attests all uncached hosts concurrently on a bounded green pool.
+
+        Hosts whose attestation failed or has not completed within
+        `attestation_deadline` seconds are reported as untrusted.
+        """
+        attestations = {}
+        pending = []
+        for host_state in host_states:
+            hostname = host_state.hypervisor_hostname
+            cached = self._get_cached_attestation(hostname)
+            if cached is not None:
+                attestations[hostname] = cached
+            elif hostname not in attestations:
+                attestations[hostname] = None
+                pending.append(host_state)
+
+        if not pending:
+            return attestations
+
+        def _attest(host_state):
+            hostname = host_state.hypervisor_hostname
+            try:
+                attestations[hostname] = self._attest_host(host_state)
+            except Exception:
+                LOG.exception("Attestation of host %s failed" % hostname)
+                attestations[hostname] = (False, {})
+
+        pool = greenpool.GreenPool(CONF.trusted_computing.attestation_pool_size)
+        threads = []
+        with eventlet.Timeout(CONF.trusted_computing.attestation_deadline, False):
+            for host_state in pending:
+                threads.append(pool.spawn(_attest, host_state))
+            pool.waitall()
+
+        # spawn rather than spawn_n, whose raw greenlets have no kill(). A
+        # killed attestation never records its result
+        for gt in threads:
+            gt.kill()
+
+        for hostname, result in attestations.items():
+            if result is None:
+                LOG.warn("Attestation of host %s did not complete within the "
+                         "deadline" % hostname)
+                attestations[hostname] = (False, {})
+        return attestations
+
+    def _attestation_passes(self, trust, asset_tag, verify_asset_tag,
+                            tag_selections):
         if not trust:
             return False
 
@@ -260,43 +443,53 @@ class TrustAssertionFilter(filters.BaseHostFilter):
             LOG.error(tag_selections)
             return self.verify_asset_tag(asset_tag, tag_selections)
 
-
         return True
 
+    def filter_all(self, filter_obj_list, filter_properties):
+        """Attests the uncached candidate hosts concurrently, then filters
+        them in a single pass.
+        """
+        host_states = list(filter_obj_list)
+        verify_trust_status, verify_asset_tag, tag_selections = \
+            self._get_trust_policy(filter_properties)
 
-    def verify_and_parse_saml(self, saml_data):
-        trust = False
-        asset_tag = {}
+        if not verify_trust_status:
+            # Filter returns success/true if neither trust or tag has to be verified.
+            return host_states
 
-        # Trust attestation service responds with a JSON in case the given host name is not found
-        # Need to update this after the mt. wilson service is updated to return consistent message formats
-        try:
-            if json.loads(saml_data):
-                return trust, asset_tag
-        except:
-            LOG.debug("System does not exist in the Mt. Wilson portal")
+        attestations = self._attest_hosts(host_states)
 
-        ns = {'saml2p': '{urn:oasis:names:tc:SAML:2.0:protocol}',
-              'saml2': '{urn:oasis:names:tc:SAML:2.0:assertion}'}
+        passed_hosts = []
+        for host_state in host_states:
+            trust, asset_tag = attestations[host_state.hypervisor_hostname]
+            if self._attestation_passes(trust, asset_tag, verify_asset_tag,
+                                        tag_selections):
+                passed_hosts.append(host_state)
+        return passed_hosts
 
-        try:
-            # xpath strings
-            xp_attributestatement = '{saml2}AttributeStatement/{saml2}Attribute'.format(**ns)
-            xp_attributevalue = '{saml2}AttributeValue'.format(**ns)
-
-            doc = etree.XML(saml_data)
-            elements = doc.findall(xp_attributestatement)
-    
-            for el in elements:
-                if el.attrib['Name'].lower() == 'trusted':
-                    if el.find(xp_attributevalue).text == 'true':
-                        trust = True
-                elif el.attrib['Name'].lower().startswith("tag"):
-                    asset_tag[el.attrib['Name'].lower().split('[')[1].split(']')[0].lower()] = el.find(xp_attributevalue).text.lower()
+    def host_passes(self, host_state, filter_properties):
+        """Only return hosts with required Trust level."""
+        verify_trust_status, verify_asset_tag, tag_selections = \
+            self._get_trust_policy(filter_properties)
 
-            return trust, asset_tag
-        except:
-            return trust, asset_tag
+        if not verify_trust_status:
+            # Filter returns success/true if neither trust or tag has to be verified.
+            return True
+
+        cached = self._get_cached_attestation(host_state.hypervisor_hostname)
+        if cached is None:
+            cached = self._attest_host(host_state)
+        trust, asset_tag = cached
+
+        return self._attestation_passes(trust, asset_tag, verify_asset_tag,
+                                        tag_selections)
+
+
+    def verify_and_parse_saml(self, saml_data):
+        assertion = saml_utils.parse_host_assertion(saml_data)
+        asset_tag = dict((name, value.lower())
+                         for name, value in assertion.asset_tags.items())
+        return assertion.trusted, asset_tag
 
     # Verifies the asset tag match with the tag selections provided by the user.
     def verify_asset_tag(self, host_tags, tag_selections):
@@ -320,34 +513,43 @@ class TrustAssertionFilter(filters.BaseHostFilter):
 
         return ret_status
 
+    # Query the Mt. Wilson hosts resource and return the list of hosts
+    def _get_hosts(self, host_url):
+        host = CONF.trusted_computing.attestation_server
+        port = CONF.trusted_computing.attestation_port
+        auth_blob = CONF.trusted_computing.attestation_auth_blob
+        LOG.debug(host_url)
+        if  hasattr(ssl,'SSLContext') and CONF.trusted_computing.attestation_server_ca_file:
+            LOG.info("Using SSL context HTTPS client connection to attestation server with SSL certificate verification")
+            as_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+            as_context.verify_mode = ssl.CERT_REQUIRED
+            as_context.check_hostname = True
+            as_context.load_verify_locations(CONF.trusted_computing.attestation_server_ca_file)
+            c = httplib.HTTPSConnection(host, port=port, context=as_context,
+                                        timeout=CONF.trusted_computing.attestation_deadline)
+        else:
+            LOG.info("Using socket HTTPS client connection to attestation server with SSL certificate verification")
+            c = HTTPSClientAuthConnection(host, port, key_file=None, cert_file=None, ca_file=CONF.trusted_computing.attestation_server_ca_file,
+                                          timeout=CONF.trusted_computing.attestation_deadline)
+
+        userAndPass = b64encode(auth_blob).decode("ascii")
+        headers = { 'Authorization' : 'Basic %s' %  userAndPass , 'Accept': 'application/json'}
+        c.request('GET', host_url, headers=headers)
+        res = c.getresponse()
+        res_data = res.read()
+        return json.loads(res_data)['hosts']
+
     # Retrieve the hypervisor UUID based on the hostname
     def get_hypervisor_uuid(self, hostname):
         try:
-            host = CONF.trusted_computing.attestation_server
-            port = CONF.trusted_computing.attestation_port
-            auth_blob = CONF.trusted_computing.attestation_auth_blob
             host_url = CONF.trusted_computing.attestation_host_url + '?nameEqualTo=' + str(hostname)
-            LOG.debug(host_url)
-            if  hasattr(ssl,'SSLContext') and CONF.trusted_computing.attestation_server_ca_file:
-                LOG.info("Using SSL context HTTPS client connection to attestation server with SSL certificate verification")
-                as_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-                as_context.verify_mode = ssl.CERT_REQUIRED
-                as_context.check_hostname = True
-                as_context.load_verify_locations(CONF.trusted_computing.attestation_server_ca_file)
-                c = httplib.HTTPSConnection(host, port=port, context=as_context)
-            else:
-                LOG.info("Using socket HTTPS client connection to attestation server with SSL certificate verification")
-                c = HTTPSClientAuthConnection(host, port, key_file=None, cert_file=None, ca_file=CONF.trusted_computing.attestation_server_ca_file)
-				 
-            userAndPass = b64encode(auth_blob).decode("ascii")
-            headers = { 'Authorization' : 'Basic %s' %  userAndPass , 'Accept': 'application/json'}
-            c.request('GET', host_url, headers=headers)
-            res = c.getresponse()
-            res_data = res.read()
-            return json.loads(res_data)['hosts'][0]['id']
+            return self._get_hosts(host_url)[0]['id']
         except Exception, e:
             LOG.error(Exception)
             LOG.error(e)
             return ""
 
-
+    # Retrieve the UUIDs of all registered hosts keyed by host name
+    def get_hypervisor_uuids(self):
+        hosts = self._get_hosts(CONF.trusted_computing.attestation_host_url)
+        return dict((host['name'], host['id']) for host in hosts)
@@ -0,0 +1,118 @@
+"""Per-request profile of the pages customized by cit_horizon_plugin.
+
+install() wraps the Nova and Glance API calls made by the patched views
+and the column renderers added by cit_horizon_plugin. While a request is
+profiled (see middleware.ProfilerMiddleware) every call adds its duration
+to the Profile of the request, the calls made outside of a profiled
+request only cost a thread local lookup.
+"""
+import functools
+import importlib
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+# API functions called by the patched views, module and attribute
+API_CALLS = (
+    ('openstack_dashboard.api.nova', 'hvspecs_metadata'),
+    ('openstack_dashboard.api.nova', 'hvspecs_asset_tags'),
+    ('openstack_dashboard.api.nova', 'hypervisor_search'),
+    ('openstack_dashboard.api.glance', 'image_list_detailed'),
+)
+
+# Columns added by cit_horizon_plugin, table class and column name
+COLUMNS = (
+    ('GeoTagInstancesTable', 'attestation_status'),
+    ('GeoTagAdminInstancesTable', 'attestation_status'),
+    ('GeoTagHypervisorsTable', 'geo_tag'),
+    ('GeoTagImagesTable', 'image_policy'),
+    ('GeoTagAdminImagesTable', 'image_policy'),
+)
+
+_local = threading.local()
+_installed = False
+
+
+class Profile(object):
+    """Calls and time spent in the measured functions for one request."""
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.start = time.time()
+        self.end = None
+        # name -> [calls, seconds]
+        self.timings = {}
+
+    def add(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+
+    def total(self):
+        return (self.end or time.time()) - self.start
+
+    def summary(self):
+        parts = ['%s %d calls %.1f ms' % (name, calls, seconds * 1000)
+                 for name, (calls, seconds) in sorted(self.timings.items())]
+        return '%s %s %.1f ms: %s' % (self.method, self.path,
+                                      self.total() * 1000,
+                                      ', '.join(parts) or 'no calls')
+
+
+def start(method, path):
+    """Starts the profile of the request run by the current thread."""
+    _local.profile = Profile(method, path)
+    return _local.profile
+
+
+def stop():
+    """Ends and returns the profile of the current thread, if any."""
+    profile = getattr(_local, 'profile', None)
+    _local.profile = None
+    if profile is not None:
+        profile.end = time.time()
+    return profile
+
+
+def _measured(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return func(*args, **kwargs)
+        began = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.add(name, time.time() - began)
+    return wrapper
+
+
+def install():
+    """Wraps the API calls and the column renderers, once per process."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    for module_name, attribute in API_CALLS:
+        module = importlib.import_module(module_name)
+        name = '%s.%s' % (module_name.rsplit('.', 1)[1], attribute)
+        setattr(module, attribute, _measured(name, getattr(module, attribute)))
+
+    # The renderers are held by the Column objects, which the tables copy
+    # when they are instantiated
+    import cit_horizon_plugin
+    for table_name, column_name in COLUMNS:
+        table = getattr(cit_horizon_plugin, table_name)
+        column = table.base_columns[column_name]
+        column.transform = _measured('render.%s' % column_name,
+                                     column.transform)
+    LOG.info("CIT Horizon profiler installed")
@@ -0,0 +1 @@
+# Not empty, the patches created with diff -N leave out empty files
@@ -0,0 +1,31 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+import cit_horizon_profiler
+
+
+LOG = logging.getLogger(__name__)
+
+
+class ProfilerMiddleware(object):
+    """Logs the profile of every request when CIT_HORIZON_PROFILER is set.
+
+    The profile is also kept as the cit_profile attribute of the request.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'CIT_HORIZON_PROFILER', False):
+            raise MiddlewareNotUsed()
+        cit_horizon_profiler.install()
+
+    def process_request(self, request):
+        cit_horizon_profiler.start(request.method, request.path)
+
+    def process_response(self, request, response):
+        profile = cit_horizon_profiler.stop()
+        if profile is not None:
+            request.cit_profile = profile
+            LOG.info("CIT profile %s" % profile.summary())
+        return response
@@ -262,6 +262,13 @@ SECURITY_GROUP_RULES = {
 
 ADD_INSTALLED_APPS = []
 
+# Logs the Nova and Glance calls and the column rendering time of the pages
+# customized by cit_horizon_plugin for every request, see the
+# cit_profile_page management command to profile a single page
+CIT_HORIZON_PROFILER = False
+MIDDLEWARE_CLASSES += ('cit_horizon_profiler.middleware.ProfilerMiddleware',)
+INSTALLED_APPS.append('cit_horizon_profiler')
+
 # Deprecated Theme Settings
 CUSTOM_THEME_PATH = None
 DEFAULT_THEME_PATH = None
@@ -0,0 +1,82 @@
+"""Profiles the pages customized by cit_horizon_plugin.
+
+    manage.py cit_profile_page /admin/hypervisors/ /project/instances/ \
+        --username admin --password secret [--repeat 5]
+
+Logs in with the Django test client and requests every page --repeat
+times with the profiler on, whatever CIT_HORIZON_PROFILER is set to, then
+prints the calls and time spent in the Nova and Glance API functions and
+in the column renderers, averaged over the requests.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.test import Client
+
+
+class Command(BaseCommand):
+    help = "Profiles the pages customized by cit_horizon_plugin"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='path',
+                            help='path of the page, e.g. /admin/hypervisors/')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--domain',
+                            help='keystone domain, when multidomain support '
+                                 'is enabled')
+        parser.add_argument('--region', default=None,
+                            help='keystone URL logged in to, '
+                                 'OPENSTACK_KEYSTONE_URL by default')
+        parser.add_argument('--host', default='localhost',
+                            help='Host header of the requests, has to be '
+                                 'in ALLOWED_HOSTS')
+        parser.add_argument('--repeat', type=int, default=1,
+                            help='requests per page')
+
+    def handle(self, *args, **options):
+        # Read when the test client loads the middleware, on its first request
+        settings.CIT_HORIZON_PROFILER = True
+        client = Client(HTTP_HOST=options['host'])
+
+        credentials = {'username': options['username'],
+                       'password': options['password'],
+                       'region': (options['region'] or
+                                  settings.OPENSTACK_KEYSTONE_URL)}
+        if options['domain']:
+            credentials['domain'] = options['domain']
+        response = client.post(settings.LOGIN_URL, credentials)
+        if response.status_code != 302:
+            raise CommandError("Unable to log in as %s, the login page "
+                               "returned %s" % (options['username'],
+                                                response.status_code))
+
+        for path in options['paths']:
+            profiles = []
+            for request in range(options['repeat']):
+                response = client.get(path)
+                if response.status_code != 200:
+                    raise CommandError("%s returned %s"
+                                       % (path, response.status_code))
+                profiles.append(response.wsgi_request.cit_profile)
+            self.report(path, profiles)
+
+    def report(self, path, profiles):
+        count = len(profiles)
+        totals = {}
+        for profile in profiles:
+            for name, (calls, seconds) in profile.timings.items():
+                total = totals.setdefault(name, [0, 0.0])
+                total[0] += calls
+                total[1] += seconds
+
+        self.stdout.write("%s: %.1f ms per request over %d requests"
+                          % (path, sum(profile.total()
+                                       for profile in profiles)
+                             * 1000 / count, count))
+        for name, (calls, seconds) in sorted(totals.items()):
+            self.stdout.write("    %-32s %6.1f calls %9.1f ms"
+                              % (name, float(calls) / count,
+                                 seconds * 1000 / count))
+        if not totals:
+            self.stdout.write("    no profiled call")
@@ -0,0 +1,816 @@
+#!/usr/bin/env python
+"""Python companion of patch-util.sh.
+
+Usage: patch_util.py COMMAND [ARGS]
+
+fingerprint SRC_DIR [SRC_DIR...] --- Finds the release the installed files
+    match, SRC_DIR holding the original/<version> and resources/<version>
+    directories the patches are created from
+create_patch SRC_DIR PATCH_DIR --- Generates the patches of every release,
+    as patch-util.sh create_patch does, on a process pool and only for the
+    releases whose files changed since the previous run (--manifest)
+apply_patch TARGET_DIR PATCH_FILE --manifest FILE --- Applies the patch
+    without touching any file when one of them does not match, recording
+    the checksums and backups of the patched files in the manifest
+rollback --manifest FILE --- Restores the files patched by apply_patch
+verify --manifest FILE --- Checks the patched files are still unchanged
+
+The sha256 of every file read is kept in a hash cache (--cache) and reused
+while the size and modification time of the file are unchanged, so only
+the files changed since the previous run are read again.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import errno
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'),
+                             '.mtwilson-patch-util-hashes.json')
+DEFAULT_WORKERS = 8
+
+# Read size of the files hashed
+CHUNK_SIZE = 1024 * 1024
+
+# Run from original/<version>, as patch-util.sh create_patch does
+DIFF_OPTIONS = ['-U', '10', '--text', '-r', '-N']
+
+
+def python_lib():
+    """site-packages directory, the default distribution location."""
+    try:
+        from distutils import sysconfig
+        return sysconfig.get_python_lib()
+    except ImportError:
+        # distutils is gone from Python 3.12
+        import sysconfig
+        return sysconfig.get_paths()['purelib']
+
+
+def version_key(version):
+    """Sorts 2014.1 < 2014.1.3 < 12.0.1 < 13.1.0 by their numbers."""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'[.-]', version)]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_files(directory):
+    """Paths of the regular files under directory, relative and sorted."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.isfile(path):
+                files.append(os.path.relpath(path, directory))
+    return files
+
+
+class HashCache(object):
+    """sha256 of files, reused while their size and mtime are unchanged."""
+
+    def __init__(self, path=None, workers=DEFAULT_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.hashes = {}
+        self.changed = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    self.hashes = json.load(cache_file)
+            except ValueError:
+                # Rebuilt from scratch when the cache file is corrupted
+                self.hashes = {}
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime]
+
+    def get(self, path):
+        """sha256 of the file, None when it does not exist."""
+        return self.get_all([path])[path]
+
+    def get_all(self, paths):
+        """sha256 of the files by path, the missing ones hashed in parallel."""
+        results = {}
+        missing = []
+        for path in set(os.path.abspath(path) for path in paths):
+            stat = self._stat(path)
+            cached = self.hashes.get(path)
+            if stat is None:
+                results[path] = None
+            elif cached is not None and cached[:2] == stat:
+                results[path] = cached[2]
+            else:
+                missing.append((path, stat))
+
+        if missing:
+            pool = ThreadPool(self.workers)
+            try:
+                digests = pool.map(file_sha256,
+                                   [path for path, stat in missing])
+            finally:
+                pool.close()
+                pool.join()
+            for (path, stat), digest in zip(missing, digests):
+                self.hashes[path] = stat + [digest]
+                results[path] = digest
+            self.changed = True
+
+        return dict((path, results[os.path.abspath(path)]) for path in paths)
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        temp_path = '%s.%d' % (self.path, os.getpid())
+        with open(temp_path, 'w') as cache_file:
+            json.dump(self.hashes, cache_file)
+        os.rename(temp_path, self.path)
+        self.changed = False
+
+
+def release_files(source_dir):
+    """{version: [relative path]} of the files patched by every release.
+
+    The empty original files stand for files created by the patch, they do
+    not tell the releases apart and are left out.
+    """
+    original_dir = os.path.join(source_dir, 'original')
+    if not os.path.isdir(original_dir):
+        raise ValueError("%s doesn't contain directories in expected "
+                         "structure." % source_dir)
+    releases = {}
+    for version in sorted(os.listdir(original_dir), key=version_key):
+        version_dir = os.path.join(original_dir, version)
+        releases[version] = [
+            path for path in list_files(version_dir)
+            if os.path.getsize(os.path.join(version_dir, path)) > 0]
+    return releases
+
+
+def install_path(path, install_dirs):
+    """Installed location of original/<version>/<path>."""
+    top, rest = path.split(os.sep, 1)
+    return os.path.join(install_dirs[top], rest)
+
+
+def fingerprint(source_dir, install_dirs, cache):
+    """Compares the installed files with every release of source_dir.
+
+    Returns one result per release, the releases whose files are all
+    installed unmodified (state original) or already patched (state
+    patched) first.
+    """
+    releases = release_files(source_dir)
+
+    paths = []
+    for version, files in releases.items():
+        for path in files:
+            if path.split(os.sep, 1)[0] not in install_dirs:
+                continue
+            paths.append(os.path.join(source_dir, 'original', version, path))
+            paths.append(os.path.join(source_dir, 'resources', version,
+                                      path))
+            paths.append(install_path(path, install_dirs))
+    # Every file is read once, in a single parallel pass
+    hashes = cache.get_all(paths)
+
+    results = []
+    for version, files in releases.items():
+        # A file the patch leaves unchanged matches both states
+        counts = {'original': 0, 'patched': 0, 'missing': 0}
+        mismatched = []
+        for path in files:
+            if path.split(os.sep, 1)[0] not in install_dirs:
+                continue
+            installed = hashes[install_path(path, install_dirs)]
+            original = installed == hashes[os.path.join(
+                source_dir, 'original', version, path)]
+            patched = installed == hashes[os.path.join(
+                source_dir, 'resources', version, path)]
+            if installed is None:
+                counts['missing'] += 1
+            counts['original'] += original
+            counts['patched'] += patched
+            if not original and not patched:
+                mismatched.append(path)
+
+        total = len([path for path in files
+                     if path.split(os.sep, 1)[0] in install_dirs])
+        if total and counts['original'] == total:
+            state = 'original'
+        elif total and counts['patched'] == total:
+            state = 'patched'
+        else:
+            state = None
+        result = {'version': version, 'state': state, 'files': total,
+                  'mismatched': mismatched}
+        result.update(counts)
+        results.append(result)
+
+    def rank(result):
+        newest = [-part if isinstance(part, int) else part
+                  for part in version_key(result['version'])]
+        if result['state']:
+            # Among several matching releases the one checking the most
+            # files is the most specific
+            return (0, -result['files'], newest)
+        best = max(result['original'], result['patched'])
+        return (1, -float(best) / max(result['files'], 1), newest)
+
+    results.sort(key=rank)
+    return results
+
+
+def fingerprint_command(args):
+    install_dirs = {'distribution-location': (args.distribution_location or
+                                              python_lib()),
+                    'openstack-dashboard': args.openstack_dashboard,
+                    'root': args.root}
+    cache = HashCache(args.cache, args.workers)
+
+    document = {}
+    status = 0
+    for source_dir in args.source_dirs:
+        # src directory of the component, e.g.
+        # controller/mtwilson-openstack-host-tag-vm/src
+        component = os.path.basename(os.path.dirname(
+            os.path.abspath(source_dir)))
+        try:
+            results = fingerprint(source_dir, install_dirs, cache)
+        except ValueError as exc:
+            print("ERROR: %s" % exc, file=sys.stderr)
+            return 1
+        matches = [result for result in results if result['state']]
+        document[component] = {
+            'match': matches[0]['version'] if matches else None,
+            'state': matches[0]['state'] if matches else None,
+            'releases': results}
+
+        if not matches:
+            status = 1
+            closest = results[0] if results else None
+            print("%s: no release matches the installed files%s"
+                  % (component, ", closest is %s with %d of %d files"
+                     % (closest['version'],
+                        max(closest['original'], closest['patched']),
+                        closest['files']) if closest else ''))
+        else:
+            print("%s: %s (%s, %d files)"
+                  % (component, matches[0]['version'], matches[0]['state'],
+                     matches[0]['files']))
+            for other in matches[1:]:
+                print("%s: also matches %s (%s, %d files)"
+                      % (component, other['version'], other['state'],
+                         other['files']))
+    cache.save()
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+    return status
+
+
+def diff_version():
+    output = subprocess.check_output(['diff', '--version'])
+    return output.decode('utf-8', 'replace').splitlines()[0]
+
+
+def tree_state(directory, cache):
+    """[path, size, mtime, sha256] of the files under directory.
+
+    diff writes the modification time of the files in the patch headers,
+    so a file touched without being changed still changes its patch.
+    """
+    if not os.path.isdir(directory):
+        return []
+    files = list_files(directory)
+    hashes = cache.get_all([os.path.join(directory, path) for path in files])
+    state = []
+    for path in files:
+        full_path = os.path.join(directory, path)
+        stat = os.stat(full_path)
+        state.append([path, stat.st_size,
+                      getattr(stat, 'st_mtime_ns', repr(stat.st_mtime)),
+                      hashes[full_path]])
+    return state
+
+
+def _diff_patch(job):
+    """Writes the patch of one release directory, run by the pool."""
+    version_dir, subdir, patch_path = job
+    resources_subdir = os.path.join(os.pardir, os.pardir, 'resources',
+                                    os.path.basename(version_dir), subdir)
+    temp_path = '%s.%d' % (patch_path, os.getpid())
+    with open(temp_path, 'wb') as output:
+        returncode = subprocess.call(['diff'] + DIFF_OPTIONS +
+                                     [subdir, resources_subdir],
+                                     cwd=version_dir, stdout=output)
+    if returncode not in (0, 1):
+        os.remove(temp_path)
+        return returncode, None
+    os.rename(temp_path, patch_path)
+    return returncode, file_sha256(patch_path)
+
+
+def create_patch(source_dir, patch_dir, cache, manifest_path=None,
+                 jobs=None):
+    """Generates PATCH_DIR/<version>/<subdir>.patch for every release.
+
+    The patches are the output of the diff patch-util.sh runs, byte for
+    byte. A patch is generated again only when the files it is created
+    from, the diff version or the timezone changed since the run recorded
+    in the manifest, or when the patch itself was changed or removed.
+    Returns False when diff failed.
+    """
+    original_dir = os.path.join(source_dir, 'original')
+    if not os.path.isdir(original_dir):
+        raise ValueError("%s doesn't contain directories in expected "
+                         "structure." % source_dir)
+
+    manifest = {}
+    if manifest_path and os.path.exists(manifest_path):
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except ValueError:
+            manifest = {}
+    environment = [diff_version(), os.environ.get('TZ')]
+    if manifest.get('environment') != environment:
+        manifest = {}
+    recorded = manifest.get('patches', {})
+    patches = {}
+
+    pending = []
+    for version in sorted(os.listdir(original_dir), key=version_key):
+        version_dir = os.path.join(original_dir, version)
+        if not os.path.isdir(version_dir):
+            continue
+        for subdir in sorted(os.listdir(version_dir)):
+            name = os.path.join(version, '%s.patch' % subdir)
+            patch_path = os.path.join(patch_dir, name)
+            inputs = hashlib.sha256(json.dumps([
+                tree_state(os.path.join(version_dir, subdir), cache),
+                tree_state(os.path.join(source_dir, 'resources', version,
+                                        subdir), cache),
+            ]).encode('utf-8')).hexdigest()
+
+            previous = recorded.get(name)
+            if (previous and previous['inputs'] == inputs and
+                    os.path.exists(patch_path) and
+                    file_sha256(patch_path) == previous['sha256']):
+                print("Patch up to date at %s" % patch_path)
+                patches[name] = previous
+                continue
+            if not os.path.isdir(os.path.join(patch_dir, version)):
+                os.makedirs(os.path.join(patch_dir, version))
+            print("Creating patch for %s" % os.path.join(version_dir,
+                                                          subdir))
+            pending.append((name, inputs,
+                            (os.path.abspath(version_dir), subdir,
+                             os.path.abspath(patch_path))))
+
+    succeeded = True
+    if pending:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            outputs = pool.map(_diff_patch, [job for name, inputs, job
+                                              in pending])
+        finally:
+            pool.close()
+            pool.join()
+        for (name, inputs, job), (returncode, digest) in zip(pending,
+                                                             outputs):
+            if digest is None:
+                print("Error while creating patch %s, diff returned %d"
+                      % (job[2], returncode), file=sys.stderr)
+                succeeded = False
+                continue
+            patches[name] = {'inputs': inputs, 'sha256': digest}
+            print("Patch created at %s" % job[2])
+
+    if manifest_path:
+        temp_path = '%s.%d' % (manifest_path, os.getpid())
+        with open(temp_path, 'w') as manifest_file:
+            json.dump({'environment': environment, 'patches': patches},
+                      manifest_file, indent=2, sort_keys=True)
+        os.rename(temp_path, manifest_path)
+    return succeeded
+
+
+def create_patch_command(args):
+    cache = HashCache(args.cache, args.workers)
+    try:
+        succeeded = create_patch(args.source_dir, args.patch_dir, cache,
+                                 args.manifest, args.jobs)
+    except ValueError as exc:
+        print("ERROR: %s" % exc, file=sys.stderr)
+        return 1
+    finally:
+        cache.save()
+    return 0 if succeeded else 1
+
+
+class PatchError(Exception):
+    pass
+
+
+class FilePatch(object):
+    """The hunks of one file of a unified diff."""
+
+    def __init__(self, path):
+        self.path = path
+        # [(old start, [(tag, line)])]
+        self.hunks = []
+
+
+_HUNK_HEADER = re.compile(br'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def split_lines(data):
+    """Lines of data with their ending, split on \\n only as patch does."""
+    lines = data.split(b'\n')
+    if lines[-1]:
+        return [line + b'\n' for line in lines[:-1]] + [lines[-1]]
+    return [line + b'\n' for line in lines[:-1]]
+
+
+def strip_path(path, strip):
+    parts = [part for part in path.split('/') if part]
+    if len(parts) <= strip:
+        raise PatchError("Unable to strip %d components from %s"
+                         % (strip, path))
+    return os.path.join(*parts[strip:])
+
+
+def parse_patch(data, strip):
+    """Parses the output of diff -r -N into FilePatch objects.
+
+    The files are named after the --- line, as patch does when the old
+    file exists, the +++ line naming the resources directory.
+    """
+    patches = []
+    current = None
+    lines = split_lines(data)
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if line.startswith(b'--- ') and index + 1 < len(lines) and \
+                lines[index + 1].startswith(b'+++ '):
+            name = line[4:].rstrip(b'\r\n').split(b'\t', 1)[0]
+            current = FilePatch(strip_path(name.decode('utf-8'), strip))
+            patches.append(current)
+            index += 2
+            continue
+
+        match = _HUNK_HEADER.match(line)
+        if match:
+            if current is None:
+                raise PatchError("Hunk without file header at line %d"
+                                 % (index + 1))
+            old_count = int(match.group(2) or b'1')
+            new_count = int(match.group(4) or b'1')
+            hunk_lines = []
+            index += 1
+            while old_count or new_count or (
+                    index < len(lines) and lines[index].startswith(b'\\')):
+                if index >= len(lines):
+                    raise PatchError("Truncated hunk in %s" % current.path)
+                line = lines[index]
+                if line.startswith(b'\\'):
+                    # No newline at end of file, for the previous line
+                    tag, previous = hunk_lines[-1]
+                    hunk_lines[-1] = (tag, previous.rstrip(b'\n'))
+                else:
+                    tag = line[0:1]
+                    if tag in (b' ', b'-'):
+                        old_count -= 1
+                    if tag in (b' ', b'+'):
+                        new_count -= 1
+                    if tag not in (b' ', b'-', b'+') or old_count < 0 or \
+                            new_count < 0:
+                        raise PatchError("Malformed hunk in %s at line %d"
+                                         % (current.path, index + 1))
+                    hunk_lines.append((tag, line[1:]))
+                index += 1
+            current.hunks.append((int(match.group(1)), hunk_lines))
+            continue
+        index += 1
+    return patches
+
+
+def apply_hunks(lines, hunks, reverse=False):
+    """Returns the lines patched by the hunks, without fuzz.
+
+    A hunk is applied where its context matches, the closest to the line
+    given by its header shifted by the offset of the previous hunks.
+    """
+    removed, added = (b'+', b'-') if reverse else (b'-', b'+')
+    result = []
+    position = 0
+    offset = 0
+    for old_start, hunk_lines in hunks:
+        old = [line for tag, line in hunk_lines if tag != added]
+        new = [line for tag, line in hunk_lines if tag != removed]
+        # A hunk removing nothing from an empty file starts at line 0
+        expected = max(old_start - 1, 0) if old else old_start
+        expected += offset
+
+        found = None
+        last = len(lines) - len(old)
+        for distance in range(0, max(last, expected) + 1):
+            for candidate in (expected - distance, expected + distance):
+                if position <= candidate <= last and \
+                        lines[candidate:candidate + len(old)] == old:
+                    found = candidate
+                    break
+            if found is not None or (expected - distance < position and
+                                     expected + distance > last):
+                break
+        if found is None:
+            return None
+
+        result.extend(lines[position:found])
+        result.extend(new)
+        position = found + len(old)
+        offset = found - expected + offset
+    result.extend(lines[position:])
+    return result
+
+
+def read_file(path):
+    try:
+        with open(path, 'rb') as source:
+            return source.read()
+    except IOError as exc:
+        if exc.errno == errno.ENOENT:
+            return None
+        raise
+
+
+def sha256(data):
+    return None if data is None else hashlib.sha256(data).hexdigest()
+
+
+def write_atomic(path, data, mode):
+    """Writes the file next to path and renames it into place."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = os.path.join(directory, '.%s.%d.tmp'
+                             % (os.path.basename(path), os.getpid()))
+    with open(temp_path, 'wb') as output:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+    os.chmod(temp_path, mode)
+    os.rename(temp_path, path)
+
+
+def read_manifest(path):
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_manifest(path, manifest):
+    write_atomic(path, json.dumps(manifest, indent=2,
+                                  sort_keys=True).encode('utf-8'), 0o600)
+
+
+def apply_patch(target_dir, patch_path, strip, manifest_path):
+    """Applies the patch to target_dir, recording what it changed.
+
+    Every file is patched in memory first, nothing is written when a hunk
+    does not apply. The originals are copied next to the manifest, which
+    records the checksum of every file before and after, then the patched
+    files are renamed into place one by one.
+    """
+    if os.path.exists(manifest_path):
+        raise PatchError("%s exists, the previous patch has to be rolled "
+                         "back first" % manifest_path)
+
+    with open(patch_path, 'rb') as patch_file:
+        patch_data = patch_file.read()
+    files = []
+    for file_patch in parse_patch(patch_data, strip):
+        target = os.path.join(target_dir, file_patch.path)
+        before = read_file(target)
+        lines = split_lines(before) if before else []
+        patched = apply_hunks(lines, file_patch.hunks)
+        if patched is None:
+            if apply_hunks(lines, file_patch.hunks, reverse=True) is not None:
+                raise PatchError("%s is already patched" % target)
+            raise PatchError("%s does not match the patch" % target)
+        files.append((file_patch.path, before, b''.join(patched)))
+
+    backup_dir = manifest_path + '.backup'
+    manifest = {'target_dir': os.path.abspath(target_dir),
+                'patch': os.path.abspath(patch_path),
+                'patch_sha256': sha256(patch_data),
+                'state': 'applying',
+                'files': []}
+    for path, before, after in files:
+        target = os.path.join(target_dir, path)
+        entry = {'path': path, 'before': sha256(before),
+                 'after': sha256(after), 'mode': None}
+        if before is not None:
+            entry['mode'] = os.stat(target).st_mode & 0o7777
+            write_atomic(os.path.join(backup_dir, path), before, 0o600)
+        manifest['files'].append(entry)
+    # Written before the first file is replaced, so that an interrupted
+    # apply is rolled back like a completed one
+    write_manifest(manifest_path, manifest)
+
+    for path, before, after in files:
+        print("Patching file %s" % os.path.join(target_dir, path))
+        write_atomic(os.path.join(target_dir, path), after, 0o644)
+
+    manifest['state'] = 'applied'
+    write_manifest(manifest_path, manifest)
+    return manifest
+
+
+def rollback(manifest_path, force=False):
+    """Restores the files recorded by apply_patch.
+
+    A file changed since it was patched is left as is unless force is
+    set. Returns the paths left unrestored, the manifest and the backups
+    are removed when there are none.
+    """
+    manifest = read_manifest(manifest_path)
+    backup_dir = manifest_path + '.backup'
+    conflicts = []
+    for entry in manifest['files']:
+        target = os.path.join(manifest['target_dir'], entry['path'])
+        current = sha256(read_file(target))
+        if current == entry['before']:
+            # Never replaced, the apply was interrupted
+            continue
+        if current != entry['after'] and not force:
+            print("%s changed since it was patched, not restored" % target,
+                  file=sys.stderr)
+            conflicts.append(target)
+            continue
+
+        if entry['before'] is None:
+            print("Removing file %s" % target)
+            os.remove(target)
+            # Along with the directories created for it
+            directory = os.path.dirname(target)
+            while (directory != manifest['target_dir'] and
+                   not os.listdir(directory)):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+        else:
+            print("Restoring file %s" % target)
+            original = read_file(os.path.join(backup_dir, entry['path']))
+            if sha256(original) != entry['before']:
+                raise PatchError("The backup of %s is corrupted" % target)
+            write_atomic(target, original, entry['mode'])
+
+    if conflicts:
+        manifest['state'] = 'rollback failed'
+        write_manifest(manifest_path, manifest)
+        return conflicts
+    shutil.rmtree(backup_dir, ignore_errors=True)
+    os.remove(manifest_path)
+    return conflicts
+
+
+def verify(manifest_path):
+    """Paths of the patched files whose checksum changed since."""
+    manifest = read_manifest(manifest_path)
+    changed = []
+    for entry in manifest['files']:
+        target = os.path.join(manifest['target_dir'], entry['path'])
+        if sha256(read_file(target)) != entry['after']:
+            changed.append(target)
+    return changed
+
+
+def apply_patch_command(args):
+    try:
+        manifest = apply_patch(args.target_dir, args.patch_file, args.strip,
+                               args.manifest)
+    except (PatchError, IOError, OSError) as exc:
+        print("Not able to apply patches: %s" % exc, file=sys.stderr)
+        return 1
+    print("%d files patched, manifest at %s"
+          % (len(manifest['files']), args.manifest))
+    return 0
+
+
+def rollback_command(args):
+    try:
+        conflicts = rollback(args.manifest, args.force)
+    except (PatchError, IOError, OSError, ValueError) as exc:
+        print("Error while reverting patch: %s" % exc, file=sys.stderr)
+        return 1
+    return 1 if conflicts else 0
+
+
+def verify_command(args):
+    try:
+        changed = verify(args.manifest)
+    except (IOError, OSError, ValueError) as exc:
+        print("Unable to read %s: %s" % (args.manifest, exc),
+              file=sys.stderr)
+        return 1
+    for path in changed:
+        print("%s changed since it was patched" % path)
+    return 1 if changed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cache', default=DEFAULT_CACHE,
+                        help='hash cache file, reused across runs')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='files hashed in parallel')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    fingerprint_parser = commands.add_parser(
+        'fingerprint', help='find the release the installed files match')
+    fingerprint_parser.add_argument('source_dirs', nargs='+',
+                                    metavar='SRC_DIR')
+    fingerprint_parser.add_argument(
+        '--distribution-location',
+        help='where the distribution-location files are installed, the '
+             'site-packages directory by default')
+    fingerprint_parser.add_argument(
+        '--openstack-dashboard', default='/usr/share/openstack-dashboard',
+        help='where the openstack-dashboard files are installed')
+    fingerprint_parser.add_argument(
+        '--root', default='/', help='where the root files are installed')
+    fingerprint_parser.add_argument('--json',
+                                    help='file the results are written to')
+    fingerprint_parser.set_defaults(func=fingerprint_command)
+
+    create_parser = commands.add_parser(
+        'create_patch', help='generate the patches of every release')
+    create_parser.add_argument('source_dir', metavar='SRC_DIR')
+    create_parser.add_argument('patch_dir', metavar='PATCH_DIR')
+    create_parser.add_argument('--manifest',
+                               help='file recording the inputs of every '
+                                    'patch, the patches are all generated '
+                                    'again when unset')
+    create_parser.add_argument('--jobs', type=int,
+                               help='patches generated in parallel, one per '
+                                    'CPU by default')
+    create_parser.set_defaults(func=create_patch_command)
+
+    apply_parser = commands.add_parser(
+        'apply_patch', help='apply a patch, recording a manifest')
+    apply_parser.add_argument('target_dir', metavar='TARGET_DIR')
+    apply_parser.add_argument('patch_file', metavar='PATCH_FILE')
+    apply_parser.add_argument('--strip', type=int, default=1,
+                              help='leading path components removed from '
+                                   'the file names of the patch')
+    apply_parser.add_argument('--manifest', required=True,
+                              help='manifest written, the backups of the '
+                                   'patched files are kept in '
+                                   'MANIFEST.backup')
+    apply_parser.set_defaults(func=apply_patch_command)
+
+    rollback_parser = commands.add_parser(
+        'rollback', help='restore the files patched by apply_patch')
+    rollback_parser.add_argument('--manifest', required=True)
+    rollback_parser.add_argument('--force', action='store_true',
+                                 help='also restore the files changed since '
+                                      'they were patched')
+    rollback_parser.set_defaults(func=rollback_command)
+
+    verify_parser = commands.add_parser(
+        'verify', help='check the files patched by apply_patch')
+    verify_parser.add_argument('--manifest', required=True)
+    verify_parser.set_defaults(func=verify_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,39 @@
+from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
 from sqlalchemy import MetaData
 from sqlalchemy import String
 from sqlalchemy import Table
 from sqlalchemy import Text
 from sqlalchemy import UniqueConstraint
+from sqlalchemy.engine import reflection
 
 meta = MetaData()
 
+# Secondary indexes of hv_specs, created along with the table.
+# hvspec_get_by_key filters on (key, deleted), which the unique constraint
+# cannot serve since it starts with compute_node_id.
+HV_SPECS_INDEXES = (
+    ('hv_specs_key_deleted_compute_node_id_idx',
+     ('key', 'deleted', 'compute_node_id')),
+    ('hv_specs_key_deleted_trusted_valid_to_idx',
+     ('key', 'deleted', 'trusted', 'valid_to')),
+)
+
 def upgrade(migrate_engine):
     meta.bind = migrate_engine
 
+    # The columns and indexes missing from the tables created by an earlier
+    # version of the script are added online by the expand phase of
+    # nova.cmd.hv_specs_migrate, not here: the DDL would lock hv_specs for
+    # the whole install
+    inspector = reflection.Inspector.from_engine(migrate_engine)
+    existing_tables = inspector.get_table_names()
+
     compute_nodes = Table('compute_nodes', meta, autoload=True)
 
     hv_specs = Table('hv_specs', meta,
@@ -24,6 +45,10 @@ def upgrade(migrate_engine):
         Column('compute_node_id', Integer, ForeignKey(compute_nodes.c.id), nullable=False),
         Column('key', String(255), nullable=False),
         Column('value', Text),
+        Column('value_blob', LargeBinary),
+        Column('trusted', Boolean),
+        Column('valid_to', DateTime),
+        Column('tags_hash', String(64)),
         UniqueConstraint(
             'compute_node_id', 'key', 'deleted',
             name='uniq_hv_specs0compute_node_id0key0deleted'),
@@ -33,7 +58,53 @@ def upgrade(migrate_engine):
 
     hv_specs.create(checkfirst=True)
 
+    # Soft-deleted rows archived by nova.cmd.hv_specs_manage, like the
+    # shadow tables of nova-manage db archive_deleted_rows
+    shadow_hv_specs = Table('shadow_hv_specs', meta,
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('deleted_at', DateTime),
+        Column('deleted', Integer, default=0),
+        Column('id', Integer, primary_key=True),
+        Column('compute_node_id', Integer, nullable=False),
+        Column('key', String(255), nullable=False),
+        Column('value', Text),
+        Column('value_blob', LargeBinary),
+        Column('trusted', Boolean),
+        Column('valid_to', DateTime),
+        Column('tags_hash', String(64)),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8'
+    )
+
+    shadow_hv_specs.create(checkfirst=True)
+
+    # Asset tags of the trust reports, see hvspec_get_trusted_compute_node_ids
+    hv_spec_tags = Table('hv_spec_tags', meta,
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('id', Integer, primary_key=True),
+        Column('hv_spec_id', Integer, ForeignKey(hv_specs.c.id), nullable=False),
+        Column('name', String(255), nullable=False),
+        Column('value', String(255), nullable=False),
+        Index('hv_spec_tags_hv_spec_id_idx', 'hv_spec_id'),
+        Index('hv_spec_tags_name_value_hv_spec_id_idx',
+              'name', 'value', 'hv_spec_id'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8'
+    )
+
+    hv_spec_tags.create(checkfirst=True)
+
+    if 'hv_specs' not in existing_tables:
+        for name, columns in HV_SPECS_INDEXES:
+            Index(name, *[hv_specs.c[column] for column in columns]).create(migrate_engine)
+
 def downgrade(migrate_engine):
     meta.bind = migrate_engine
+    hv_spec_tags = Table('hv_spec_tags', meta, autoload=True)
+    hv_spec_tags.drop(checkfirst=True)
+    shadow_hv_specs = Table('shadow_hv_specs', meta, autoload=True)
+    shadow_hv_specs.drop(checkfirst=True)
     hv_specs = Table('hv_specs', meta, autoload=True)
     hv_specs.drop(checkfirst=True)
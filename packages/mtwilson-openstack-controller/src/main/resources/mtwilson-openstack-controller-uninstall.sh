@@ -55,6 +55,7 @@ elif [ "$CONTROLLER_EXT_LAYOUT" == "home" ]; then
   export CONTROLLER_EXT_REPOSITORY=${CONTROLLER_EXT_REPOSITORY:-$CONTROLLER_EXT_HOME/repository}
 fi
 export CONTROLLER_EXT_BIN=$CONTROLLER_EXT_HOME/bin
+export CONTROLLER_EXT_PATCH_MANIFESTS=$CONTROLLER_EXT_HOME/patch-manifests
 
 # note that the env dir is not configurable; it is defined as "env" under home
 export CONTROLLER_EXT_ENV=$CONTROLLER_EXT_HOME/env
@@ -210,8 +211,14 @@ function find_patch() {
 }
 
 for component in $COMPUTE_COMPONENTS; do
-  find_patch $component $version
-  revert_patch "$DISTRIBUTION_LOCATION/" "$patch_dir/distribution-location.patch" 1
+  patchManifest=$CONTROLLER_EXT_PATCH_MANIFESTS/$component-distribution-location.json
+  if [ -f "$patchManifest" ] && [ -f "$CONTROLLER_EXT_BIN/patch_util.py" ]; then
+    # restores the files recorded when the patches were applied
+    /usr/bin/python $CONTROLLER_EXT_BIN/patch_util.py rollback --manifest "$patchManifest"
+  else
+    find_patch $component $version
+    revert_patch "$DISTRIBUTION_LOCATION/" "$patch_dir/distribution-location.patch" 1
+  fi
   if [ $? -ne 0 ]; then
     echo_failure "Error while reverting distribution-location patches."
     echo_failure "Continuing with installation. If it fails while applying patches uninstall controller-ext component and then rerun installer."
@@ -13,7 +13,7 @@
 # 8. unzip mtwilson-openstack-controller archive mtwilson-openstack-controller-zip-*.zip
 # 9. apply openstack extension patches
 # 10. remove trusted_filter.py if exists
-# 11. sync nova database
+# 11. sync nova database and expand the hv_specs tables
 # 12. restart openstack services
 
 #####
@@ -54,7 +54,8 @@ PATCH_UTIL_SCRIPT_FILE=$(ls -1 mtwilson-linux-patch-util-*.sh | head -n 1)
 if [ -n "$PATCH_UTIL_SCRIPT_FILE" ] && [ -f "$PATCH_UTIL_SCRIPT_FILE" ]; then
   . $PATCH_UTIL_SCRIPT_FILE
 fi
-PATCH_DB_SCRIPT_FILE=$(ls -1 *.py)
+PATCH_UTIL_PYTHON_FILE=$(ls -1 mtwilson-linux-patch-util-*.py | head -n 1)
+PATCH_DB_SCRIPT_FILE=$(ls -1 change-script.py)
 UNINSTALL_SCRIPT_FILE=$(ls -1 mtwilson-openstack-controller-uninstall.sh | head -n 1)
 
 # load installer environment file, if present
@@ -73,8 +74,10 @@ elif [ "$CONTROLLER_EXT_LAYOUT" == "home" ]; then
   export CONTROLLER_EXT_REPOSITORY=${CONTROLLER_EXT_REPOSITORY:-$CONTROLLER_EXT_HOME/repository}
 fi
 export CONTROLLER_EXT_BIN=$CONTROLLER_EXT_HOME/bin
+# manifests and backups of the files patched by patch_util.py
+export CONTROLLER_EXT_PATCH_MANIFESTS=$CONTROLLER_EXT_HOME/patch-manifests
 
-for directory in $CONTROLLER_EXT_REPOSITORY $CONTROLLER_EXT_BIN $CONTROLLER_EXT_ENV; do
+for directory in $CONTROLLER_EXT_REPOSITORY $CONTROLLER_EXT_BIN $CONTROLLER_EXT_ENV $CONTROLLER_EXT_PATCH_MANIFESTS; do
   mkdir -p $directory
   chmod 700 $directory
 done
@@ -441,7 +444,15 @@ function find_patch() {
 
 # Uninstall previously installed patches
 for component in $COMPUTE_COMPONENTS; do
-  if [ -d $CONTROLLER_EXT_REPOSITORY/$component ]; then
+  patchManifest=$CONTROLLER_EXT_PATCH_MANIFESTS/$component-distribution-location.json
+  if [ -f "$patchManifest" ] && [ -f "$CONTROLLER_EXT_BIN/patch_util.py" ]; then
+    # restores the files recorded when the patches were applied
+    /usr/bin/python $CONTROLLER_EXT_BIN/patch_util.py rollback --manifest "$patchManifest"
+    if [ $? -ne 0 ]; then
+      echo_failure "Error while reverting distribution-location patches."
+      echo_failure "Continuing with installation. If it fails while applying patches uninstall controller-ext component and then rerun installer."
+    fi
+  elif [ -d $CONTROLLER_EXT_REPOSITORY/$component ]; then
     find_patch $component $version
     revert_patch "$DISTRIBUTION_LOCATION/" "$patch_dir/distribution-location.patch" 1
     if [ $? -ne 0 ]; then
@@ -463,6 +474,7 @@ done
 # copy utilities script file to application folder
 cp $UTIL_SCRIPT_FILE $CONTROLLER_EXT_HOME/bin/functions.sh
 cp $PATCH_UTIL_SCRIPT_FILE $CONTROLLER_EXT_HOME/bin/patch-util.sh
+cp $PATCH_UTIL_PYTHON_FILE $CONTROLLER_EXT_HOME/bin/patch_util.py
 cp $PATCH_DB_SCRIPT_FILE $CONTROLLER_EXT_HOME/bin/change-script.py
 cp $UNINSTALL_SCRIPT_FILE $CONTROLLER_EXT_HOME/bin/mtwilson-openstack-controller-uninstall.sh
 
@@ -486,7 +498,7 @@ cd $CONTROLLER_EXT_REPOSITORY
 
 for component in $COMPUTE_COMPONENTS; do
   find_patch $component $version
-  apply_patch "$DISTRIBUTION_LOCATION/" "$patch_dir/distribution-location.patch" 1
+  /usr/bin/python $CONTROLLER_EXT_BIN/patch_util.py apply_patch "$DISTRIBUTION_LOCATION/" "$patch_dir/distribution-location.patch" --strip 1 --manifest "$CONTROLLER_EXT_PATCH_MANIFESTS/$component-distribution-location.json"
   if [ $? -ne 0 ]; then
     echo_failure "Error while applying patches."
     exit -1
@@ -551,6 +563,19 @@ fi
 echo "Syncing nova database"
 su -s /bin/sh -c "nova-manage db sync" nova
 
+# columns and indexes missing from an existing hv_specs, added online by
+# the patch sets that ship the hv_specs migrations
+if [ -f "$DISTRIBUTION_LOCATION/nova/cmd/hv_specs_migrate.py" ]; then
+  echo "Expanding the hv_specs tables"
+  su -s /bin/sh -c "/usr/bin/python -m nova.cmd.hv_specs_migrate --config-file $novaConfFile --phase expand" nova
+  if [ $? -ne 0 ]; then
+    echo_failure "Error while expanding the hv_specs tables"
+    exit -1
+  fi
+  echo "Migrate the existing trust reports, on the live database, with:"
+  echo "  python -m nova.cmd.hv_specs_migrate --config-file $novaConfFile --phase backfill"
+fi
+
 openstackRestart
 
 echo_success "OpenStack Controller Extensions Installation complete"
@@ -0,0 +1,207 @@
+"""Fleet shared by the CIT benchmarks.
+
+The rules deciding which compute nodes are trusted and where they are, the
+trust reports, the hub key pair, the nova.conf and the compute_nodes and
+hv_specs rows used by fleet_generator.py, trust_filter_benchmark.py,
+hypervisors_api_load.py and trust_check_benchmark.py, so that a fleet
+written by the generator is the one the benchmarks build for themselves.
+
+load_fleet reads the fleet.json the generator writes, for the --fleet
+option of the benchmarks.
+"""
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import sys
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+import jwt
+
+
+# One compute node in UNTRUSTED_EVERY is untrusted and one in EXPIRED_EVERY
+# has an expired trust report
+UNTRUSTED_EVERY = 10
+EXPIRED_EVERY = 7
+
+COUNTRIES = ('US', 'DE', 'FR')
+RACKS = ('r1', 'r2', 'r3', 'r4')
+
+# Fixed so that the rows are the same on every run, the trust reports are
+# checked against the current time
+VALID_TO = '2099-12-31T00:00:00.000Z'
+EXPIRED_VALID_TO = '2016-01-01T00:00:00.000Z'
+CREATED_AT = datetime.datetime(2016, 6, 1)
+
+# Rows written per statement, and compute nodes per hvspec_set call
+BATCH = 500
+
+ALGORITHM = 'RS256'
+
+
+def write_config(directory, url, sections=()):
+    """Writes nova.conf, sections being (name, [(option, value)]) pairs."""
+    path = os.path.join(directory, 'nova.conf')
+    with open(path, 'w') as conf:
+        conf.write('[DEFAULT]\n'
+                   'debug = False\n'
+                   '[database]\n'
+                   'connection = %s\n' % url)
+        for name, options in sections:
+            conf.write('[%s]\n' % name)
+            for option, value in options:
+                conf.write('%s = %s\n' % (option, value))
+    return path
+
+
+def generate_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                    backend=default_backend())
+
+
+def private_bytes(private_key):
+    return private_key.private_bytes(serialization.Encoding.PEM,
+                                     serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption())
+
+
+def public_bytes(private_key):
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def load_keys(directory):
+    """The hub key pair of the fleet, generated on the first run."""
+    private_path = os.path.join(directory, 'hub_private_key.pem')
+    public_path = os.path.join(directory, 'hub_public_key.pem')
+    if os.path.exists(private_path):
+        with open(private_path, 'rb') as private_file:
+            private_pem = private_file.read()
+        private_key = serialization.load_pem_private_key(
+            private_pem, password=None, backend=default_backend())
+    else:
+        private_key = generate_key()
+        private_pem = private_bytes(private_key)
+        with open(private_path, 'wb') as private_file:
+            private_file.write(private_pem)
+    with open(public_path, 'wb') as public_file:
+        public_file.write(public_bytes(private_key))
+    return private_pem, private_path, public_path
+
+
+def sign(report, private_pem):
+    """The RS256 JWT the hub signs a trust report into."""
+    signed = jwt.encode(report, private_pem, algorithm=ALGORITHM)
+    if not isinstance(signed, str):
+        signed = signed.decode('ascii')
+    return signed
+
+
+def node_trusted(node):
+    """Whether the trust report of a compute node passes the trust check."""
+    return node % UNTRUSTED_EVERY != 0 and node % EXPIRED_EVERY != 0
+
+
+def node_country(node):
+    return COUNTRIES[node % len(COUNTRIES)]
+
+
+def trust_report(node, extra_tags=0):
+    asset_tags = {'country': [node_country(node)],
+                  'rack': [RACKS[node % len(RACKS)]]}
+    for tag in range(extra_tags):
+        asset_tags['tag_%d' % tag] = ['value_%d' % (node % (tag + 2))]
+    return {'hostname': 'compute-%d' % node,
+            'trusted': node % UNTRUSTED_EVERY != 0,
+            'valid_to': (EXPIRED_VALID_TO if node % EXPIRED_EVERY == 0
+                         else VALID_TO),
+            'asset_tags': asset_tags}
+
+
+def filler(table):
+    """Zeros for the columns without default the benchmarks do not read."""
+    values = {}
+    for column in table.columns:
+        if (column.primary_key or column.nullable or
+                column.default is not None):
+            continue
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = int
+        values[column.name] = ('' if python_type in (str, type(u''))
+                               else 0)
+    return values
+
+
+def insert(engine, table, rows):
+    for start in range(0, len(rows), BATCH):
+        engine.execute(table.insert(), rows[start:start + BATCH])
+
+
+def refuse_non_empty(engine, tables):
+    """Exits unless the tables a fleet is written to are empty."""
+    for table in tables:
+        if engine.dialect.has_table(engine, table):
+            rows = engine.execute('SELECT COUNT(*) FROM %s'
+                                  % table).scalar()
+            if rows:
+                sys.exit('%s has %d rows, --force empties the tables of '
+                         'the fleet' % (table, rows))
+
+
+def create_compute_nodes(engine, models, hosts):
+    table = models.ComputeNode.__table__
+    compute_filler = filler(table)
+    insert(engine, table, [
+        dict(compute_filler, id=node, host='compute-%d' % node,
+             hypervisor_hostname='compute-%d' % node,
+             host_ip='10.%d.%d.%d' % (node >> 16, (node >> 8) & 255,
+                                      node & 255),
+             created_at=CREATED_AT, deleted=0)
+        for node in range(1, hosts + 1)])
+
+
+def create_hvspecs(db, asset_tag_utils, admin, hosts, private_pem, keys=3,
+                   extra_tags=0):
+    """The unsigned and signed trust reports of every compute node.
+
+    :param keys: hv_specs keys per compute node, hostname, trust_report
+                 and signed_trust_report being counted
+    """
+    for start in range(1, hosts + 1, BATCH):
+        hvspecs = {}
+        summaries = {}
+        for node in range(start, min(start + BATCH, hosts + 1)):
+            report = trust_report(node, extra_tags)
+            hvspecs[node] = {'trust_report': json.dumps(report,
+                                                        sort_keys=True),
+                             'signed_trust_report': sign(report,
+                                                         private_pem),
+                             'hostname': report['hostname']}
+            for key in range(keys - 3):
+                hvspecs[node]['attribute_%d' % key] = 'value-%d-%d' % (
+                    node, key)
+            summary = {'trusted': report['trusted'],
+                       'valid_to': asset_tag_utils.parseValidTo(
+                           report['valid_to']),
+                       'asset_tags': report['asset_tags']}
+            summaries[node] = {'trust_report': summary,
+                               'signed_trust_report': summary}
+        db.hvspec_set(admin, hvspecs, summaries=summaries)
+        print('hv_specs %d/%d compute nodes' % (
+            min(start + BATCH - 1, hosts), hosts), file=sys.stderr)
+
+
+def load_fleet(path):
+    """fleet.json of a fleet_generator.py directory, or the file itself."""
+    if os.path.isdir(path):
+        path = os.path.join(path, 'fleet.json')
+    if not os.path.exists(path):
+        sys.exit('%s not found, run fleet_generator.py first' % path)
+    with open(path) as fleet_file:
+        return json.load(fleet_file)
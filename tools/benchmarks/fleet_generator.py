@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""Deterministic synthetic fleet for the CIT performance tests.
+
+Writes a fleet into a SQLite (or --url) nova database. Each compute node
+gets an unsigned and an RS256 signed trust report in hv_specs, with their
+summary columns and hv_spec_tags rows. Extra hv_specs keys and a
+soft-deleted report history are optional. The instances are booted from
+CIT images and carry the image_trust, image_tags and
+image_mtwilson_trustpolicy_location system metadata nova copies from the
+image. Each instance is placed on a host its image policy passes. The
+images are written as a Glance v2 image list, images.json.
+
+The dataset only depends on the options and the key pair. The hub key
+pair is generated into --directory on the first run and reused on the
+next ones, so the scheduler, os-hypervisors API and Horizon benchmarks
+run on the same rows. fleet.json describes the dataset and the results
+expected from it, such as the number of hosts each image passes.
+
+Imports the installed nova, which has to be patched with one of the
+12.0.2, 12.0.4, 13.0.0 or 13.1.0 patch sets. The SQLite database is
+created again on every run. With --url the tables the fleet is written to
+have to be empty, --force empties them first.
+
+The trust reports, the key pair and the rows are built by fleet_common.py,
+which the benchmarks use for their own fleets as well. Their --fleet
+option runs them on the fleet of a directory instead.
+
+Usage:
+    python tools/benchmarks/fleet_generator.py [--directory DIR]
+        [--hosts 1000] [--instances-per-host 2] [--images 20]
+        [--keys 3] [--extra-tags 0] [--history 0]
+        [--storage text|compressed] [--seed 0] [--url URL [--force]]
+"""
+from __future__ import print_function
+
+import argparse
+import ast
+import datetime
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+
+from fleet_common import COUNTRIES
+from fleet_common import CREATED_AT
+from fleet_common import create_compute_nodes
+from fleet_common import create_hvspecs
+from fleet_common import filler
+from fleet_common import insert
+from fleet_common import load_keys
+from fleet_common import node_country
+from fleet_common import node_trusted
+from fleet_common import refuse_non_empty
+from fleet_common import trust_report
+from fleet_common import write_config
+
+
+# Image properties of the CIT image policies, the tag selection being the
+# string literal set on the images
+IMAGE_POLICIES = (
+    ('no_trust', {}),
+    ('trust', {'trust': 'true'}),
+    ('trust_tags', {'trust': 'true'}),
+    ('trust_policy', {'mtwilson_trustpolicy_location': 'glance_image_tar'}),
+)
+
+TABLES = ('hv_spec_tags', 'hv_specs', 'instance_info_caches',
+          'instance_system_metadata', 'instance_extra', 'instances',
+          'compute_nodes')
+
+FLAVOR = {'name': 'cit.fleet',
+          'flavorid': 'cit-fleet',
+          'memory_mb': 512,
+          'vcpus': 1,
+          'root_gb': 1,
+          'ephemeral_gb': 0,
+          'swap': 0,
+          'rxtx_factor': 1.0,
+          'vcpu_weight': None,
+          'disabled': False,
+          'is_public': True}
+
+
+def random_uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_images(count, rng):
+    """Glance v2 image records, cycling through the image policies."""
+    images = []
+    for index in range(count):
+        policy, properties = IMAGE_POLICIES[index % len(IMAGE_POLICIES)]
+        properties = dict(properties)
+        if policy == 'trust_tags':
+            country = COUNTRIES[(index // len(IMAGE_POLICIES)) %
+                                len(COUNTRIES)]
+            properties['tags'] = repr({'country': [country]})
+        image_id = random_uuid(rng)
+        name = 'cit-%s-%d' % (policy, index)
+        image = {'id': image_id,
+                 'name': name,
+                 'status': 'active',
+                 'visibility': 'public',
+                 'protected': False,
+                 'owner': 'fleet-project',
+                 'disk_format': 'qcow2',
+                 'container_format': 'bare',
+                 'size': 1073741824,
+                 'checksum': hashlib.md5(name.encode('ascii')).hexdigest(),
+                 'min_disk': 1,
+                 'min_ram': 0,
+                 'tags': [],
+                 'created_at': CREATED_AT.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                 'updated_at': CREATED_AT.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                 'file': '/v2/images/%s/file' % image_id,
+                 'self': '/v2/images/%s' % image_id,
+                 'schema': '/v2/schemas/image'}
+        # Custom properties are top level attributes in Glance v2
+        image.update(properties)
+        images.append((policy, properties, image))
+    return images
+
+
+def passing_nodes(hosts, properties):
+    """Compute nodes TrustAssertionFilter passes for an image."""
+    if ('trust' not in properties and
+            'mtwilson_trustpolicy_location' not in properties):
+        return list(range(1, hosts + 1))
+    nodes = [node for node in range(1, hosts + 1) if node_trusted(node)]
+    if 'tags' in properties:
+        country = ast.literal_eval(properties['tags'])['country'][0]
+        nodes = [node for node in nodes if node_country(node) == country]
+    return nodes
+
+
+def create_history(engine, models, args):
+    """Soft-deleted reports of earlier pushes, deleted set to the id as nova
+    does, for the archive and the migrations.
+    """
+    table = models.HVMetadata.__table__
+    next_id = (engine.execute('SELECT MAX(id) FROM hv_specs').scalar() or
+               0) + 1
+    rows = []
+    for node in range(1, args.hosts + 1):
+        report = json.dumps(trust_report(node, args.extra_tags),
+                            sort_keys=True)
+        for version in range(args.history):
+            deleted_at = CREATED_AT - datetime.timedelta(hours=version + 1)
+            rows.append({'id': next_id, 'deleted': next_id,
+                         'created_at': deleted_at, 'deleted_at': deleted_at,
+                         'compute_node_id': node, 'key': 'trust_report',
+                         'value': report})
+            next_id += 1
+    insert(engine, table, rows)
+    return len(rows)
+
+
+def create_flavor(engine, db, objects, admin):
+    engine.execute("DELETE FROM instance_types WHERE flavorid = '%s'"
+                   % FLAVOR['flavorid'])
+    db_flavor = db.flavor_create(admin, dict(FLAVOR))
+    return objects.Flavor._from_db_object(admin, objects.Flavor(), db_flavor)
+
+
+def create_instances(engine, models, flavor, images, args, rng):
+    instances_table = models.Instance.__table__
+    instance_filler = filler(instances_table)
+    # Stored as nova does when an instance is created
+    flavor_json = json.dumps({'cur': flavor.obj_to_primitive(),
+                              'old': None, 'new': None})
+
+    candidates = [(image, passing_nodes(args.hosts, properties))
+                  for policy, properties, image in images]
+    candidates = [(image, nodes) for image, nodes in candidates if nodes]
+
+    instances = []
+    system_metadata = []
+    extras = []
+    info_caches = []
+    for index in range(1, args.hosts * args.instances_per_host + 1):
+        image, nodes = rng.choice(candidates)
+        node = rng.choice(nodes)
+        instance_uuid = random_uuid(rng)
+        instances.append(dict(
+            instance_filler, id=index, uuid=instance_uuid,
+            user_id='fleet-user', project_id='fleet-project',
+            image_ref=image['id'], hostname='vm-%d' % index,
+            display_name='vm-%d' % index, host='compute-%d' % node,
+            node='compute-%d' % node, launched_on='compute-%d' % node,
+            vm_state='active', power_state=1, memory_mb=flavor.memory_mb,
+            vcpus=flavor.vcpus, root_gb=flavor.root_gb,
+            ephemeral_gb=flavor.ephemeral_gb, instance_type_id=flavor.id,
+            launch_index=0, reservation_id='r-%08d' % index,
+            availability_zone='nova', root_device_name='/dev/vda',
+            locked=False, cleaned=0, created_at=CREATED_AT,
+            launched_at=CREATED_AT, deleted=0))
+
+        # The image properties nova copies to the system metadata
+        image_metadata = {'base_image_ref': image['id'],
+                          'disk_format': image['disk_format'],
+                          'container_format': image['container_format'],
+                          'min_disk': image['min_disk'],
+                          'min_ram': image['min_ram']}
+        for name in ('trust', 'tags', 'mtwilson_trustpolicy_location'):
+            if name in image:
+                image_metadata[name] = image[name]
+        for name, value in sorted(image_metadata.items()):
+            system_metadata.append({'instance_uuid': instance_uuid,
+                                    'key': 'image_%s' % name,
+                                    'value': '%s' % value,
+                                    'created_at': CREATED_AT,
+                                    'deleted': 0})
+        extras.append({'instance_uuid': instance_uuid, 'flavor': flavor_json,
+                       'created_at': CREATED_AT, 'deleted': 0})
+        info_caches.append({'instance_uuid': instance_uuid,
+                            'network_info': '[]',
+                            'created_at': CREATED_AT, 'deleted': 0})
+
+    insert(engine, instances_table, instances)
+    insert(engine, models.InstanceSystemMetadata.__table__, system_metadata)
+    insert(engine, models.InstanceExtra.__table__, extras)
+    insert(engine, models.InstanceInfoCache.__table__, info_caches)
+    return instances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--directory', default='cit-fleet',
+                        help='directory of the SQLite database, key pair, '
+                             'images.json and fleet.json')
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help='compute nodes of the fleet')
+    parser.add_argument('--instances-per-host', type=int, default=2,
+                        help='instances booted per compute node, on average')
+    parser.add_argument('--images', type=int, default=20,
+                        help='images, cycling through the image policies')
+    parser.add_argument('--keys', type=int, default=3,
+                        help='hv_specs keys per compute node, at least the '
+                             '3 of the trust reports')
+    parser.add_argument('--extra-tags', type=int, default=0,
+                        help='asset tags added to country and rack')
+    parser.add_argument('--history', type=int, default=0,
+                        help='soft-deleted trust reports per compute node')
+    parser.add_argument('--storage', default='text',
+                        choices=('text', 'compressed'),
+                        help='trust_report_storage of the hv_specs rows')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the image ids and of the instance '
+                             'placement')
+    parser.add_argument('--url',
+                        help='SQLAlchemy database URL, a SQLite database '
+                             'in --directory by default')
+    parser.add_argument('--force', action='store_true',
+                        help='empty the tables of the fleet in a --url '
+                             'database holding rows')
+    args = parser.parse_args()
+    if args.keys < 3:
+        sys.exit('--keys has to be at least 3')
+    if args.images < 1:
+        sys.exit('--images has to be at least 1')
+
+    directory = os.path.abspath(args.directory)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    url = args.url
+    if not url:
+        path = os.path.join(directory, 'nova.sqlite')
+        if os.path.exists(path):
+            os.remove(path)
+        url = 'sqlite:///%s' % path
+    config_file = write_config(directory, url, [
+        ('trusted_computing', [('trust_report_storage', args.storage)])])
+    private_pem, private_path, public_path = load_keys(directory)
+
+    from nova import config
+    config.parse_args([sys.argv[0], '--config-file', config_file],
+                      default_config_files=[])
+
+    from nova import context
+    from nova import db
+    from nova.db.sqlalchemy import api as db_api
+    from nova.db.sqlalchemy import models
+    from nova import objects
+    from nova.openstack.common import asset_tag_utils
+    from nova import version
+
+    objects.register_all()
+    engine = db_api.get_engine()
+    models.BASE.metadata.create_all(engine)
+    if args.url and not args.force:
+        refuse_non_empty(engine, TABLES)
+    for table in TABLES:
+        engine.execute('DELETE FROM %s' % table)
+
+    admin = context.get_admin_context()
+    rng = random.Random(args.seed)
+    start = time.time()
+
+    create_compute_nodes(engine, models, args.hosts)
+    create_hvspecs(db, asset_tag_utils, admin, args.hosts, private_pem,
+                   keys=args.keys, extra_tags=args.extra_tags)
+    history = create_history(engine, models, args) if args.history else 0
+    images = generate_images(args.images, rng)
+    flavor = create_flavor(engine, db, objects, admin)
+    instances = create_instances(engine, models, flavor, images, args, rng)
+    print('%d compute nodes, %d instances, %d images in %.1f s'
+          % (args.hosts, len(instances), len(images), time.time() - start),
+          file=sys.stderr)
+
+    images_path = os.path.join(directory, 'images.json')
+    with open(images_path, 'w') as images_file:
+        json.dump({'images': [image for policy, properties, image in images],
+                   'first': '/v2/images',
+                   'schema': '/v2/schemas/images'},
+                  images_file, indent=2, sort_keys=True)
+
+    hosts_passing = {}
+    for policy, properties, image in images:
+        hosts_passing[image['name']] = len(passing_nodes(args.hosts,
+                                                         properties))
+    hosts_by_country = dict((country, 0) for country in COUNTRIES)
+    for node in range(1, args.hosts + 1):
+        hosts_by_country[node_country(node)] += 1
+
+    document = {'nova_version': version.version_string(),
+                'python': platform.python_version(),
+                'database': engine.dialect.name,
+                'url': url,
+                'seed': args.seed,
+                'hosts': args.hosts,
+                'instances': len(instances),
+                'images': len(images),
+                'keys': args.keys,
+                'extra_tags': args.extra_tags,
+                'history_rows': history,
+                'storage': args.storage,
+                'files': {'config': config_file,
+                          'hub_public_key': public_path,
+                          'hub_private_key': private_path,
+                          'images': images_path},
+                'expected': {
+                    'trusted_hosts': len([node for node in
+                                          range(1, args.hosts + 1)
+                                          if node_trusted(node)]),
+                    'hosts_by_country': hosts_by_country,
+                    'hosts_passing': hosts_passing}}
+    with open(os.path.join(directory, 'fleet.json'), 'w') as fleet:
+        json.dump(document, fleet, indent=2, sort_keys=True)
+    print(json.dumps(document, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
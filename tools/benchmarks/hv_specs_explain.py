@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""Query plan regression check for the hv_specs indexes.
+
+Creates hv_specs with the controller change-script.py, fills it with a
+fleet of trust reports including their soft-deleted history, then checks
+with EXPLAIN that every hv_specs lookup done by nova is served by an index
+instead of a full table scan. Exits with status 1 when a lookup scans.
+
+Runs on an in-memory SQLite database by default, pass --url to check a
+MySQL database instead (the hv_specs, hv_spec_tags and compute_nodes tables
+of that database are dropped and re-created).
+
+Usage:
+    python tools/benchmarks/hv_specs_explain.py [--rows N] [--url URL]
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import imp
+import os
+import sys
+import timeit
+
+import sqlalchemy
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+
+
+CHANGE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    'packages', 'mtwilson-openstack-controller', 'src', 'main', 'resources',
+    'change-script.py')
+
+KEYS = ('trust_report', 'signed_trust_report', 'hostname')
+
+# Soft-deleted versions kept for each live hv_specs row
+HISTORY = 10
+
+# The lookups of nova/db/sqlalchemy/api.py, read_deleted='no' being
+# deleted = 0
+QUERIES = (
+    ('hvspec_get_by_key',
+     'SELECT * FROM hv_specs WHERE {key} = :key AND deleted = 0',
+     {'key': 'trust_report'}),
+    ('hvspec_get_by_compute_node_id',
+     'SELECT * FROM hv_specs WHERE compute_node_id = :compute_node_id '
+     'AND deleted = 0',
+     {'compute_node_id': 42}),
+    ('hvspec_get_by_compute_node_id_and_key',
+     'SELECT * FROM hv_specs WHERE compute_node_id = :compute_node_id '
+     'AND {key} = :key AND deleted = 0',
+     {'compute_node_id': 42, 'key': 'trust_report'}),
+    ('hvspec_get_trusted_compute_node_ids',
+     'SELECT hv_specs.compute_node_id FROM hv_specs '
+     'JOIN hv_spec_tags AS tag ON tag.hv_spec_id = hv_specs.id '
+     'AND tag.name = :name AND tag.value = :value '
+     'WHERE {key} = :key AND deleted = 0 AND trusted = 1 '
+     'AND valid_to > :valid_until',
+     {'key': 'trust_report', 'name': 'country', 'value': 'US',
+      'valid_until': datetime.datetime(2016, 6, 1, 10, 5)}),
+)
+
+# Asset tags of the live trust reports, the country tag being set on every
+# other compute node
+TAGS = (('country', ('US', 'DE')), ('rack', ('r1', 'r2', 'r3', 'r4')))
+
+
+def create_tables(engine):
+    meta = MetaData()
+    Table('compute_nodes', meta,
+          Column('id', Integer, primary_key=True),
+          Column('hypervisor_hostname', String(255)),
+          mysql_engine='InnoDB')
+    for name in ('hv_spec_tags', 'hv_specs', 'compute_nodes'):
+        engine.execute('DROP TABLE IF EXISTS %s' % name)
+    meta.create_all(engine)
+
+    change_script = imp.load_source('change_script', CHANGE_SCRIPT)
+    change_script.upgrade(engine)
+
+
+def populate(engine, rows):
+    # Every live row has HISTORY soft-deleted versions, deleted holding the
+    # row id as nova's soft_delete does
+    per_node = len(KEYS) * (HISTORY + 1)
+    nodes = max(1, rows // per_node)
+
+    engine.execute(
+        sqlalchemy.text('INSERT INTO compute_nodes (id, hypervisor_hostname) '
+                        'VALUES (:id, :hostname)'),
+        [{'id': node, 'hostname': 'compute-%d' % node}
+         for node in range(1, nodes + 1)])
+
+    key = engine.dialect.identifier_preparer.quote('key')
+    insert = sqlalchemy.text(
+        'INSERT INTO hv_specs (id, compute_node_id, %s, value, deleted, '
+        'trusted, valid_to) VALUES (:id, :compute_node_id, :key, :value, '
+        ':deleted, :trusted, :valid_to)' % key)
+    insert_tag = sqlalchemy.text(
+        'INSERT INTO hv_spec_tags (hv_spec_id, name, value) '
+        'VALUES (:hv_spec_id, :name, :value)')
+    valid_to = datetime.datetime(2016, 6, 1, 11, 0)
+    batch = []
+    tags = []
+    row_id = 0
+    for node in range(1, nodes + 1):
+        for name in KEYS:
+            for version in range(HISTORY + 1):
+                row_id += 1
+                live = version == HISTORY
+                report = name == 'trust_report'
+                batch.append({'id': row_id, 'compute_node_id': node,
+                              'key': name, 'value': 'x' * 64,
+                              'deleted': 0 if live else row_id,
+                              'trusted': True if report else None,
+                              'valid_to': valid_to if report else None})
+                if live and report:
+                    for tag, values in TAGS:
+                        tags.append({'hv_spec_id': row_id, 'name': tag,
+                                     'value': values[node % len(values)]})
+        if len(batch) >= 10000:
+            engine.execute(insert, batch)
+            engine.execute(insert_tag, tags)
+            batch = []
+            tags = []
+    if batch:
+        engine.execute(insert, batch)
+    if tags:
+        engine.execute(insert_tag, tags)
+
+    # Not analyzed on SQLite, with statistics it skip-scans the unique
+    # constraint for every compute node, which EXPLAIN does not report as
+    # a scan
+    if engine.dialect.name == 'mysql':
+        engine.execute('ANALYZE TABLE hv_specs, hv_spec_tags')
+    return row_id
+
+
+def explain(engine, sql, params):
+    """Returns the plan lines and whether hv_specs is fully scanned."""
+    if engine.dialect.name == 'sqlite':
+        result = engine.execute(sqlalchemy.text('EXPLAIN QUERY PLAN ' + sql),
+                                params)
+        plan = [row[-1] for row in result]
+        scans = any(line.startswith('SCAN') for line in plan)
+    else:
+        result = engine.execute(sqlalchemy.text('EXPLAIN ' + sql), params)
+        plan = []
+        scans = False
+        for row in result:
+            row = dict(row.items())
+            plan.append('type=%(type)s key=%(key)s rows=%(rows)s '
+                        'extra=%(Extra)s' % row)
+            scans = (scans or row['type'] == 'ALL' or
+                     'skip scan' in (row['Extra'] or ''))
+    return plan, scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='approximate number of hv_specs rows')
+    parser.add_argument('--url', default='sqlite://',
+                        help='SQLAlchemy database URL')
+    parser.add_argument('--number', type=int, default=200,
+                        help='executions per timed query')
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(args.url)
+    create_tables(engine)
+    rows = populate(engine, args.rows)
+    print('%s, %d hv_specs rows' % (engine.dialect.name, rows))
+
+    key = engine.dialect.identifier_preparer.quote('key')
+    failures = []
+    for name, sql, params in QUERIES:
+        sql = sql.format(key=key)
+        plan, scans = explain(engine, sql, params)
+        duration = min(timeit.repeat(
+            lambda: engine.execute(sqlalchemy.text(sql), params).fetchall(),
+            number=args.number, repeat=3)) / args.number
+
+        print('\n%s (%.1f us)' % (name, duration * 1e6))
+        for line in plan:
+            print('    %s' % line)
+        if scans:
+            failures.append(name)
+
+    if failures:
+        sys.exit('\nfull table scan of hv_specs in: %s' % ', '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
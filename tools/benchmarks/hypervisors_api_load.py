@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""Load test of the os-hypervisors metadata API, run in-process.
+
+Creates a HypervisorsController on a SQLite (or --url) nova database with
+a fleet of compute nodes, then replays a mix of trust report pushes
+(create) and reads (hvspecs, metadata, asset_tags, truststatus) from
+--concurrency threads, each request carrying an admin context as the
+nova API middleware would. Reports per action the throughput, the latency
+percentiles and histogram, the errors and the SQL statements per request,
+as a JSON document.
+
+Imports the installed nova, which has to be patched with one of the
+12.0.2, 12.0.4, 13.0.0 or 13.1.0 patch sets. The trust reports are pushed
+unsigned and read with trusted_computing/signature_verification off.
+
+The compute nodes and trust reports are the ones of fleet_common.py. With
+--fleet the requests run on the database of a fleet_generator.py
+directory instead, a SQLite one being copied first so that the pushes
+leave the fleet unchanged.
+
+Usage:
+    python tools/benchmarks/hypervisors_api_load.py
+        [--hosts 1000] [--keys 10] [--requests 5000] [--concurrency 8]
+        [--mix create=20,metadata=50,truststatus=20,asset_tags=5,hvspecs=5]
+        [--hosts-per-push 50] [--url URL [--force] | --fleet DIR]
+        [--output FILE]
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+
+from fleet_common import create_compute_nodes
+from fleet_common import load_fleet
+from fleet_common import refuse_non_empty
+from fleet_common import trust_report
+from fleet_common import write_config
+
+
+ACTIONS = ('create', 'hvspecs', 'metadata', 'asset_tags', 'truststatus')
+
+TABLES = ('hv_spec_tags', 'hv_specs', 'compute_nodes')
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class FakeRequest(object):
+    """What the controller reads of the webob request."""
+
+    def __init__(self, context):
+        self.environ = {'nova.context': context}
+
+
+def write_policy(directory):
+    path = os.path.join(directory, 'policy.json')
+    with open(path, 'w') as policy:
+        # Every API action is allowed, the requests are not authorized
+        json.dump({'default': ''}, policy)
+    return path
+
+
+def host_details(node, keys):
+    """The hostDetailsList entry the hub pushes for a compute node."""
+    details = {'hostname': 'compute-%d' % node,
+               'trust_report': json.dumps(trust_report(node),
+                                          sort_keys=True)}
+    # hostname and trust_report are stored as keys as well
+    for key in range(keys - 2):
+        details['attribute_%d' % key] = 'value-%d-%d' % (node, key)
+    return details
+
+
+def parse_mix(mix):
+    weights = []
+    for item in mix.split(','):
+        action, weight = item.split('=')
+        if action not in ACTIONS:
+            sys.exit('unknown action %s, expected one of %s'
+                     % (action, ', '.join(ACTIONS)))
+        weights.append((action, int(weight)))
+    return weights
+
+
+def percentile(durations, percent):
+    ordered = sorted(durations)
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def histogram(durations):
+    counts = collections.OrderedDict(('<=%dms' % bound, 0)
+                                     for bound in BUCKETS_MS)
+    counts['>%dms' % BUCKETS_MS[-1]] = 0
+    for duration in durations:
+        milliseconds = duration * 1000
+        for bound in BUCKETS_MS:
+            if milliseconds <= bound:
+                counts['<=%dms' % bound] += 1
+                break
+        else:
+            counts['>%dms' % BUCKETS_MS[-1]] += 1
+    return counts
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, controller, context, plan, args, statements):
+        super(Worker, self).__init__()
+        self.daemon = True
+        self.controller = controller
+        self.context = context
+        self.plan = plan
+        self.args = args
+        self.statements = statements
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.random = random.Random()
+
+    def request(self, action):
+        req = FakeRequest(self.context)
+        node = self.random.randint(1, self.args.hosts)
+        if action == 'create':
+            nodes = [self.random.randint(1, self.args.hosts)
+                     for push in range(self.args.hosts_per_push)]
+            body = {'hostDetailsList': [
+                host_details(node, self.args.keys) for node in nodes]}
+            return self.controller.create(req, body)
+        if action == 'hvspecs':
+            return self.controller.hvspecs(req)
+        if action == 'metadata':
+            return self.controller.metadata(req, str(node))
+        if action == 'asset_tags':
+            return self.controller.asset_tags(req)
+        return self.controller.truststatus(req, str(node))
+
+    def run(self):
+        while True:
+            try:
+                action = self.plan.pop()
+            except IndexError:
+                return
+            self.statements.count = 0
+            start = time.time()
+            try:
+                self.request(action)
+            except Exception as exc:
+                self.errors[(action, exc.__class__.__name__)] += 1
+            self.samples[action].append((time.time() - start,
+                                         self.statements.count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help='compute nodes of the fleet')
+    parser.add_argument('--keys', type=int, default=10,
+                        help='hv_specs keys pushed per compute node')
+    parser.add_argument('--requests', type=int, default=5000,
+                        help='requests replayed after the initial push')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='threads sending the requests')
+    parser.add_argument('--mix', default='create=20,metadata=50,'
+                                         'truststatus=20,asset_tags=5,'
+                                         'hvspecs=5',
+                        help='comma separated action=weight')
+    parser.add_argument('--hosts-per-push', type=int, default=50,
+                        help='hostDetailsList entries per create request')
+    database = parser.add_mutually_exclusive_group()
+    database.add_argument('--url',
+                          help='SQLAlchemy database URL, a temporary SQLite '
+                               'database by default')
+    database.add_argument('--fleet',
+                          help='fleet_generator.py directory or fleet.json '
+                               'whose database and compute nodes are used '
+                               'instead of --hosts')
+    parser.add_argument('--force', action='store_true',
+                        help='empty the tables of the fleet in a --url '
+                             'database holding rows')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the request mix')
+    parser.add_argument('--output', help='file the JSON is written to '
+                                         'instead of stdout')
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+
+    fleet = load_fleet(args.fleet) if args.fleet else None
+
+    directory = tempfile.mkdtemp(prefix='hypervisors_api_load')
+    try:
+        trusted_computing = [('signature_verification', 'off'),
+                             ('trust_report_fanout', False)]
+        if fleet:
+            args.hosts = fleet['hosts']
+            url = fleet['url']
+            if url.startswith('sqlite:///'):
+                path = os.path.join(directory, 'nova.sqlite')
+                shutil.copyfile(url[len('sqlite:///'):], path)
+                url = 'sqlite:///%s' % path
+            trusted_computing.append(('trust_report_storage',
+                                      fleet['storage']))
+        else:
+            url = args.url or 'sqlite:///%s' % os.path.join(directory,
+                                                             'nova.sqlite')
+        config_file = write_config(directory, url, [
+            ('oslo_policy', [('policy_file', write_policy(directory))]),
+            ('trusted_computing', trusted_computing)])
+
+        from nova import config
+        config.parse_args([sys.argv[0], '--config-file', config_file],
+                          default_config_files=[])
+
+        from nova.api.openstack.compute import hypervisors
+        from nova import context
+        from nova.db.sqlalchemy import api as db_api
+        from nova.db.sqlalchemy import models
+        from nova import version
+
+        engine = db_api.get_engine()
+        models.BASE.metadata.create_all(engine)
+        if not fleet:
+            if args.url and not args.force:
+                refuse_non_empty(engine, TABLES)
+            for table in TABLES:
+                engine.execute('DELETE FROM %s' % table)
+            create_compute_nodes(engine, models, args.hosts)
+
+        # SQL statements of the request being run by the current thread
+        statements = threading.local()
+
+        def count_statement(*args):
+            statements.count = getattr(statements, 'count', 0) + 1
+
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+        admin = context.get_admin_context()
+        controller = hypervisors.HypervisorsController()
+
+        # Every compute node has its keys before the reads start, the
+        # fleet ones already have theirs
+        pushes = [] if fleet else range(1, args.hosts + 1,
+                                        args.hosts_per_push)
+        for start in pushes:
+            nodes = range(start, min(start + args.hosts_per_push,
+                                     args.hosts + 1))
+            controller.create(FakeRequest(admin), {'hostDetailsList': [
+                host_details(node, args.keys) for node in nodes]})
+
+        plan_random = random.Random(args.seed)
+        population = [action for action, weight in weights
+                      for count in range(weight)]
+        plan = [plan_random.choice(population)
+                for request in range(args.requests)]
+
+        workers = [Worker(controller, admin, plan, args, statements)
+                   for thread in range(args.concurrency)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = {}
+    for action in ACTIONS:
+        samples = [sample for worker in workers
+                   for sample in worker.samples[action]]
+        if not samples:
+            continue
+        durations = [duration for duration, count in samples]
+        errors = {}
+        for worker in workers:
+            for (failed, name), count in worker.errors.items():
+                if failed == action:
+                    errors[name] = errors.get(name, 0) + count
+        results[action] = {
+            'requests': len(samples),
+            'errors': errors,
+            'throughput_rps': round(len(samples) / elapsed, 1),
+            'p50_ms': round(percentile(durations, 50) * 1000, 3),
+            'p90_ms': round(percentile(durations, 90) * 1000, 3),
+            'p99_ms': round(percentile(durations, 99) * 1000, 3),
+            'max_ms': round(max(durations) * 1000, 3),
+            'histogram': histogram(durations),
+            'statements_per_request': round(
+                float(sum(count for duration, count in samples)) /
+                len(samples), 2)}
+        print('%-12s %6d req %8.1f req/s  p50 %9.3f ms  p99 %9.3f ms  '
+              '%7.2f statements  %d errors'
+              % (action, len(samples), results[action]['throughput_rps'],
+                 results[action]['p50_ms'], results[action]['p99_ms'],
+                 results[action]['statements_per_request'],
+                 sum(errors.values())),
+              file=sys.stderr)
+
+    document = {'nova_version': version.version_string(),
+                'python': platform.python_version(),
+                'database': engine.dialect.name,
+                'hosts': args.hosts,
+                'fleet': args.fleet,
+                'keys': args.keys,
+                'concurrency': args.concurrency,
+                'hosts_per_push': args.hosts_per_push,
+                'elapsed_s': round(elapsed, 3),
+                'throughput_rps': round(args.requests / elapsed, 1),
+                'actions': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2)
+    else:
+        print(json.dumps(document, indent=2))
+
+
+if __name__ == '__main__':
+    main()
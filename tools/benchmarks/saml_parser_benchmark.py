@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""Microbenchmark for the Mt. Wilson SAML assertion parser.
+
+Compares saml_utils.parse_host_assertion against the findall based parser
+it replaced, on generated assertions shaped like the ones returned by
+/mtwilson/v2/host-attestations (signed, with 0 to 50 asset tags).
+
+Usage:
+    python tools/benchmarks/saml_parser_benchmark.py [--number N]
+                                                     [--saml-utils-dir DIR]
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+from lxml import etree
+
+
+DEFAULT_SAML_UTILS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    'controller', 'mtwilson-openstack-host-tag-vm', 'src', 'resources',
+    '2015.1.2', 'root', 'usr', 'lib', 'python2.7')
+
+TAG_COUNTS = (0, 1, 5, 20, 50)
+
+ASSERTION_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<saml2:Assertion xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion" ID="HostTrustAssertion" IssueInstant="2016-06-01T10:00:00.000Z" Version="2.0">
+<saml2:Issuer>https://mtwilson.example.com:8443</saml2:Issuer>
+<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo><CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315#WithComments"/><SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/><Reference URI="#HostTrustAssertion"><Transforms><Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/></Transforms><DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/><DigestValue>{digest}</DigestValue></Reference></SignedInfo><SignatureValue>{signature}</SignatureValue><KeyInfo><X509Data><X509Certificate>{certificate}</X509Certificate></X509Data></KeyInfo></Signature>
+<saml2:Subject><saml2:NameID Format="urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified">compute-{index}</saml2:NameID><saml2:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:sender-vouches"><saml2:NameID Format="urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified">Intel Cloud Integrity Technology</saml2:NameID><saml2:SubjectConfirmationData Address="10.0.0.{index}" NotBefore="2016-06-01T10:00:00.000Z" NotOnOrAfter="2016-06-01T11:00:00.000Z"/></saml2:SubjectConfirmation></saml2:Subject>
+<saml2:AttributeStatement>
+{attributes}
+</saml2:AttributeStatement>
+</saml2:Assertion>"""
+
+ATTRIBUTE_TEMPLATE = ('<saml2:Attribute Name="{name}"><saml2:AttributeValue '
+                      'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                      'xsi:type="xs:string">{value}</saml2:AttributeValue>'
+                      '</saml2:Attribute>')
+
+FIXED_ATTRIBUTES = (
+    ('Host_Name', 'compute-{index}'),
+    ('Host_Address', '10.0.0.{index}'),
+    ('Trusted', 'true'),
+    ('Trusted_BIOS', 'true'),
+    ('BIOS_Name', 'Intel Corp.'),
+    ('BIOS_Version', 'SE5C610.86B.01.01.0008.021120151325'),
+    ('Trusted_VMM', 'true'),
+    ('VMM_Name', 'Ubuntu'),
+    ('VMM_Version', '14.04-3.13.0-24-generic'),
+    ('AIK_Certificate', '{certificate}'),
+    ('AIK_SHA1', '{digest}'),
+)
+
+
+def generate_assertion(tag_count, index=1):
+    blob = base64.b64encode(os.urandom(1024)).decode('ascii')
+    digest = base64.b64encode(os.urandom(20)).decode('ascii')
+    attributes = []
+    for name, value in FIXED_ATTRIBUTES:
+        attributes.append(ATTRIBUTE_TEMPLATE.format(
+            name=name,
+            value=value.format(index=index, certificate=blob, digest=digest)))
+    for tag in range(tag_count):
+        attributes.append(ATTRIBUTE_TEMPLATE.format(
+            name='TAG[tag_%d]' % tag, value='Value_%d' % tag))
+    return ASSERTION_TEMPLATE.format(
+        index=index, digest=digest, signature=blob[:344], certificate=blob,
+        attributes='\n'.join(attributes)).encode('utf-8')
+
+
+def legacy_verify_and_parse_saml(saml_data):
+    """The findall based parser previously inlined in the trust filter."""
+    trust = False
+    asset_tag = {}
+
+    try:
+        if json.loads(saml_data):
+            return trust, asset_tag
+    except Exception:
+        pass
+
+    ns = {'saml2p': '{urn:oasis:names:tc:SAML:2.0:protocol}',
+          'saml2': '{urn:oasis:names:tc:SAML:2.0:assertion}'}
+
+    try:
+        xp_attributestatement = '{saml2}AttributeStatement/{saml2}Attribute'.format(**ns)
+        xp_attributevalue = '{saml2}AttributeValue'.format(**ns)
+
+        doc = etree.XML(saml_data)
+        elements = doc.findall(xp_attributestatement)
+
+        for el in elements:
+            if el.attrib['Name'].lower() == 'trusted':
+                if el.find(xp_attributevalue).text == 'true':
+                    trust = True
+            elif el.attrib['Name'].lower().startswith("tag"):
+                asset_tag[el.attrib['Name'].lower().split('[')[1].split(']')[0].lower()] = el.find(xp_attributevalue).text.lower()
+
+        return trust, asset_tag
+    except Exception:
+        return trust, asset_tag
+
+
+def best_of(func, number, repeat=7):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=2000,
+                        help='parses per timing run')
+    parser.add_argument('--saml-utils-dir', default=DEFAULT_SAML_UTILS_DIR,
+                        help='directory containing saml_utils.py')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.saml_utils_dir))
+    import saml_utils
+
+    not_registered = json.dumps({'error': 'Host not found'}).encode('utf-8')
+    cases = [('not registered', not_registered)]
+    cases.extend(('%d tags' % count, generate_assertion(count))
+                 for count in TAG_COUNTS)
+
+    print('%-16s %8s %14s %17s %8s' % ('assertion', 'bytes', 'findall (us)',
+                                       'saml_utils (us)', 'speedup'))
+    for label, saml_data in cases:
+        expected = legacy_verify_and_parse_saml(saml_data)
+        parsed = saml_utils.parse_host_assertion(saml_data)
+        tags = dict((k, v.lower()) for k, v in parsed.asset_tags.items())
+        if (parsed.trusted, tags) != expected:
+            sys.exit('parsers disagree on %s: %r != %r'
+                     % (label, (parsed.trusted, tags), expected))
+
+        legacy = best_of(lambda: legacy_verify_and_parse_saml(saml_data),
+                         args.number)
+        current = best_of(lambda: saml_utils.parse_host_assertion(saml_data),
+                          args.number)
+        print('%-16s %8d %14.1f %17.1f %7.2fx' % (label, len(saml_data),
+                                                  legacy * 1e6, current * 1e6,
+                                                  legacy / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""Per-call cost of the host trust checks, replayed from recorded fixtures.
+
+Times asset_tag_utils.isHostTrusted and isAssetTagsPresent, the JWT
+decode of HostTrustUtils.verifySignature and the SAML parse of the legacy
+verify_and_parse_saml filter method, on trust reports with 0 to 50 asset
+tags, RS256 JWTs signed with a local test key, SAML assertions with 0 to
+50 tags and tag policies with 1 to 20 keys. For every case it reports the
+best and median time per call and, under Python 3, the peak and retained
+memory allocated by one call, as a JSON document.
+
+The fixtures are generated on every run unless --fixtures replays a file
+written by --save-fixtures, so that a parser or cache change is measured
+on the same inputs before and after. asset_tag_utils and saml_utils are
+imported from the tree, nova is not needed. verifySignature also reads
+the hub public key through rootwrap, timed here as public_key_read by
+running cat without sudo.
+
+With --fleet the fixtures are signed with the hub key pair of a
+fleet_generator.py directory, and the trust reports of its first compute
+node are read from its database and measured as the fleet cases.
+
+Usage:
+    python tools/benchmarks/trust_check_benchmark.py [--number N]
+        [--fixtures FILE | --save-fixtures FILE] [--fleet DIR]
+        [--asset-tag-utils-dir DIR] [--saml-utils-dir DIR] [--output FILE]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import zlib
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+import jwt
+import sqlalchemy
+
+from fleet_common import ALGORITHM
+from fleet_common import generate_key
+from fleet_common import load_fleet
+from fleet_common import private_bytes
+from fleet_common import public_bytes
+from fleet_common import sign
+from saml_parser_benchmark import DEFAULT_SAML_UTILS_DIR
+from saml_parser_benchmark import generate_assertion
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, the allocations are not reported
+    tracemalloc = None
+
+
+DEFAULT_ASSET_TAG_UTILS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    'controller', 'mtwilson-openstack-host-tag-vm', 'src', 'resources',
+    '13.1.0', 'distribution-location', 'nova', 'openstack', 'common')
+
+TAG_COUNTS = (0, 1, 5, 20, 50)
+POLICY_KEYS = (1, 5, 10, 20)
+
+# Compute node of the fleet whose trust reports are measured, trusted
+FLEET_NODE = 1
+
+# Far enough for the recorded trust reports to stay valid
+VALID_TO = '2099-01-01T00:00:00.000Z'
+
+
+def asset_tags(count):
+    return dict(('tag_%d' % tag, ['value_%d' % tag, 'other_%d' % tag])
+                for tag in range(count))
+
+
+def generate_fixtures(private_pem=None):
+    if private_pem is None:
+        private_key = generate_key()
+        private_pem = private_bytes(private_key)
+    else:
+        private_key = serialization.load_pem_private_key(
+            private_pem, password=None, backend=default_backend())
+    public_pem = public_bytes(private_key)
+
+    fixtures = {'public_key': public_pem.decode('ascii'),
+                'trust_reports': {},
+                'signed_trust_reports': {},
+                'assertions': {},
+                'host_tags': asset_tags(max(POLICY_KEYS)),
+                'policies': {}}
+    for count in TAG_COUNTS:
+        report = {'hostname': 'compute-1',
+                  'trusted': True,
+                  'valid_to': VALID_TO,
+                  'asset_tags': asset_tags(count)}
+        fixtures['trust_reports'][str(count)] = json.dumps(report)
+        fixtures['signed_trust_reports'][str(count)] = sign(report,
+                                                            private_pem)
+        fixtures['assertions'][str(count)] = generate_assertion(
+            count).decode('utf-8')
+    for keys in POLICY_KEYS:
+        # The string literal set as the tags property of an image, every
+        # key matching so that the whole policy is checked
+        fixtures['policies'][str(keys)] = repr(
+            dict(('tag_%d' % tag, ['value_%d' % tag])
+                 for tag in range(keys)))
+    return fixtures
+
+
+def fleet_fixtures(fleet):
+    """The trust reports of FLEET_NODE, as stored in the fleet database."""
+    engine = sqlalchemy.create_engine(fleet['url'])
+    # Reflected, key being a reserved word of MySQL
+    hv_specs = sqlalchemy.Table('hv_specs', sqlalchemy.MetaData(),
+                                autoload=True, autoload_with=engine)
+    rows = engine.execute(
+        sqlalchemy.select([hv_specs.c.key, hv_specs.c.value,
+                           hv_specs.c.value_blob]).where(sqlalchemy.and_(
+                               hv_specs.c.compute_node_id == FLEET_NODE,
+                               hv_specs.c.deleted == 0,
+                               hv_specs.c.key.in_(['trust_report',
+                                                   'signed_trust_report'])))
+    ).fetchall()
+    reports = {}
+    for key, value, value_blob in rows:
+        # value_blob with trust_report_storage = compressed
+        if value_blob is not None:
+            value = zlib.decompress(value_blob).decode('utf-8')
+        reports[key] = value
+    if len(reports) != 2:
+        sys.exit('compute node %d of the fleet has no trust reports'
+                 % FLEET_NODE)
+    return {'trust_report': reports['trust_report'],
+            'signed_trust_report': reports['signed_trust_report'],
+            'tags': len(json.loads(reports['trust_report'])['asset_tags'])}
+
+
+def verify_and_parse_saml(saml_utils, saml_data):
+    """The body of the legacy TrustAssertionFilter.verify_and_parse_saml."""
+    assertion = saml_utils.parse_host_assertion(saml_data)
+    asset_tag = dict((name, value.lower())
+                     for name, value in assertion.asset_tags.items())
+    return assertion.trusted, asset_tag
+
+
+def allocations(func):
+    """Peak and retained bytes allocated by one call, None on Python 2."""
+    if tracemalloc is None:
+        return None, None
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before, current - before
+
+
+def measure(func, number, repeat=7):
+    timings = sorted(timing / number for timing in
+                     timeit.repeat(func, number=number, repeat=repeat))
+    peak, retained = allocations(func)
+    return {'best_us': round(timings[0] * 1e6, 3),
+            'median_us': round(timings[len(timings) // 2] * 1e6, 3),
+            'peak_bytes': peak,
+            'retained_bytes': retained}
+
+
+def cases(fixtures, asset_tag_utils, saml_utils, public_key_path):
+    """(function, case, callable, check) of every measured call."""
+    public_key = fixtures['public_key']
+    host_tags = fixtures['host_tags']
+
+    for count in TAG_COUNTS:
+        report = fixtures['trust_reports'][str(count)]
+        parsed = json.loads(report)
+        yield ('isHostTrusted', '%d tags json' % count,
+               lambda report=report: asset_tag_utils.isHostTrusted(report),
+               lambda result, count=count: (result[0] and
+                                            len(result[1]) == count))
+        yield ('isHostTrusted', '%d tags dict' % count,
+               lambda parsed=parsed: asset_tag_utils.isHostTrusted(parsed),
+               lambda result, count=count: (result[0] and
+                                            len(result[1]) == count))
+
+    for keys in POLICY_KEYS:
+        policy = fixtures['policies'][str(keys)]
+        yield ('isAssetTagsPresent', '%d keys' % keys,
+               lambda policy=policy: asset_tag_utils.isAssetTagsPresent(
+                   host_tags, policy),
+               lambda result: result is True)
+
+    yield ('public_key_read', 'cat',
+           lambda: subprocess.check_output(['cat', public_key_path]),
+           lambda result: result.decode('ascii') == public_key)
+
+    for count in TAG_COUNTS:
+        signed = fixtures['signed_trust_reports'][str(count)]
+        # Decoded as verifySignature does
+        yield ('verifySignature', '%d tags' % count,
+               lambda signed=signed: jwt.decode(signed, public_key,
+                                                ALGORITHM),
+               lambda result, count=count: len(result['asset_tags']) == count)
+
+    fleet = fixtures.get('fleet')
+    if fleet:
+        count = fleet['tags']
+        report = fleet['trust_report']
+        signed = fleet['signed_trust_report']
+        yield ('isHostTrusted', '%d tags fleet' % count,
+               lambda: asset_tag_utils.isHostTrusted(report),
+               lambda result: result[0] and len(result[1]) == count)
+        yield ('verifySignature', '%d tags fleet' % count,
+               lambda: jwt.decode(signed, public_key, ALGORITHM),
+               lambda result: len(result['asset_tags']) == count)
+
+    for count in TAG_COUNTS:
+        saml_data = fixtures['assertions'][str(count)].encode('utf-8')
+        yield ('verify_and_parse_saml', '%d tags' % count,
+               lambda saml_data=saml_data: verify_and_parse_saml(saml_utils,
+                                                                 saml_data),
+               lambda result, count=count: result[0] and
+               len(result[1]) == count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=1000,
+                        help='calls per timing run')
+    fixtures_group = parser.add_mutually_exclusive_group()
+    fixtures_group.add_argument('--fixtures',
+                                help='JSON file of the fixtures replayed, '
+                                     'written by --save-fixtures')
+    fixtures_group.add_argument('--save-fixtures',
+                                help='file the generated fixtures are '
+                                     'written to')
+    parser.add_argument('--fleet',
+                        help='fleet_generator.py directory or fleet.json '
+                             'whose hub key signs the fixtures and whose '
+                             'trust reports are measured')
+    parser.add_argument('--asset-tag-utils-dir',
+                        default=DEFAULT_ASSET_TAG_UTILS_DIR,
+                        help='directory containing asset_tag_utils.py')
+    parser.add_argument('--saml-utils-dir', default=DEFAULT_SAML_UTILS_DIR,
+                        help='directory containing saml_utils.py')
+    parser.add_argument('--output', help='file the JSON is written to '
+                                         'instead of stdout')
+    args = parser.parse_args()
+    if args.fleet and args.fixtures:
+        parser.error('--fleet generates the fixtures, it cannot be used '
+                     'with --fixtures')
+
+    sys.path.insert(0, os.path.abspath(args.asset_tag_utils_dir))
+    sys.path.insert(0, os.path.abspath(args.saml_utils_dir))
+    import asset_tag_utils
+    import saml_utils
+
+    if args.fixtures:
+        with open(args.fixtures) as fixtures_file:
+            fixtures = json.load(fixtures_file)
+    else:
+        fleet = load_fleet(args.fleet) if args.fleet else None
+        private_pem = None
+        if fleet:
+            with open(fleet['files']['hub_private_key'],
+                      'rb') as private_file:
+                private_pem = private_file.read()
+        fixtures = generate_fixtures(private_pem)
+        if fleet:
+            fixtures['fleet'] = fleet_fixtures(fleet)
+        if args.save_fixtures:
+            with open(args.save_fixtures, 'w') as fixtures_file:
+                json.dump(fixtures, fixtures_file, indent=2, sort_keys=True)
+
+    directory = tempfile.mkdtemp(prefix='trust_check_benchmark')
+    try:
+        public_key_path = os.path.join(directory, 'hub_public_key.pem')
+        with open(public_key_path, 'w') as public_key_file:
+            public_key_file.write(fixtures['public_key'])
+
+        results = []
+        for function, case, call, check in cases(fixtures, asset_tag_utils,
+                                                 saml_utils,
+                                                 public_key_path):
+            if not check(call()):
+                sys.exit('%s returned an unexpected result on %s'
+                         % (function, case))
+            result = measure(call, args.number)
+            result.update({'function': function, 'case': case})
+            results.append(result)
+            print('%-22s %-14s best %9.3f us  median %9.3f us  peak %s B'
+                  % (function, case, result['best_us'], result['median_us'],
+                     result['peak_bytes']),
+                  file=sys.stderr)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    document = {'python': platform.python_version(),
+                'jwt': jwt.__version__,
+                'fixtures': args.fixtures,
+                'fleet': args.fleet,
+                'number': args.number,
+                'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(document, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""Per-request cost of TrustAssertionFilter at fleet scale.
+
+Builds N HostStates and a SQLite nova database whose hv_specs table holds
+an unsigned and a signed (RS256 JWT) trust report for every compute node,
+then runs TrustAssertionFilter.filter_all for boot requests with and
+without trust and asset tag policies. For every combination of fleet size,
+trust report path and signature verification it reports the p50/p99
+latency of a request, the SQL statements and the signature verifications
+per request, as a JSON document comparable across the 12.x and 13.x patch
+sets.
+
+Imports the installed nova, which has to be patched with one of the
+12.0.2, 12.0.4, 13.0.0 or 13.1.0 patch sets. The filter reads the hub
+public key with run_as_root, so --verification on needs to run as root.
+
+The fleets are built in a temporary SQLite database by fleet_common.py,
+or with --fleet read from the database of a fleet_generator.py directory,
+whose compute nodes are then the only fleet size.
+
+Usage:
+    python tools/benchmarks/trust_filter_benchmark.py
+        [--hosts 100,1000,10000] [--requests N]
+        [--paths sql,memory,trust_map] [--verification off,on]
+        [--fleet DIR] [--output FILE]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from fleet_common import create_compute_nodes
+from fleet_common import create_hvspecs
+from fleet_common import load_fleet
+from fleet_common import load_keys
+from fleet_common import node_country
+from fleet_common import node_trusted
+from fleet_common import write_config
+
+
+# Image properties of the boot requests, the tag selection being the
+# string literal set on the images
+POLICIES = (
+    ('no_trust', {}),
+    ('trust', {'trust': 'true'}),
+    ('trust_tags', {'trust': 'true', 'tags': "{'country': ['US']}"}),
+)
+
+
+class Image(object):
+
+    def __init__(self, properties):
+        self.properties = properties
+
+
+class Request(dict):
+    """Both the 12.x filter_properties and the 13.x RequestSpec."""
+
+    def __init__(self, properties):
+        super(Request, self).__init__(
+            request_spec={'image': {'properties': properties}})
+        self.image = Image(properties)
+
+
+def expected_hosts(hosts, policy):
+    """Number of compute nodes the filter has to pass."""
+    if 'trust' not in policy:
+        return hosts
+    passing = [node for node in range(1, hosts + 1) if node_trusted(node)]
+    if 'tags' in policy:
+        passing = [node for node in passing if node_country(node) == 'US']
+    return len(passing)
+
+
+def populate(engine, models, db, asset_tag_utils, admin, hosts, private_pem):
+    for table in ('hv_spec_tags', 'hv_specs', 'compute_nodes'):
+        engine.execute('DELETE FROM %s' % table)
+    create_compute_nodes(engine, models, hosts)
+    create_hvspecs(db, asset_tag_utils, admin, hosts, private_pem)
+
+
+def percentile(durations, percent):
+    ordered = sorted(durations)
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def make_filter(path, verification, cfg_override, modules):
+    trust_report_backend = modules['trust_report_backend']
+    cfg_override('signature_verification', verification)
+    cfg_override('trust_report_fanout', False)
+    cfg_override('trust_report_backend',
+                 'memory' if path == 'memory' else 'sql')
+    # The backend is shared by the process, created again for the path
+    trust_report_backend._BACKEND = None
+
+    host_filter = modules['asset_tag_filter'].TrustAssertionFilter()
+    if path == 'trust_map':
+        # Loaded from the database as the schedulers do at start, the
+        # fan-out itself is not started
+        host_filter.trust_map = modules['trust_report_rpc'].TrustMap()
+        host_filter.trust_map.reconcile()
+    return host_filter
+
+
+def run(host_filter, host_states, policy, requests, warmup, counters):
+    properties = dict(policy)
+    durations = []
+    statements = 0
+    verifications = 0
+    passed = None
+    for request in range(warmup + requests):
+        counters['statements'] = 0
+        counters['verifications'] = 0
+        start = time.time()
+        passed = len(list(host_filter.filter_all(host_states,
+                                                 Request(properties))))
+        duration = time.time() - start
+        if request < warmup:
+            continue
+        durations.append(duration)
+        statements += counters['statements']
+        verifications += counters['verifications']
+
+    return {'passed': passed,
+            'p50_ms': round(percentile(durations, 50) * 1000, 3),
+            'p99_ms': round(percentile(durations, 99) * 1000, 3),
+            'statements_per_request': float(statements) / requests,
+            'verifications_per_request': float(verifications) / requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--hosts', default='100,1000,10000',
+                        help='comma separated fleet sizes')
+    parser.add_argument('--requests', type=int, default=20,
+                        help='timed boot requests per policy')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='untimed boot requests run first')
+    parser.add_argument('--paths', default='sql,memory,trust_map',
+                        help='comma separated trust report paths: sql, '
+                             'memory (trust_report_backend) or trust_map '
+                             '(trust_report_fanout)')
+    parser.add_argument('--verification', default='off',
+                        help='comma separated signature_verification '
+                             'values, on verifies the signed reports')
+    parser.add_argument('--fleet',
+                        help='fleet_generator.py directory or fleet.json '
+                             'whose database is read instead of building '
+                             'the --hosts fleets')
+    parser.add_argument('--output', help='file the JSON is written to '
+                                         'instead of stdout')
+    args = parser.parse_args()
+
+    fleet = load_fleet(args.fleet) if args.fleet else None
+    if fleet:
+        fleet_sizes = [fleet['hosts']]
+    else:
+        fleet_sizes = [int(hosts) for hosts in args.hosts.split(',')]
+
+    directory = tempfile.mkdtemp(prefix='trust_filter_benchmark')
+    try:
+        if fleet:
+            url = fleet['url']
+            public_path = fleet['files']['hub_public_key']
+            config_file = write_config(directory, url, [
+                ('trusted_computing',
+                 [('trust_report_storage', fleet['storage'])])])
+        else:
+            url = 'sqlite:///%s' % os.path.join(directory, 'nova.sqlite')
+            config_file = write_config(directory, url)
+            private_pem, private_path, public_path = load_keys(directory)
+
+        from nova import config
+        config.parse_args([sys.argv[0], '--config-file', config_file],
+                          default_config_files=[])
+
+        from nova import context
+        from nova import db
+        from nova.db.sqlalchemy import api as db_api
+        from nova.db.sqlalchemy import models
+        from nova.openstack.common import asset_tag_utils
+        from nova.openstack.common import trust_report_backend
+        from nova.openstack.common import trust_report_rpc
+        from nova.scheduler.filters import asset_tag_filter
+        from nova.scheduler import host_manager
+        from nova import version
+        from oslo_config import cfg
+
+        conf = cfg.CONF
+        # Named attestation_hub_public_key by the 12.0.2 and 13.0.0 patches
+        for name in ('hub_public_key', 'attestation_hub_public_key'):
+            if name in conf.trusted_computing:
+                conf.set_override(name, public_path,
+                                  group='trusted_computing')
+
+        def cfg_override(name, value):
+            conf.set_override(name, value, group='trusted_computing')
+
+        modules = {'asset_tag_filter': asset_tag_filter,
+                   'trust_report_backend': trust_report_backend,
+                   'trust_report_rpc': trust_report_rpc}
+
+        engine = db_api.get_engine()
+        models.BASE.metadata.create_all(engine)
+
+        counters = {'statements': 0, 'verifications': 0}
+
+        def count_statement(*args):
+            counters['statements'] += 1
+
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+        admin = context.get_admin_context()
+        results = []
+        for hosts in fleet_sizes:
+            if not fleet:
+                populate(engine, models, db, asset_tag_utils, admin, hosts,
+                         private_pem)
+            host_states = []
+            for node in range(1, hosts + 1):
+                host_state = host_manager.HostState('compute-%d' % node,
+                                                    'compute-%d' % node)
+                host_state.hypervisor_hostname = 'compute-%d' % node
+                host_states.append(host_state)
+
+            for verification in args.verification.split(','):
+                for path in args.paths.split(','):
+                    host_filter = make_filter(path, verification,
+                                              cfg_override, modules)
+                    verify = host_filter.utils.verifySignature
+
+                    def counted_verify(signed_trust_report):
+                        counters['verifications'] += 1
+                        return verify(signed_trust_report)
+
+                    host_filter.utils.verifySignature = counted_verify
+
+                    for name, policy in POLICIES:
+                        result = run(host_filter, host_states, policy,
+                                     args.requests, args.warmup, counters)
+                        expected = expected_hosts(hosts, policy)
+                        if result['passed'] != expected:
+                            sys.exit('%d hosts, %s path, verification %s, '
+                                     '%s policy: %d hosts passed instead '
+                                     'of %d' % (hosts, path, verification,
+                                                name, result['passed'],
+                                                expected))
+                        result.update({'hosts': hosts,
+                                       'path': path,
+                                       'verification': verification,
+                                       'policy': name})
+                        results.append(result)
+                        print('%6d hosts %-9s verification %-3s %-10s '
+                              'p50 %9.3f ms  p99 %9.3f ms'
+                              % (hosts, path, verification, name,
+                                 result['p50_ms'], result['p99_ms']),
+                              file=sys.stderr)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    document = {'nova_version': version.version_string(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'requests': args.requests,
+                'fleet': args.fleet,
+                'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(document, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()